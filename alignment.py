@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+alignment.py（教師タイムラインへの位置合わせ）
+============================================================
+生徒の「動きの大きさ」の時系列と、教師プロファイルから作った
+同じ時系列（テンプレート）を FFT で相互相関し、
+  ・E01 開始時刻 t0（全体のずれ）
+  ・体操ごとの追加のずれ（任意）
+をミリ秒で求める。前奏のしきい値検出（detect_start_t0）の代わり。
+
+動きの大きさ = 0.5 秒ごとの 1 秒窓での 20 角度の振れ幅（range）の平均
+  → 教師プロファイルの f**_range 列の平均と同じ量
+     （教師ウィンドウ k は E 区間の開始 + k×0.5 秒）
+
+使い方（scoring_pipeline.py から）:
+  aligner = Aligner(profile, per_exercise=True)
+  al = aligner(angle20, ts)        # → Alignment
+  al.t0_ms, al.exercise_offsets_ms
+============================================================
+"""
+
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+from motion_features import sliding_windows
+from make_student_window_features import E_TIMES, WIN, HOP
+
+# 教師の特徴量は 30fps・30 フレーム窓・15 フレームずらし
+TEACHER_FPS = 30.0
+STEP_SEC = HOP / TEACHER_FPS   # 0.5 秒
+WIN_SEC = WIN / TEACHER_FPS    # 1.0 秒
+
+# 体操ごとのずれを探す範囲 [sec]（全体合わせの後の微調整）
+MAX_EXERCISE_SHIFT_SEC = 3.0
+
+Alignment = namedtuple("Alignment", ["t0_ms", "exercise_offsets_ms", "peak"])
+Alignment.__doc__ = """
+t0_ms               : 録画開始から E01 開始までの時間 [ms]
+exercise_offsets_ms : {eid: t0 からさらにずれている時間 [ms]}（per_exercise=False なら空）
+peak                : 相互相関のピーク値（1 に近いほどよく一致）
+"""
+
+
+# ============================================================
+# 動きの大きさ
+# ============================================================
+def _range_columns(columns):
+    return [i for i, c in enumerate(columns) if c.startswith("f") and c.endswith("_range")]
+
+
+def motion_energy(angle20, fps=TEACHER_FPS):
+    """
+    angle20: (T,20) 20角度
+    return : (n_steps,) STEP_SEC ごとの動きの大きさ（i 番目は i×STEP_SEC 秒から始まる窓）
+    """
+    win = max(2, int(round(WIN_SEC * fps)))
+    hop = max(1, int(round(STEP_SEC * fps)))
+    if len(angle20) < win:
+        return np.zeros(0)
+    A = sliding_windows(np.asarray(angle20, dtype=float), win, hop)   # (n,20,win)
+    with warnings.catch_warnings():
+        # 全フレーム NaN の窓（見失い）は 0 扱い
+        warnings.simplefilter("ignore", RuntimeWarning)
+        rng = np.nanmax(A, axis=-1) - np.nanmin(A, axis=-1)
+        energy = np.nanmean(rng, axis=-1)
+    return np.nan_to_num(energy)
+
+
+def teacher_energy_template(prof):
+    """
+    教師プロファイル → E01 開始 = 0 の STEP_SEC 刻みの動きの大きさ
+    return: (template (n_steps,), {eid: (開始 step, 終了 step)})
+    """
+    cols = _range_columns(prof.columns)
+    eids = [eid for eid in E_TIMES if prof.get(eid) is not None]
+
+    spans = {}
+    n = 0
+    for eid in eids:
+        k0 = int(round(E_TIMES[eid]["start"] / STEP_SEC))
+        spans[eid] = (k0, k0 + len(prof[eid]))
+        n = max(n, spans[eid][1])
+
+    total = np.zeros(n)
+    count = np.zeros(n)
+    for eid in eids:
+        k0, k1 = spans[eid]
+        total[k0:k1] += prof[eid][:, cols].mean(axis=1)
+        count[k0:k1] += 1
+
+    # 体操の切れ目で窓が無いところは前後から補間
+    has = count > 0
+    k = np.arange(n)
+    template = np.interp(k, k[has], total[has] / count[has])
+    return template, spans
+
+
+# ============================================================
+# 相互相関
+# ============================================================
+def _zscore(x):
+    sd = x.std()
+    return (x - x.mean()) / sd if sd > 0 else np.zeros_like(x)
+
+
+def xcorr_fft(signal, template):
+    """
+    c[L] = Σ_k template[k] × signal[k + L] を全ての L について FFT で計算（O(N log N)）
+    return: (c, lags)  lags = -(len(template)-1) 〜 len(signal)-1
+    """
+    n, m = len(signal), len(template)
+    size = 1 << int(np.ceil(np.log2(n + m - 1)))
+    c = np.fft.irfft(np.fft.rfft(signal, size) * np.conj(np.fft.rfft(template, size)), size)
+    c = np.concatenate([c[size - (m - 1):], c[:n]]) if m > 1 else c[:n]
+    return c, np.arange(-(m - 1), n)
+
+
+def _refine(c, i):
+    """ピーク位置を前後 3 点の放物線で小数まで求める"""
+    if 0 < i < len(c) - 1:
+        a, b, d = c[i - 1], c[i], c[i + 1]
+        den = a - 2 * b + d
+        if np.isfinite(den) and den < 0:
+            return i + 0.5 * (a - d) / den
+    return float(i)
+
+
+# ============================================================
+# 位置合わせ
+# ============================================================
+class Aligner:
+    """教師テンプレートを保持して、生徒ごとに t0（＋体操ごとのずれ）を求める"""
+
+    def __init__(self, prof, per_exercise=False, max_shift_sec=MAX_EXERCISE_SHIFT_SEC):
+        template, self.spans = teacher_energy_template(prof)
+        self.template = _zscore(template)
+        self.per_exercise = per_exercise
+        self.max_shift = int(round(max_shift_sec / STEP_SEC))
+
+    def __call__(self, angle20, ts):
+        fps = (len(ts) - 1) / (ts[-1] - ts[0]) if len(ts) > 1 and ts[-1] > ts[0] else TEACHER_FPS
+        s = motion_energy(angle20, fps)
+        t = self.template
+        if len(s) == 0 or len(t) == 0:
+            return Alignment(0.0, {}, 0.0)
+        s = _zscore(s)
+
+        # ---- 全体のずれ ----
+        c, lags = xcorr_fft(s, t)
+        # テンプレートの半分以上が録画と重なる範囲だけを探す
+        ok = (lags >= -(len(t) // 2)) & (lags <= len(s) - len(t) // 2)
+        c = np.where(ok, c, -np.inf)
+        i = int(np.argmax(c))
+        lag = lags[0] + _refine(c, i)
+        peak = float(c[i] / len(t))
+        t0_sec = float(ts[0]) + lag * STEP_SEC
+
+        # ---- 体操ごとのずれ（全体合わせの位置の前後 max_shift を探す。結果も ±max_shift 以内） ----
+        offsets = {}
+        if self.per_exercise:
+            D = self.max_shift
+            base = int(round(lag))
+            pad = np.concatenate([np.zeros(D), s, np.zeros(D + len(t))])
+            for eid, (k0, k1) in self.spans.items():
+                seg = t[k0:k1]
+                p = base + k0 + D                       # pad 上で d=0 のときの開始位置
+                if p - D < 0 or len(seg) < 2:
+                    continue
+                local = np.correlate(pad[p - D:p + D + len(seg)], seg, mode="valid")
+                j = int(np.argmax(local))
+                if j == 0 or j == len(local) - 1:
+                    # 探索範囲の端が最大 = 本当のピークは範囲の外（当てにならない）
+                    # → この体操は全体合わせの位置のまま
+                    offsets[eid] = 0.0
+                    continue
+                # 放物線補間と全体合わせの端数で範囲を少し超えることがあるので ±max_shift に収める
+                d = np.clip(_refine(local, j) - D + (base - lag), -D, D)
+                offsets[eid] = float(d * STEP_SEC * 1000.0)
+
+        return Alignment(t0_sec * 1000.0, offsets, peak)
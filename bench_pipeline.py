@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_pipeline.py（採点パイプラインの段階別ベンチマーク）
+============================================================
+synthetic_session.py の合成セッションを使って、1 セッション分の
+処理を段階ごとに計測する。
+
+  ingest_json   : JSON（旧クライアント形式）→ float32 配列
+  ingest_binary : landmark_codec 形式 → float32 配列
+  ingest_int16  : landmark_codec の int16 量子化形式 → float32 配列
+  angles        : 基本 8 角度 + 20 角度（全フレーム）
+  windows       : E01〜E13 の区間分け + 30 フレーム窓の切り出し
+  features      : 区間ごとの 83 次元特徴量（make_window_features）
+  scoring       : 教師プロファイルとの比較（score_features）
+  scoring_dtw   : 同上（DTW で対応付け、体操ごとの時間も記録）
+  save          : landmarks・特徴量・スコアを session_artifact.npz に保存（save_result）
+  render        : /result/<student_id> の描画（キャッシュ無し）
+
+あわせて DTW 対応付け（1 体操あたり）と録画中の即時スコア（1 ウィンドウあたり）の
+時間を測り、予算を超えたら表示する。
+
+※ 以前の「CSV 書き出し」段階は、結果を CSV ではなく session_artifact.npz に
+   保存するようになったので save に置き換えた（前回の JSON と比べるときは注意）
+※ 計算結果の一致（int16 量子化・前処理・float32 採点・逐次版の特徴量）は
+   ここでは確かめない。tests/ の pytest で許容差を決めて確かめる
+
+結果は JSON に保存し、--compare で前回の JSON と比べて
+遅くなった段階を表示する（閾値を超えたら終了コード 1）。
+
+使い方:
+  python bench_pipeline.py                         # 1 / 3.5 / 10 分
+  python bench_pipeline.py --minutes 1 --repeat 3
+  python bench_pipeline.py --out new.json --compare base.json
+============================================================
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import io
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from synthetic_session import make_session
+from landmark_codec import encode_landmarks, decode_landmarks
+from compute_20_angles import compute_20_angles
+from motion_features import sliding_windows
+from make_student_window_features import (
+    E_TIMES, WIN, HOP, segment_index, FEATURE_WORKERS, FEATURE_EXECUTOR,
+)
+from score_student_windows import score_features
+from dtw_matcher import match_windows, band_windows
+from scoring_pipeline import ScoringPipeline, save_result
+from live_feedback import LiveFeedback
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(BASE_DIR, "../data/bench")
+
+DEFAULT_MINUTES = [1.0, 3.5, 10.0]
+
+# この割合以上遅くなったら「遅くなった」とみなす
+REGRESSION_RATIO = 1.20
+
+# これより短い差（ms）は計測誤差として無視する
+MIN_DIFF_MS = 2.0
+
+# DTW 対応付けの 1 体操あたりの予算 [ms]
+DTW_BUDGET_MS = 5.0
+
+# 録画中の即時スコア（live_feedback）の 1 ウィンドウあたりの予算 [ms]
+LIVE_BUDGET_MS = 3.0
+
+
+# ============================================================
+# 計測
+# ============================================================
+def _timeit(fn, repeat):
+    """fn() を repeat 回実行して (秒のリスト, 最後の戻り値)"""
+    times = []
+    out = None
+    for _ in range(repeat):
+        # 各段階の print（検出結果など）は計測の邪魔なので捨てる
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            out = fn()
+            times.append(time.perf_counter() - t)
+    return times, out
+
+
+def _summary(times):
+    return {
+        "median_ms": float(np.median(times) * 1000),
+        "min_ms": float(np.min(times) * 1000),
+        "runs": len(times),
+    }
+
+
+def _render_app(results_dir):
+    """result_routes だけを載せた Flask アプリ（OpenAI クライアント不要）"""
+    from flask import Flask
+    import result_routes
+
+    result_routes.RESULTS_DIR = results_dir
+    app = Flask(__name__, template_folder=os.path.join(BASE_DIR, "web"),
+                static_folder=os.path.join(BASE_DIR, "static"))
+    app.secret_key = "bench"
+    app.register_blueprint(result_routes.result_bp)
+    return app, result_routes
+
+
+def bench_session(pipeline, minutes, fps, repeat, workdir):
+    landmarks = make_session(minutes, fps)
+    stages = {}
+
+    # --- 受信 ---
+    body_json = json.dumps({"frames": landmarks.tolist()})
+    times, _ = _timeit(
+        lambda: np.asarray(json.loads(body_json)["frames"], dtype=np.float32), repeat)
+    stages["ingest_json"] = _summary(times)
+
+    body_bin = encode_landmarks(landmarks, fps)
+    times, _ = _timeit(lambda: decode_landmarks(body_bin), repeat)
+    stages["ingest_binary"] = _summary(times)
+
+    body_q = encode_landmarks(landmarks, fps, quantize=True)
+    times, _ = _timeit(lambda: decode_landmarks(body_q), repeat)
+    stages["ingest_int16"] = _summary(times)
+
+    # --- 角度 ---
+    def angles():
+        P, angles8 = pipeline.prepare(landmarks)
+        return P, angles8, compute_20_angles(P)
+    times, (P, angles8, _) = _timeit(angles, repeat)
+    stages["angles"] = _summary(times)
+
+    # --- 区間分け + 窓 ---
+    ts = np.arange(len(P)) / fps
+
+    def windows():
+        angle20 = compute_20_angles(P).to_numpy() if pipeline.aligner is not None else None
+        t0, offsets = pipeline.align(angles8, ts, angle20)
+        t_norm = ts - t0
+        n = 0
+        for eid in E_TIMES:
+            idx = segment_index(t_norm - offsets.get(eid, 0.0), eid)
+            if len(idx) >= WIN:
+                n += len(sliding_windows(P[idx], WIN, HOP))
+        return n
+    times, n_windows = _timeit(windows, repeat)
+    stages["windows"] = _summary(times)
+
+    # --- 特徴量 ---
+    times, features = _timeit(lambda: pipeline.features(P, angles8, ts), repeat)
+    stages["features"] = _summary(times)
+
+    # --- 採点 ---
+    times, _ = _timeit(lambda: score_features(features, pipeline.profile), repeat)
+    stages["scoring"] = _summary(times)
+
+    times, _ = _timeit(lambda: score_features(features, pipeline.profile, "dtw"), repeat)
+    stages["scoring_dtw"] = _summary(times)
+    dtw_ms = bench_dtw(features, pipeline.profile, repeat)
+    live_ms = bench_live(pipeline, landmarks, fps)
+
+    # --- 保存 ---
+    sid = f"bench{int(minutes * 10):03d}"
+    student_dir = os.path.join(workdir, f"student_{sid}")
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = pipeline.score(features)
+    times, _ = _timeit(lambda: save_result(result, student_dir, landmarks, fps), repeat)
+    stages["save"] = _summary(times)
+
+    # --- 結果ページ描画（毎回キャッシュを捨てる） ---
+    app, result_routes = _render_app(workdir)
+    client = app.test_client()
+
+    def render():
+        result_routes._VIEW_CACHE.clear()
+        r = client.get(f"/result/{sid}")
+        assert r.status_code == 200, r.status_code
+    times, _ = _timeit(render, repeat)
+    stages["render"] = _summary(times)
+
+    stages["total"] = {
+        "median_ms": sum(s["median_ms"] for s in stages.values()),
+    }
+    return {
+        "minutes": minutes,
+        "fps": fps,
+        "frames": int(len(landmarks)),
+        "windows": int(n_windows),
+        "stages": stages,
+        "dtw_ms": dtw_ms,
+        "live_ms": live_ms,
+        "payload_bytes": {"json": len(body_json), "float32": len(body_bin), "int16": len(body_q)},
+    }
+
+
+def bench_dtw(features, prof, repeat):
+    """体操ごとの DTW 対応付けの時間 [ms]（DTW_BUDGET_MS を超えたら表示）"""
+    out = {}
+    for eid in sorted(features):
+        T = prof.get(eid)
+        if T is None or len(features[eid]) == 0:
+            continue
+        S = features[eid].values
+        times, _ = _timeit(lambda: match_windows(S, T, band_windows()), repeat)
+        out[eid] = float(np.median(times) * 1000)
+        if out[eid] > DTW_BUDGET_MS:
+            print(f"   ⚠ DTW {eid}: {out[eid]:.2f} ms（予算 {DTW_BUDGET_MS} ms 超え）")
+    return out
+
+
+def bench_live(pipeline, landmarks, fps):
+    """録画中と同じく HOP フレームずつ LiveFeedback に入れ、1 ウィンドウの時間 [ms] を測る"""
+    live = LiveFeedback(pipeline.profile, fps, pipeline.dtype)
+    times = []
+    for s in range(0, len(landmarks), HOP):
+        t = time.perf_counter()
+        events = live.push(landmarks[s:s + HOP])
+        if events:
+            times.append((time.perf_counter() - t) * 1000 / len(events))
+    if not times:
+        return {}
+    out = {"median_ms": float(np.median(times)), "max_ms": float(np.max(times)), "windows": len(times)}
+    if out["median_ms"] > LIVE_BUDGET_MS:
+        print(f"   ⚠ 即時スコア: {out['median_ms']:.2f} ms / ウィンドウ（予算 {LIVE_BUDGET_MS} ms 超え）")
+    return out
+
+
+# ============================================================
+# 実行環境の記録・比較
+# ============================================================
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _meta():
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "feature_workers": FEATURE_WORKERS,
+        "feature_executor": FEATURE_EXECUTOR,
+    }
+
+
+def _key(minutes):
+    return f"{minutes:g}min"
+
+
+def compare(curr, base, ratio=REGRESSION_RATIO):
+    """return: 遅くなった (セッション, 段階, 前回ms, 今回ms) のリスト"""
+    slower = []
+    print(f"\n📊 比較: {base['meta'].get('commit')} → {curr['meta'].get('commit')}")
+    for key, sess in curr["sessions"].items():
+        b = base["sessions"].get(key)
+        if b is None:
+            continue
+        print(f"--- {key} ---")
+        for stage, s in sess["stages"].items():
+            bs = b["stages"].get(stage)
+            if bs is None:
+                continue
+            r = s["median_ms"] / bs["median_ms"] if bs["median_ms"] > 0 else float("inf")
+            noticeable = abs(s["median_ms"] - bs["median_ms"]) >= MIN_DIFF_MS
+            mark = "  "
+            if noticeable and r > ratio:
+                mark = "🔺"
+            elif noticeable and r < 1 / ratio:
+                mark = "🔻"
+            print(f"  {mark} {stage:<14} {bs['median_ms']:10.1f} → {s['median_ms']:10.1f} ms  (x{r:.2f})")
+            if mark == "🔺" and stage != "total":
+                slower.append((key, stage, bs["median_ms"], s["median_ms"]))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="採点パイプラインの段階別ベンチマーク")
+    parser.add_argument("--minutes", type=float, nargs="+", default=DEFAULT_MINUTES)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", default=None, help="結果 JSON（既定: data/bench/bench_<日時>.json）")
+    parser.add_argument("--compare", default=None, help="比べる前回の結果 JSON")
+    parser.add_argument("--ratio", type=float, default=REGRESSION_RATIO)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline = ScoringPipeline()
+
+    report = {"meta": _meta(), "sessions": {}}
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for minutes in args.minutes:
+            print(f"⏱ {minutes:g} 分 ({args.repeat} 回)")
+            sess = bench_session(pipeline, minutes, args.fps, args.repeat, workdir)
+            report["sessions"][_key(minutes)] = sess
+            for stage, s in sess["stages"].items():
+                print(f"   {stage:<14} {s['median_ms']:10.1f} ms")
+            if sess["live_ms"]:
+                lm = sess["live_ms"]
+                print(f"   即時スコア: {lm['median_ms']:.2f} ms / ウィンドウ（最大 {lm['max_ms']:.2f} ms、"
+                      f"{lm['windows']} 個）/ 予算 {LIVE_BUDGET_MS} ms")
+            if sess["dtw_ms"]:
+                worst = max(sess["dtw_ms"], key=sess["dtw_ms"].get)
+                print(f"   DTW 最大 {worst}: {sess['dtw_ms'][worst]:.2f} ms / 予算 {DTW_BUDGET_MS} ms"
+                      f"（{len(sess['dtw_ms'])} 体操）")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out
+    if out is None:
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        out = os.path.join(BENCH_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 保存: {out}")
+
+    failed = False
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            base = json.load(f)
+        slower = compare(report, base, args.ratio)
+        if slower:
+            print(f"\n⚠ 遅くなった段階: {len(slower)} 件")
+            failed = True
+        else:
+            print("\n🎉 遅くなった段階はありません")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
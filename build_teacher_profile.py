@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+build_teacher_profile.py（教師プロファイル・時間モデルの作り直し）
+============================================================
+教師の録画（何本でも）から
+  teacher_profile_window_median.npz  … 体操ごとの (n_windows,83) 中央値
+  teacher_timing_model.json          … 体操ごとの平均開始・終了時刻（E01 開始 = 0）
+を作る。
+
+  ・録画は 1 本ずつ読み、生徒と同じ経路（20 角度 → 83 次元特徴量）で
+    ウィンドウ特徴量を作る
+  ・ウィンドウ k・特徴量 f ごとの中央値は P² アルゴリズム
+    （Jain & Chlamtac, 1985）で逐次に推定する
+    → 録画が何本あってもメモリは (ウィンドウ数 × 83 × (EXACT_MAX + 15)) のまま
+      （録画が EXACT_MAX 本以下なら厳密な中央値）
+  ・体操ごとのウィンドウ数は、半分以上の録画にあるウィンドウまで
+  ・開始・終了時刻は録画ごとに E01 開始を 0 にして平均
+
+入力:
+  --indir     <name>_landmarks.npz（norm, angles, ts）のフォルダ
+              （make_student_window_features.py の入力と同じ形式）
+  --segments  区間の CSV（録画内の時刻 [sec]）
+                recording,exercise_id,start_sec,end_sec
+                teacher01,E00,0.0,15.6
+                teacher01,E01,14.6,22.4
+                ...
+
+使い方:
+  python build_teacher_profile.py --indir teacher_landmarks \\
+                                  --segments teacher_segments.csv \\
+                                  --outdir new_profile
+============================================================
+"""
+
+import os
+import argparse
+from glob import glob
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from compute_20_angles import compute_20_angles
+from make_student_window_features import segment_features, WIN
+
+PROFILE_NAME = "teacher_profile_window_median.npz"
+TIMING_NAME = "teacher_timing_model.json"
+
+# 教師プロファイルに入れる体操（E00 = 前奏は時間モデルだけ）
+PROFILE_EXERCISES = [f"E{i:02d}" for i in range(1, 14)]
+
+
+# ============================================================
+# P² アルゴリズムによる中央値（セルごと、まとめて更新）
+# ============================================================
+# セルごとに最初の EXACT_MAX 個は観測をそのまま持ち（厳密な中央値）、
+# それを超えたら並べた観測から P² のマーカーを作って逐次推定に切り替える
+# （P² は観測が少ないうちは誤差が大きいため）
+EXACT_MAX = 32
+
+
+class P2Median:
+    """
+    n_cells 個の独立した系列の中央値を逐次推定する
+    セルごとに観測 EXACT_MAX 個分のバッファと 5 つのマーカー
+    （高さ q・位置 pos・目標位置 want）だけを持つ
+    セル数は grow() で後から増やせる（ウィンドウ数が録画で違うため）
+    """
+
+    P = 0.5
+    DWANT = np.array([0.0, P / 2, P, (1 + P) / 2, 1.0])
+
+    def __init__(self, n_cells=0, exact_max=EXACT_MAX):
+        self.exact_max = max(5, exact_max)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.buf = np.zeros((0, self.exact_max))
+        self.q = np.zeros((0, 5))
+        self.pos = np.zeros((0, 5))
+        self.want = np.zeros((0, 5))
+        self.grow(n_cells)
+
+    def __len__(self):
+        return len(self.count)
+
+    def grow(self, n_cells):
+        extra = n_cells - len(self)
+        if extra <= 0:
+            return
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.buf = np.vstack([self.buf, np.full((extra, self.exact_max), np.nan)])
+        self.q = np.vstack([self.q, np.full((extra, 5), np.nan)])
+        self.pos = np.vstack([self.pos, np.zeros((extra, 5))])
+        self.want = np.vstack([self.want, np.zeros((extra, 5))])
+
+    def update(self, values):
+        """values: (n,) セル 0..n-1 への新しい観測（NaN は無視）"""
+        values = np.asarray(values, dtype=float).ravel()
+        self.grow(len(values))
+        cells = np.nonzero(np.isfinite(values))[0]
+        x = values[cells]
+        c = self.count[cells]
+
+        # ---- EXACT_MAX 個まではそのまま溜める ----
+        init = c < self.exact_max
+        if init.any():
+            ci = cells[init]
+            self.buf[ci, c[init]] = x[init]
+            self.count[ci] += 1
+            self._start_markers(ci[self.count[ci] == self.exact_max])
+
+        upd = ~init
+        if upd.any():
+            self._step(cells[upd], x[upd])
+
+    def _start_markers(self, cells):
+        """溜めた観測の 0, 25, 50, 75, 100% 点を P² のマーカーにする"""
+        if len(cells) == 0:
+            return
+        n = self.exact_max
+        ranks = np.rint((n - 1) * np.array([0.0, 0.25, 0.5, 0.75, 1.0])).astype(int)
+        self.q[cells] = np.sort(self.buf[cells], axis=1)[:, ranks]
+        self.pos[cells] = ranks + 1.0
+        self.want[cells] = 1.0 + (n - 1) * self.DWANT
+
+    def _step(self, cells, x):
+        q, pos, want = self.q[cells], self.pos[cells], self.want[cells]
+        rows = np.arange(len(cells))
+
+        # ---- x が入る区間 k（端を超えたら端のマーカーを動かす） ----
+        q[:, 0] = np.minimum(q[:, 0], x)
+        q[:, 4] = np.maximum(q[:, 4], x)
+        k = np.clip((x[:, None] >= q[:, 1:4]).sum(axis=1), 0, 3)   # q[k] <= x < q[k+1]
+        pos += np.arange(5)[None, :] > k[:, None]
+        want += self.DWANT
+
+        # ---- 真ん中の 3 つのマーカーを目標位置へ 1 つずつ寄せる ----
+        for i in (1, 2, 3):
+            d = want[:, i] - pos[:, i]
+            move = ((d >= 1) & (pos[:, i + 1] - pos[:, i] > 1)) | \
+                   ((d <= -1) & (pos[:, i - 1] - pos[:, i] < -1))
+            if not move.any():
+                continue
+            r = rows[move]
+            s = np.sign(d[move])
+            qm, qi, qp = q[r, i - 1], q[r, i], q[r, i + 1]
+            nm, ni, np_ = pos[r, i - 1], pos[r, i], pos[r, i + 1]
+
+            # 放物線で補間、順番が崩れるなら直線
+            para = qi + s / (np_ - nm) * (
+                (ni - nm + s) * (qp - qi) / (np_ - ni) +
+                (np_ - ni - s) * (qi - qm) / (ni - nm)
+            )
+            q_nb = np.where(s > 0, qp, qm)
+            n_nb = np.where(s > 0, np_, nm)
+            lin = qi + s * (q_nb - qi) / (n_nb - ni)
+            q[r, i] = np.where((qm < para) & (para < qp), para, lin)
+            pos[r, i] += s
+
+        self.q[cells], self.pos[cells], self.want[cells] = q, pos, want
+        self.count[cells] += 1
+
+    def median(self):
+        """(n_cells,)（観測が無いセルは NaN）"""
+        out = np.full(len(self), np.nan)
+        # ちょうど EXACT_MAX 個のときはバッファに全部残っているので厳密な中央値
+        # （マーカーの q[2] は 1 つの順位の値で、個数が偶数だと真ん中 2 つの平均にならない）
+        big = self.count > self.exact_max
+        out[big] = self.q[big, 2]
+        small = (self.count > 0) & ~big
+        if small.any():
+            out[small] = np.nanmedian(self.buf[small], axis=1)
+        return out
+
+
+# ============================================================
+# 体操ごとの集計
+# ============================================================
+class ExerciseAccumulator:
+    """1 つの体操のウィンドウ特徴量の中央値（録画ごとにウィンドウ数が違ってよい）"""
+
+    def __init__(self, n_features):
+        self.n_features = n_features
+        self.median = P2Median()
+        self.rows_seen = np.zeros(0, dtype=np.int64)   # ウィンドウ k がある録画の数
+        self.n_recordings = 0
+
+    def add(self, X):
+        n = len(X)
+        if n > len(self.rows_seen):
+            self.rows_seen = np.concatenate([self.rows_seen, np.zeros(n - len(self.rows_seen), dtype=np.int64)])
+        self.rows_seen[:n] += 1
+        self.n_recordings += 1
+        self.median.update(X)
+
+    def profile(self):
+        """半分以上の録画にあるウィンドウまでの (n_windows,83)"""
+        n = int((2 * self.rows_seen >= self.n_recordings).sum())
+        return self.median.median()[: n * self.n_features].reshape(n, self.n_features)
+
+
+class TimingAccumulator:
+    """体操ごとの開始・終了時刻（E01 開始 = 0）の平均"""
+
+    def __init__(self):
+        self.sums = {}   # eid → [開始の合計, 終了の合計, 本数]
+
+    def add(self, segments):
+        """segments: {eid: (start_sec, end_sec)}（録画内の時刻）"""
+        t0 = segments["E01"][0]
+        for eid, (s, e) in segments.items():
+            acc = self.sums.setdefault(eid, [0.0, 0.0, 0])
+            acc[0] += s - t0
+            acc[1] += e - t0
+            acc[2] += 1
+
+    def table(self):
+        rows = [
+            {"exercise_id": eid, "mean_start_sec": s / n, "mean_end_sec": e / n}
+            for eid, (s, e, n) in sorted(self.sums.items())
+        ]
+        return pd.DataFrame(rows, columns=["exercise_id", "mean_start_sec", "mean_end_sec"])
+
+
+# ============================================================
+# 1 本ずつ読んで集計
+# ============================================================
+def read_segments(path):
+    """return: {recording: {eid: (start_sec, end_sec)}}"""
+    df = pd.read_csv(path, dtype={"recording": str})
+    out = {}
+    for row in df.itertuples(index=False):
+        out.setdefault(row.recording, {})[row.exercise_id] = (float(row.start_sec), float(row.end_sec))
+    return out
+
+
+def recording_features(P, ts, segments):
+    """
+    1 本分の録画 → {eid: (n_windows,83)}（生徒と同じ特徴量）
+    segments: {eid: (start_sec, end_sec)}
+    """
+    angle20 = compute_20_angles(P).to_numpy()
+    out = {}
+    for eid in PROFILE_EXERCISES:
+        if eid not in segments:
+            continue
+        s, e = segments[eid]
+        idx = np.where((ts >= s) & (ts < e))[0]
+        if len(idx) < WIN:
+            print(f"   ⚠ {eid}: フレーム不足 → スキップ")
+            continue
+        out[eid] = segment_features(P[idx], angle20[idx]).to_numpy()
+    return out
+
+
+def build_profile(files, segments_by_recording):
+    """
+    files: <name>_landmarks.npz のリスト（1 本ずつ読む）
+    return: ({eid: (n_windows,83) float32}, 時間モデルの DataFrame)
+    """
+    features = {}
+    timing = TimingAccumulator()
+
+    for path in tqdm(files):
+        name = os.path.basename(path)[: -len("_landmarks.npz")]
+        segments = segments_by_recording.get(name)
+        if segments is None or "E01" not in segments:
+            print(f"⚠ {name}: 区間が無い → スキップ")
+            continue
+
+        with np.load(path) as d:
+            P, ts = d["norm"], d["ts"]
+        timing.add(segments)
+        for eid, X in recording_features(P, ts, segments).items():
+            if eid not in features:
+                features[eid] = ExerciseAccumulator(X.shape[1])
+            features[eid].add(X)
+
+    profile = {eid: acc.profile().astype(np.float32) for eid, acc in sorted(features.items())}
+    return profile, timing.table()
+
+
+def save_profile(out_dir, profile, timing):
+    os.makedirs(out_dir, exist_ok=True)
+    profile_path = os.path.join(out_dir, PROFILE_NAME)
+    timing_path = os.path.join(out_dir, TIMING_NAME)
+    np.savez(profile_path, **profile)
+    timing.to_json(timing_path, orient="records", indent=2)
+    return profile_path, timing_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="教師の録画からプロファイルと時間モデルを作る")
+    parser.add_argument("--indir", required=True, help="<name>_landmarks.npz のフォルダ")
+    parser.add_argument("--segments", required=True, help="recording,exercise_id,start_sec,end_sec の CSV")
+    parser.add_argument("--outdir", required=True)
+    args = parser.parse_args()
+
+    files = sorted(glob(os.path.join(args.indir, "*_landmarks.npz")))
+    print(f"🔍 教師ランドマーク: {len(files)} 件")
+
+    profile, timing = build_profile(files, read_segments(args.segments))
+    for eid, mat in profile.items():
+        print(f"  {eid}: {mat.shape}")
+
+    profile_path, timing_path = save_profile(args.outdir, profile, timing)
+    print("\n🎉 教師プロファイル作成 完了！")
+    print(f"  📘 プロファイル: {profile_path}")
+    print(f"  ⏱ 時間モデル: {timing_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+chat_backend.py（/chat_api の GPT 呼び出し：ストリーミング・キャッシュ・同時実行数）
+============================================================
+chat_routes.py の /chat_api から使う。
+
+  ・返答はトークン（差分テキスト）ごとに stream_reply() から yield する
+    → chat_routes が text/event-stream でブラウザへ流す
+  ・同じ質問（正規化後の文面が同じ）への返答は CHAT_CACHE_TTL_SEC 秒キャッシュ
+    （件数は CHAT_CACHE_SIZE まで、古いものから捨てる）
+  ・同じ質問が生成中に届いたら API は呼ばず、生成中の返答に相乗りする
+    （先頭のトークンから同じものを受け取る）
+  ・API を同時に呼ぶ数は CHAT_MAX_CONCURRENCY まで。
+    空きを CHAT_QUEUE_TIMEOUT_SEC 秒待っても無ければ ChatBusy
+    （chat_routes が 503 + Retry-After を返す）
+  ・OpenAI クライアントはプロセスで 1 つ（HTTP の接続を使い回す）。
+    /voice_api の Whisper も同じクライアントを使う
+  ・CHAT_BACKEND=stub なら API を呼ばずに決まった返答を返す（オフライン確認用）
+
+環境変数:
+  CHAT_BACKEND            openai / stub（既定 openai）
+  CHAT_MODEL              既定 gpt-4o-mini
+  CHAT_CACHE_TTL_SEC      返答キャッシュの有効秒数（既定 3600、0 でキャッシュしない）
+  CHAT_CACHE_SIZE         返答キャッシュの件数（既定 256）
+  CHAT_MAX_CONCURRENCY    API を同時に呼ぶ数（既定 8）
+  CHAT_QUEUE_TIMEOUT_SEC  空きを待つ秒数（既定 10）
+  CHAT_TIMEOUT_SEC        API 呼び出しのタイムアウト（既定 60）
+  CHAT_STUB_DELAY_SEC     stub のトークン間隔（既定 0.02）
+============================================================
+"""
+
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import metrics
+
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "openai")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+CHAT_CACHE_TTL_SEC = float(os.getenv("CHAT_CACHE_TTL_SEC", "3600"))
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "256"))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "8"))
+CHAT_QUEUE_TIMEOUT_SEC = float(os.getenv("CHAT_QUEUE_TIMEOUT_SEC", "10"))
+CHAT_TIMEOUT_SEC = float(os.getenv("CHAT_TIMEOUT_SEC", "60"))
+CHAT_STUB_DELAY_SEC = float(os.getenv("CHAT_STUB_DELAY_SEC", "0.02"))
+
+BACKENDS = ("openai", "stub")
+
+SYSTEM_PROMPT = "あなたは優しい体操コーチAIです。"
+
+# 満杯時にクライアントへ伝える再送までの秒数
+RETRY_AFTER_SEC = 5
+
+
+class ChatBusy(Exception):
+    pass
+
+
+# ============================================================
+# 質問の正規化（キャッシュ・相乗りのキー）
+# ============================================================
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCT = re.compile(r"[?!.。、,！？…~〜\s]+$")
+
+
+def normalize_prompt(text):
+    """
+    全角/半角・大文字/小文字・空白・末尾の「？」「。」の違いを無視する
+      例: 「肩こりに効く体操は？」「肩こりに効く体操は?」「肩こりに効く体操は」→ 同じ
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = _SPACES.sub(" ", text).strip().lower()
+    return _TRAILING_PUNCT.sub("", text)
+
+
+# ============================================================
+# 返答キャッシュ（TTL + LRU）
+# ============================================================
+class ResponseCache:
+    def __init__(self, size=CHAT_CACHE_SIZE, ttl_sec=CHAT_CACHE_TTL_SEC):
+        self.size = size
+        self.ttl_sec = ttl_sec
+        self._items = OrderedDict()   # key → (期限, 返答)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is None:
+                return None
+            if hit[0] <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return hit[1]
+
+    def put(self, key, reply):
+        if self.ttl_sec <= 0 or self.size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_sec, reply)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+# ============================================================
+# バックエンド（トークンを yield する）
+# ============================================================
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_openai_client():
+    """
+    プロセスで 1 つの OpenAI クライアント（初回に作る）
+    接続プールの大きさを同時実行数に合わせ、keep-alive で接続を使い回す
+    """
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            import httpx
+            from openai import OpenAI, DefaultHttpxClient
+
+            # Whisper の分も考えて 1 本多めに持つ
+            n = CHAT_MAX_CONCURRENCY + 1
+            _CLIENT = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=CHAT_TIMEOUT_SEC,
+                http_client=DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=n, max_keepalive_connections=n),
+                    timeout=CHAT_TIMEOUT_SEC,
+                ),
+            )
+        return _CLIENT
+
+
+class OpenAIBackend:
+    name = "openai"
+
+    def __init__(self, model=CHAT_MODEL):
+        self.model = model
+
+    def stream(self, message):
+        response = get_openai_client().chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": message},
+            ],
+            stream=True,
+        )
+        try:
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            response.close()
+
+
+class StubBackend:
+    """API を呼ばずに質問に応じた決まった返答を返す（呼ばれた回数を数える）"""
+    name = "stub"
+
+    REPLIES = (
+        "いい質問ですね。無理のない範囲で、ゆっくり大きく体を動かしてみましょう。",
+        "ラジオ体操は毎日続けるのが大切です。まずは腕を回す運動から始めてみましょう。",
+        "痛みがあるときはお休みしてくださいね。体をねじる運動は呼吸を止めずに行いましょう。",
+    )
+
+    def __init__(self, delay_sec=CHAT_STUB_DELAY_SEC):
+        self.delay_sec = delay_sec
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def stream(self, message):
+        with self._lock:
+            self.calls += 1
+        reply = self.REPLIES[sum(map(ord, normalize_prompt(message))) % len(self.REPLIES)]
+        # 句読点ごとに区切って少しずつ返す
+        for token in re.findall(r"[^、。]+[、。]?", reply):
+            if self.delay_sec > 0:
+                time.sleep(self.delay_sec)
+            yield token
+
+
+def make_backend(name=CHAT_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"未対応の CHAT_BACKEND: {name}")
+    return StubBackend() if name == "stub" else OpenAIBackend()
+
+
+# ============================================================
+# 相乗り（同じ質問の生成を 1 回にまとめる）
+# ============================================================
+class _Flight:
+    """生成中の返答 1 つ分。生成はスレッドで行い、受け取る側は先頭から読む"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def append(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.chunks) > i or self.done)
+                new = self.chunks[i:]
+                done, error = self.done, self.error
+            yield from new
+            i += len(new)
+            if done and i == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class ChatService:
+    def __init__(self, backend=None, cache=None, max_concurrency=CHAT_MAX_CONCURRENCY,
+                 queue_timeout_sec=CHAT_QUEUE_TIMEOUT_SEC):
+        self.backend = backend or make_backend()
+        self.cache = cache if cache is not None else ResponseCache()
+        self.max_concurrency = max_concurrency
+        self.queue_timeout_sec = queue_timeout_sec
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._flights = {}   # key → 生成中の _Flight
+        self._lock = threading.Lock()
+
+    def stream_reply(self, message):
+        """
+        返答をトークンごとに yield する
+        （キャッシュにあれば 1 回で全部、API の空きが無ければ最初に ChatBusy）
+        """
+        key = normalize_prompt(message)
+        reply = self.cache.get(key)
+        if reply is not None:
+            metrics.count_chat("hit")
+            return iter((reply,))
+
+        with self._lock:
+            flight = self._flights.get(key)
+        if flight is not None:
+            metrics.count_chat("coalesced")
+            return iter(flight)
+
+        # 空きを待つ間は他の質問の相乗りを止めないようにロックの外で待つ
+        if not self._slots.acquire(timeout=self.queue_timeout_sec):
+            metrics.count_chat("busy")
+            raise ChatBusy(f"GPT の同時呼び出しが {self.max_concurrency} 件あります")
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            # 待っている間に同じ質問の生成が始まっていた
+            self._slots.release()
+            metrics.count_chat("coalesced")
+            return iter(flight)
+
+        metrics.count_chat("miss")
+        threading.Thread(target=self._generate, args=(key, message, flight), daemon=True).start()
+        return iter(flight)
+
+    def reply(self, message):
+        """返答全体を返す（JSON で返すとき用）"""
+        return "".join(self.stream_reply(message))
+
+    def _generate(self, key, message, flight):
+        """
+        ブラウザが途中で切断しても最後まで生成してキャッシュに入れる
+        （相乗りしている他の人のため）
+        """
+        t = time.perf_counter()
+        error = None
+        try:
+            with metrics.timer("chat"):
+                for i, chunk in enumerate(self.backend.stream(message)):
+                    if i == 0:
+                        metrics.observe_stage("chat_first_token", time.perf_counter() - t)
+                    flight.append(chunk)
+            self.cache.put(key, "".join(flight.chunks))
+        except Exception as e:
+            print("チャット生成エラー:", e)
+            error = e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                # 待っている人が先に終わりを知ってから枠を空ける
+                flight.finish(error)
+            self._slots.release()
+
+
+# ============================================================
+# プロセスで 1 つ
+# ============================================================
+_SERVICE = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_chat_service():
+    global _SERVICE
+    with _SERVICE_LOCK:
+        if _SERVICE is None:
+            _SERVICE = ChatService()
+        return _SERVICE
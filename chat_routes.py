@@ -1,16 +1,13 @@
 # chat_routes.py
 # GPTチャットページのルーティングとAPI処理を担当
 
-from openai import OpenAI
-import os
+import json
 import tempfile
-from flask import Blueprint, render_template, request, session, jsonify
+from flask import Blueprint, render_template, request, session, jsonify, Response
+from chat_backend import get_chat_service, get_openai_client, ChatBusy, RETRY_AFTER_SEC
 
 chat_bp = Blueprint("chat", __name__)
 
-# OpenAI クライアント（新SDK）
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # -------------------------------------------------------------
 # /chat 画面表示
 # -------------------------------------------------------------
@@ -22,6 +19,9 @@ def chat_page():
 
 # -------------------------------------------------------------
 # /chat_api  テキスト → GPT
+#   Accept: text/event-stream → 返答をトークンごとに流す
+#     data: {"delta": "..."} … → event: done（失敗時は event: error）
+#   それ以外（旧クライアント） → {"reply": "..."}
 # -------------------------------------------------------------
 @chat_bp.route("/chat_api", methods=["POST"])
 def chat_api():
@@ -32,21 +32,39 @@ def chat_api():
         if not user_message:
             return jsonify({"error": "メッセージが空です"}), 400
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "あなたは優しい体操コーチAIです。"},
-                {"role": "user", "content": user_message}
-            ]
-        )
+        chat = get_chat_service()
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            resp = Response(sse_reply(chat.stream_reply(user_message)), mimetype="text/event-stream")
+            resp.headers["Cache-Control"] = "no-cache"
+            resp.headers["X-Accel-Buffering"] = "no"   # プロキシでため込まない
+            return resp
 
-        reply = response.choices[0].message.content
+        reply = chat.reply(user_message)
         return jsonify({"reply": reply})
 
+    except ChatBusy as e:
+        print("チャット混雑:", e)
+        resp = jsonify({"error": "コーチが混み合っています。しばらくしてから送り直してください。"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(RETRY_AFTER_SEC)
+        return resp
+
     except Exception as e:
         print("チャットAPI エラー:", e)
         return jsonify({"error": str(e)}), 500
 
+
+def sse_reply(tokens):
+    """トークン → text/event-stream の行"""
+    try:
+        for delta in tokens:
+            yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        print("チャットAPI エラー:", e)
+        yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+        return
+    yield "event: done\ndata: {}\n\n"
+
 # -------------------------------------------------------------
 # /voice_api  音声 → テキスト（Whisper）
 # -------------------------------------------------------------
@@ -66,7 +84,7 @@ def voice_api():
         with tempfile.NamedTemporaryFile(suffix=".webm") as tmp:
             audio_file.save(tmp.name)
 
-            transcript = client.audio.transcriptions.create(
+            transcript = get_openai_client().audio.transcriptions.create(
                 file=open(tmp.name, "rb"),
                 model="whisper-1"
             )
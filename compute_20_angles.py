@@ -8,10 +8,31 @@ def angle_between(v1, v2):
     dot = np.clip(np.dot(v1, v2), -1.0, 1.0)
     return float(np.degrees(np.arccos(dot)))
 
+def _rowdot(v1, v2):
+    """
+    (...,3)·(...,3) → (...)
+    np.dot と同じ積和順になるよう matmul で計算（スカラー版と数値一致）
+    """
+    return (v1[..., None, :] @ v2[..., :, None])[..., 0, 0]
+
+def angle_between_batch(v1, v2):
+    """
+    angle_between のベクトル化版
+    v1, v2 : (...,3)（ブロードキャスト可）
+    return : (...) 角度[deg]（float32 の入力なら float32 のまま）
+    """
+    v1, v2 = np.asarray(v1), np.asarray(v2)
+    dtype = np.result_type(v1, v2, np.float32)
+    v1, v2 = np.broadcast_arrays(v1.astype(dtype, copy=False), v2.astype(dtype, copy=False))
+    v1 = v1 / (np.sqrt(_rowdot(v1, v1)) + 1e-6)[..., None]
+    v2 = v2 / (np.sqrt(_rowdot(v2, v2)) + 1e-6)[..., None]
+    dot = np.clip(_rowdot(v1, v2), -1.0, 1.0)
+    return np.degrees(np.arccos(dot))
+
 def compute_20_angles(coords):
     """
     coords : (T,33,3)
-    return : DataFrame (T,20)
+    return : DataFrame (T,20)（coords と同じ float の dtype）
     """
 
     # indices
@@ -22,52 +43,51 @@ def compute_20_angles(coords):
     L_KN = 25; R_KN = 26
     L_AN = 27; R_AN = 28
 
-    T = coords.shape[0]
-    rows = []
-
-    for t in range(T):
-        P = coords[t]
+    P = coords
 
-        # main segments
-        L_UP   = P[L_SH] - P[L_EL]
-        R_UP   = P[R_SH] - P[R_EL]
-        L_LOW  = P[L_EL] - P[L_WR]
-        R_LOW  = P[R_EL] - P[R_WR]
+    # main segments（全フレーム一括, 各 (T,3)）
+    L_UP   = P[:, L_SH] - P[:, L_EL]
+    R_UP   = P[:, R_SH] - P[:, R_EL]
+    L_LOW  = P[:, L_EL] - P[:, L_WR]
+    R_LOW  = P[:, R_EL] - P[:, R_WR]
 
-        L_THI  = P[L_HP] - P[L_KN]
-        R_THI  = P[R_HP] - P[R_KN]
-        L_CALF = P[L_KN] - P[L_AN]
-        R_CALF = P[R_KN] - P[R_AN]
+    L_THI  = P[:, L_HP] - P[:, L_KN]
+    R_THI  = P[:, R_HP] - P[:, R_KN]
+    L_CALF = P[:, L_KN] - P[:, L_AN]
+    R_CALF = P[:, R_KN] - P[:, R_AN]
 
-        TORSO  = P[L_SH] - P[L_HP]
+    TORSO  = P[:, L_SH] - P[:, L_HP]
 
-        vals = [
-            angle_between(L_UP,   TORSO),
-            angle_between(R_UP,   TORSO),
-            angle_between(L_LOW,  TORSO),
-            angle_between(R_LOW,  TORSO),
-            angle_between(L_THI,  TORSO),
-            angle_between(R_THI,  TORSO),
-            angle_between(L_CALF, TORSO),
-            angle_between(R_CALF, TORSO),
+    pairs = [
+        (L_UP,   TORSO),
+        (R_UP,   TORSO),
+        (L_LOW,  TORSO),
+        (R_LOW,  TORSO),
+        (L_THI,  TORSO),
+        (R_THI,  TORSO),
+        (L_CALF, TORSO),
+        (R_CALF, TORSO),
 
-            angle_between(L_UP,   L_LOW),
-            angle_between(R_UP,   R_LOW),
-            angle_between(L_THI,  L_CALF),
-            angle_between(R_THI,  R_CALF),
+        (L_UP,   L_LOW),
+        (R_UP,   R_LOW),
+        (L_THI,  L_CALF),
+        (R_THI,  R_CALF),
 
-            angle_between(L_UP,   L_THI),
-            angle_between(R_UP,   R_THI),
-            angle_between(L_LOW,  L_CALF),
-            angle_between(R_LOW,  R_CALF),
+        (L_UP,   L_THI),
+        (R_UP,   R_THI),
+        (L_LOW,  L_CALF),
+        (R_LOW,  R_CALF),
 
-            angle_between(P[L_SH] - P[L_HP],  P[L_EL] - P[L_KN]),
-            angle_between(P[R_SH] - P[R_HP],  P[R_EL] - P[R_KN]),
-            angle_between(P[L_HP] - P[L_KN],  P[L_KN] - P[L_AN]),
-            angle_between(P[R_HP] - P[R_KN],  P[R_KN] - P[R_AN]),
-        ]
+        (P[:, L_SH] - P[:, L_HP],  P[:, L_EL] - P[:, L_KN]),
+        (P[:, R_SH] - P[:, R_HP],  P[:, R_EL] - P[:, R_KN]),
+        (P[:, L_HP] - P[:, L_KN],  P[:, L_KN] - P[:, L_AN]),
+        (P[:, R_HP] - P[:, R_KN],  P[:, R_KN] - P[:, R_AN]),
+    ]
 
-        rows.append(vals)
+    # (T,20,3) × 2 → 20角度を一括計算
+    V1 = np.stack([a for a, _ in pairs], axis=1)
+    V2 = np.stack([b for _, b in pairs], axis=1)
+    vals = angle_between_batch(V1, V2)   # (T,20)
 
     cols = [f"angle20_{i:02d}" for i in range(20)]
-    return pd.DataFrame(rows, columns=cols)
+    return pd.DataFrame(vals, columns=cols)
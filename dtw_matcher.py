@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+dtw_matcher.py（教師・生徒ウィンドウの DTW 対応付け）
+============================================================
+score_student_windows は生徒ウィンドウ i を教師ウィンドウ i と比べるので、
+音楽より少し遅れて動く生徒は体操全体で減点されてしまう。
+
+ここでは (n_windows, 83) の特徴量列どうしを動的時間伸縮（DTW）で
+対応付ける。
+  ・Sakoe-Chiba バンド: 対角線（長さが違うときは斜めの線）から
+    ±band ウィンドウの範囲だけを見る → 計算量 O(N·band)
+  ・バンド内の距離はまとめて計算（(n, 2·band+1) の表）
+  ・戻り値の warping path から、生徒ウィンドウごとに
+    いちばん近い教師ウィンドウを 1 つ選ぶ
+============================================================
+"""
+
+import numpy as np
+
+# バンド幅 [sec]（ウィンドウは 0.5 秒ずらしなので 6 ウィンドウ）
+DTW_BAND_SEC = 3.0
+WINDOW_STEP_SEC = 0.5
+
+
+def band_windows(band_sec=DTW_BAND_SEC):
+    return max(1, int(round(band_sec / WINDOW_STEP_SEC)))
+
+
+def _band_columns(n, m, band):
+    """
+    生徒 i 行目で見る教師ウィンドウ j の表 (n, 2·band+1)
+    J[i, k] = lo[i] + k（範囲外は -1）
+    return: (J, lo)
+    """
+    center = np.zeros(n, dtype=int) if n == 1 else \
+        np.rint(np.arange(n) * (m - 1) / (n - 1)).astype(int)
+    lo = center - band
+    J = lo[:, None] + np.arange(2 * band + 1)[None, :]
+    J[(J < 0) | (J >= m)] = -1
+    return J, lo
+
+
+def band_distances(S, T, band):
+    """
+    バンド内の距離 ||S[i] - T[j]|| をまとめて計算
+    return: (J, lo, dist (n, 2·band+1))  範囲外・NaN は inf
+    """
+    n, m = len(S), len(T)
+    J, lo = _band_columns(n, m, band)
+    diff = S[:, None, :] - T[np.where(J >= 0, J, 0)]            # (n, B, 83)
+    # 行ごとの内積を matmul で取る（score_windows と同じ積和順）
+    dist = np.sqrt((diff[..., None, :] @ diff[..., :, None])[..., 0, 0])
+    dist[(J < 0) | np.isnan(dist)] = np.inf
+    return J, lo, dist
+
+
+def dtw_path(S, T, band):
+    """
+    S: (n,83) 生徒, T: (m,83) 教師
+    return: (path [(i, j), ...]（(0,0) → (n-1,m-1)）, 累積コスト)
+            バンド内に道が無ければ (None, inf)
+    """
+    J, lo, dist = band_distances(S, T, band)
+    return _warp(lo.tolist(), dist.tolist(), len(T))
+
+
+def _warp(lo, dist, m):
+    """
+    lo  : 各行のバンドの左端（教師 index）
+    dist: バンド上の距離（list of list, 範囲外は inf）
+    D[i][k] が (i, lo[i] + k) までの累積コスト。バンド外は inf 扱い
+    """
+    n, B = len(dist), len(dist[0])
+    inf = float("inf")
+
+    def at(D, i, j):
+        k = j - lo[i]
+        return D[i][k] if 0 <= k < B else inf
+
+    D = [[inf] * B for _ in range(n)]
+    for i in range(n):
+        row, d = D[i], dist[i]
+        for k in range(B):
+            if d[k] == inf:
+                continue
+            j = lo[i] + k
+            if i == 0 and j == 0:
+                row[k] = d[k]
+                continue
+            best = row[k - 1] if k > 0 else inf                   # 横 (i, j-1)
+            if i > 0:
+                best = min(best, at(D, i - 1, j), at(D, i - 1, j - 1))   # 縦・斜め
+            row[k] = d[k] + best
+
+    cost = at(D, n - 1, m - 1)
+    if cost == inf:
+        return None, inf
+
+    # ---- 終点から戻る ----
+    path = [(n - 1, m - 1)]
+    i, j = n - 1, m - 1
+    while (i, j) != (0, 0):
+        cands = []
+        if i > 0 and j > 0:
+            cands.append((at(D, i - 1, j - 1), i - 1, j - 1))
+        if i > 0:
+            cands.append((at(D, i - 1, j), i - 1, j))
+        if j > 0:
+            cands.append((at(D, i, j - 1), i, j - 1))
+        _, i, j = min(cands)
+        path.append((i, j))
+    path.reverse()
+    return path, cost
+
+
+def match_windows(S, T, band=None):
+    """
+    生徒ウィンドウごとに対応する教師ウィンドウを返す
+    return: (n,) の教師ウィンドウ index
+            DTW の道が無いとき（NaN だらけなど）は i 番目どうし（教師の長さで打ち切り）
+            → (min(n, m),)。生徒の先頭 len(戻り値) ウィンドウだけを使う
+              （教師の最後のウィンドウに寄せると、後ろの生徒ウィンドウの誤差が膨らむ）
+    """
+    n, m = len(S), len(T)
+    if band is None:
+        band = band_windows()
+
+    J, lo, dist = band_distances(S, T, max(band, 1))
+    path, _ = _warp(lo.tolist(), dist.tolist(), m)
+    if path is None:
+        return np.arange(min(n, m))
+
+    # 道の上で、生徒 i に対応する教師 j のうち距離がいちばん小さいもの
+    match = np.full(n, -1, dtype=int)
+    best = np.full(n, np.inf)
+    for i, j in path:
+        d = dist[i, j - lo[i]]
+        if match[i] < 0 or d < best[i]:
+            match[i], best[i] = j, d
+    return match
@@ -0,0 +1,288 @@
+# =============================================================
+# history_store.py
+#
+# 💡 ログインユーザーの採点履歴を SQLite に保存します。
+#
+#   - 1セッション分（E01〜E13 のスコア）を 1 トランザクションで追記
+#   - ユーザー×体操ごとの自己ベストは追記のたびに更新（再集計しない）
+#   - 再採点（rescore_sessions.py）ではスコアだけを書き換えて自己ベストを再集計
+#   - 旧形式 data/history/<user>_history.csv は初回に自動で取り込み
+#
+# 複数の gunicorn ワーカーから同時に書いても WAL + busy_timeout で
+# セッションが消えることはありません。
+# =============================================================
+
+import os
+import sqlite3
+import threading
+from glob import glob
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+DB_NAME = "history.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id     TEXT NOT NULL,
+    session_id  TEXT NOT NULL,
+    exercise    TEXT NOT NULL,
+    mean_score  REAL,
+    timestamp   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scores_user_session ON scores (user_id, session_id);
+CREATE INDEX IF NOT EXISTS idx_scores_user_exercise ON scores (user_id, exercise, timestamp);
+
+CREATE TABLE IF NOT EXISTS best_scores (
+    user_id     TEXT NOT NULL,
+    exercise    TEXT NOT NULL,
+    best_score  REAL NOT NULL,
+    PRIMARY KEY (user_id, exercise)
+);
+
+CREATE TABLE IF NOT EXISTS csv_migrations (
+    user_id     TEXT PRIMARY KEY,
+    source      TEXT NOT NULL,
+    migrated_at TEXT NOT NULL
+);
+"""
+
+
+class HistoryStore:
+    def __init__(self, history_dir):
+        self.history_dir = history_dir
+        os.makedirs(history_dir, exist_ok=True)
+        self.db_path = os.path.join(history_dir, DB_NAME)
+
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # 接続はスレッドをまたがないよう操作ごとに開く（with を抜けたら commit して閉じる）
+        con = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            con.execute("PRAGMA busy_timeout=30000")
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    # ---------------------------------------------------------
+    # 書き込み
+    # ---------------------------------------------------------
+    def add_session(self, user_id, session_id, scores, timestamp=None):
+        """
+        scores: [(exercise, mean_score), ...]
+        """
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        with self._connect() as con:
+            self._insert(con, user_id, session_id, scores, timestamp)
+
+    def _insert(self, con, user_id, session_id, scores, timestamp):
+        rows = [(user_id, session_id, ex, _to_float(sc), timestamp) for ex, sc in scores]
+        con.executemany(
+            "INSERT INTO scores (user_id, session_id, exercise, mean_score, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        # 自己ベストを追記分だけで更新
+        con.executemany(
+            "INSERT INTO best_scores (user_id, exercise, best_score) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, exercise) "
+            "DO UPDATE SET best_score = MAX(best_score, excluded.best_score)",
+            [(u, ex, sc) for u, _, ex, sc, _ in rows if sc is not None],
+        )
+
+    def replace_sessions(self, sessions):
+        """
+        再採点したセッションのスコアを書き換える（並び順・日時はそのまま）
+        sessions: [(session_id, [(exercise, mean_score), ...]), ...]
+        return  : 書き換えたセッション数（履歴に無いゲストのセッションは数えない）
+        """
+        n = 0
+        users = set()
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            for session_id, scores in sessions:
+                row = con.execute(
+                    "SELECT user_id, timestamp FROM scores WHERE session_id = ? ORDER BY id LIMIT 1",
+                    (session_id,),
+                ).fetchone()
+                if row is None:
+                    continue
+                user_id, timestamp = row
+
+                # session_id は 6 桁なので、別ユーザーの同じ id（旧 CSV の取り込み等）は書き換えない
+                for ex, sc in scores:
+                    cur = con.execute(
+                        "UPDATE scores SET mean_score = ? "
+                        "WHERE user_id = ? AND session_id = ? AND exercise = ?",
+                        (_to_float(sc), user_id, session_id, ex),
+                    )
+                    if cur.rowcount == 0:
+                        con.execute(
+                            "INSERT INTO scores (user_id, session_id, exercise, mean_score, timestamp) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (user_id, session_id, ex, _to_float(sc), timestamp),
+                        )
+                users.add(user_id)
+                n += 1
+
+            # 点数が下がることもあるので、関係するユーザーの自己ベストは集計し直す
+            for user_id in users:
+                con.execute("DELETE FROM best_scores WHERE user_id = ?", (user_id,))
+                con.execute(
+                    "INSERT INTO best_scores (user_id, exercise, best_score) "
+                    "SELECT user_id, exercise, MAX(mean_score) FROM scores "
+                    "WHERE user_id = ? AND mean_score IS NOT NULL GROUP BY user_id, exercise",
+                    (user_id,),
+                )
+        return n
+
+    # ---------------------------------------------------------
+    # 読み出し
+    # ---------------------------------------------------------
+    def session_ids(self, user_id):
+        """このユーザーのセッション一覧（古い順）"""
+        with self._connect() as con:
+            cur = con.execute(
+                "SELECT session_id FROM scores WHERE user_id = ? "
+                "GROUP BY session_id ORDER BY MIN(id)",
+                (user_id,),
+            )
+            return [r[0] for r in cur]
+
+    def previous_session(self, user_id, session_id):
+        """session_id の 1 つ前のセッション（無ければ None）"""
+        with self._connect() as con:
+            cur = con.execute(
+                "SELECT MIN(id) FROM scores WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id),
+            )
+            first_id = cur.fetchone()[0]
+            if first_id is None:
+                return None
+            cur = con.execute(
+                "SELECT session_id FROM scores WHERE user_id = ? AND session_id != ? "
+                "GROUP BY session_id HAVING MIN(id) < ? ORDER BY MIN(id) DESC LIMIT 1",
+                (user_id, session_id, first_id),
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def has_session(self, user_id, session_id):
+        with self._connect() as con:
+            cur = con.execute(
+                "SELECT 1 FROM scores WHERE user_id = ? AND session_id = ? LIMIT 1",
+                (user_id, session_id),
+            )
+            return cur.fetchone() is not None
+
+    def session_scores(self, user_id, session_id):
+        """{exercise: mean_score}"""
+        with self._connect() as con:
+            cur = con.execute(
+                "SELECT exercise, mean_score FROM scores "
+                "WHERE user_id = ? AND session_id = ? ORDER BY id",
+                (user_id, session_id),
+            )
+            return {ex: sc for ex, sc in cur}
+
+    def best_scores(self, user_id):
+        """{exercise: best_score}"""
+        with self._connect() as con:
+            cur = con.execute(
+                "SELECT exercise, best_score FROM best_scores WHERE user_id = ?",
+                (user_id,),
+            )
+            return {ex: sc for ex, sc in cur}
+
+    # ---------------------------------------------------------
+    # 旧 CSV（<user>_history.csv）の取り込み
+    # ---------------------------------------------------------
+    def migrate_csv_dir(self):
+        """まだ取り込んでいない <user>_history.csv をすべて取り込む"""
+        n = 0
+        for path in sorted(glob(os.path.join(self.history_dir, "*_history.csv"))):
+            user_id = os.path.basename(path)[:-len("_history.csv")]
+            if self.migrate_csv(user_id, path):
+                n += 1
+        return n
+
+    def migrate_csv(self, user_id, path):
+        df = pd.read_csv(path, dtype={"session_id": str})
+        if "exercise" not in df.columns and "exercise_id" in df.columns:
+            df = df.rename(columns={"exercise_id": "exercise"})
+        if "mean_score" not in df.columns and "score" in df.columns:
+            df = df.rename(columns={"score": "mean_score"})
+        if "timestamp" not in df.columns:
+            df["timestamp"] = None
+        df = df.dropna(subset=["session_id"])
+
+        with self._connect() as con:
+            # 別ワーカーと同時に取り込まないよう先に書き込みロックを取る
+            con.execute("BEGIN IMMEDIATE")
+            done = con.execute(
+                "SELECT 1 FROM csv_migrations WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if done:
+                return False
+
+            # CSV の並び順（＝古い順）のままセッション単位で追記
+            for sid in df["session_id"].unique():
+                sub = df[df["session_id"] == sid]
+                self._insert(
+                    con, user_id, str(sid),
+                    list(zip(sub["exercise"], sub["mean_score"])),
+                    sub["timestamp"].iloc[0] if pd.notna(sub["timestamp"].iloc[0]) else None,
+                )
+
+            con.execute(
+                "INSERT INTO csv_migrations (user_id, source, migrated_at) VALUES (?, ?, ?)",
+                (user_id, path, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            )
+        print(f"📥 履歴CSVを取り込み: {path}")
+        return True
+
+
+def _to_float(x):
+    try:
+        x = float(x)
+    except (TypeError, ValueError):
+        return None
+    return None if x != x else x   # NaN → NULL
+
+
+# =============================================================
+# プロセス共通インスタンス（初回に旧 CSV を取り込む）
+# =============================================================
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_history_store(history_dir):
+    history_dir = os.path.abspath(history_dir)
+    with _STORES_LOCK:
+        store = _STORES.get(history_dir)
+        if store is None:
+            store = HistoryStore(history_dir)
+            store.migrate_csv_dir()
+            _STORES[history_dir] = store
+        return store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="<user>_history.csv を SQLite に取り込む")
+    parser.add_argument("--history-dir", required=True)
+    args = parser.parse_args()
+
+    n = HistoryStore(args.history_dir).migrate_csv_dir()
+    print(f"🎉 取り込み完了: {n} ユーザー")
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+incremental_scoring.py（録画中のチャンク逐次採点）
+============================================================
+index.js が数秒ごとに送る landmarks チャンクを溜めながら、
+  ・前奏検出（E01 開始 t0）
+  ・E01〜E13 の区間が揃ったものから順に 83次元特徴量
+を先に計算しておく。録画終了時は残りの区間と採点だけを行う。
+
+録画中の t0 は仮の値で、先頭からのフレームだけで決まる動き出し検出
+（detect_start_onset）が START_HOLD_SEC 続いた時点で置く。一括採点の
+detect_start_t0 / 相互相関（SCORING_ALIGNMENT=xcorr）は録画全体が無いと
+決まらないので、録画中には使えない。
+
+最終結果は一括採点（ScoringPipeline.run_landmarks）と同じになるように、
+終了時に全フレームで t0 / 体操ごとのずれを求め直し、フレーム範囲が
+変わった区間だけ特徴量を作り直す（仮の t0 がずれていた分は作り直しになる）。
+============================================================
+"""
+
+import threading
+import time
+import uuid
+import numpy as np
+
+import metrics
+from utils_pose import PoseBuffers
+from live_feedback import LiveFeedback
+from compute_20_angles import compute_20_angles
+from make_student_window_features import (
+    E_TIMES, WIN, segment_index, segment_features, detect_start_onset,
+)
+
+# 終了時の fps がこれ以上ずれていたら作り直す（相対誤差）
+FPS_TOLERANCE = 0.02
+
+# 最後のチャンクからこの秒数が過ぎたセッションは破棄
+SESSION_TTL_SEC = 15 * 60
+
+
+# ============================================================
+# 伸長するフレームバッファ（容量倍々で確保）
+# ============================================================
+class _FrameBuffer:
+    def __init__(self):
+        self._buf = None
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def append(self, x):
+        n = len(x)
+        if self._buf is None:
+            self._buf = np.empty((max(n, 256),) + x.shape[1:], dtype=x.dtype)
+        elif self._n + n > len(self._buf):
+            cap = max(len(self._buf) * 2, self._n + n)
+            grown = np.empty((cap,) + self._buf.shape[1:], dtype=self._buf.dtype)
+            grown[:self._n] = self._buf[:self._n]
+            self._buf = grown
+        self._buf[self._n:self._n + n] = x
+        self._n += n
+
+    def view(self):
+        if self._buf is None:
+            return np.empty((0,))
+        return self._buf[:self._n]
+
+
+# ============================================================
+# 1 録画分の逐次採点
+# ============================================================
+class IncrementalSession:
+    def __init__(self, pipeline, fps=30.0):
+        self.pipeline = pipeline
+        self.fps = float(fps)
+        self.raw = _FrameBuffer()       # (T,33,4) 保存用
+        self.P = _FrameBuffer()         # (T,33,3)
+        self.angles8 = _FrameBuffer()   # (T,8)
+        self.pose_buffers = PoseBuffers()   # 前処理の作業用（チャンクごとに使い回す）
+        self.live = LiveFeedback(pipeline.profile, fps, pipeline.dtype)   # 録画中の即時スコア（SSE）
+        self.t0 = None
+        self.offsets = {}               # eid → t0 からの追加のずれ [sec]（xcorr のみ）
+        self.features = {}              # eid → DataFrame（フレーム不足は None）
+        self.segments = {}              # eid → 特徴量を作ったフレーム範囲 (先頭, フレーム数)
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+
+    @property
+    def n_frames(self):
+        return len(self.P)
+
+    def add_frames(self, landmarks):
+        """チャンクを追加し、揃った区間の特徴量を計算する"""
+        landmarks = np.asarray(landmarks)
+        P, angles8 = self.pipeline.prepare(landmarks, self.pose_buffers)
+        self.raw.append(landmarks)
+        self.P.append(P)
+        self.angles8.append(angles8)
+        self.last_access = time.time()
+        self._update(final=False)
+
+    def done_exercises(self):
+        return [eid for eid, df in self.features.items() if df is not None]
+
+    # --------------------------------------------------------
+    # 区間ごとの特徴量
+    # --------------------------------------------------------
+    def _update(self, final):
+        T = self.n_frames
+        now = T / self.fps
+
+        if self.t0 is None:
+            if final:
+                self.t0, self.offsets = self._align()
+            else:
+                # 仮の t0（終了時に一括採点と同じ方法で求め直す）
+                self.t0 = detect_start_onset(self.angles8.view(), self.fps)
+                if self.t0 is None:
+                    return
+                print(f"   🔍 E01開始（仮）: {self.t0:.3f} sec（{now:.1f} sec 時点）")
+
+        P = self.P.view()
+        t_norm = np.arange(T) / self.fps - self.t0
+
+        for eid, se in E_TIMES.items():
+            if eid in self.features:
+                continue
+            off = self.offsets.get(eid, 0.0)
+            # 区間の終わりまでフレームが届いていなければ待つ
+            if not final and now < self.t0 + off + se["end"]:
+                continue
+
+            idx = segment_index(t_norm - off, eid)
+            self.segments[eid] = _frame_range(idx)
+            if len(idx) < WIN:
+                self.features[eid] = None
+                continue
+
+            L = P[idx]
+            self.features[eid] = segment_features(L, compute_20_angles(L).to_numpy())
+            metrics.count_windows(eid, len(self.features[eid]))
+
+    def _align(self):
+        """ここまでの全フレームで E01 開始（＋体操ごとのずれ）を求める"""
+        ts = np.arange(self.n_frames) / self.fps
+        angle20 = None
+        if self.pipeline.aligner is not None:
+            angle20 = compute_20_angles(self.P.view()).to_numpy()
+        return self.pipeline.align(self.angles8.view(), ts, angle20)
+
+    def needs_rebuild(self, fps):
+        """終了時の実測 fps が途中の fps と食い違っているか"""
+        return abs(fps - self.fps) > FPS_TOLERANCE * self.fps
+
+    def _drop_moved_segments(self):
+        """t0 / ずれ / fps を決め直したあと、フレーム範囲が変わった区間の特徴量を捨てる"""
+        t_norm = np.arange(self.n_frames) / self.fps - self.t0
+        moved = [
+            eid for eid in self.features
+            if _frame_range(segment_index(t_norm - self.offsets.get(eid, 0.0), eid)) != self.segments.get(eid)
+        ]
+        for eid in moved:
+            del self.features[eid]
+        if moved:
+            print(f"   ↺ 区間が変わった {len(moved)} 体操の特徴量を作り直します: {', '.join(moved)}")
+
+    def finish(self, fps=None):
+        """
+        残りの区間を計算して採点する
+        return: ScoringPipeline.score() と同じ dict
+        """
+        if fps is not None and self.needs_rebuild(fps):
+            print(f"   ↺ fps 更新 {self.fps:.2f} → {fps:.2f}")
+            self.fps = float(fps)
+
+        # 一括採点と同じく全フレームで求め直し、
+        # 仮の t0 からフレーム範囲が変わった体操だけ作り直す
+        self.t0, self.offsets = self._align()
+        self._drop_moved_segments()
+
+        self._update(final=True)
+
+        features = {eid: df for eid, df in self.features.items() if df is not None}
+        return self.pipeline.score(features)
+
+
+def _frame_range(idx):
+    """区間のフレーム index（連続）→ (先頭, フレーム数)"""
+    return (int(idx[0]) if len(idx) else -1, len(idx))
+
+
+# ============================================================
+# セッション置き場（プロセス内）
+# ============================================================
+class SessionStore:
+    """
+    session_id → IncrementalSession
+    gunicorn の同じワーカー内でのみ有効（別ワーカーに届いたチャンクは 404）
+    """
+
+    def __init__(self, ttl_sec=SESSION_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, pipeline, fps=30.0):
+        sid = uuid.uuid4().hex[:6]
+        with self._lock:
+            self._expire()
+            self._sessions[sid] = IncrementalSession(pipeline, fps)
+        return sid
+
+    def get(self, sid):
+        with self._lock:
+            self._expire()
+            return self._sessions.get(sid)
+
+    def pop(self, sid):
+        with self._lock:
+            sess = self._sessions.pop(sid, None)
+        if sess is not None:
+            sess.live.close()
+        return sess
+
+    def _expire(self):
+        limit = time.time() - self.ttl_sec
+        for sid in [s for s, sess in self._sessions.items() if sess.last_access < limit]:
+            self._sessions.pop(sid).live.close()
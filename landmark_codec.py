@@ -0,0 +1,126 @@
+# landmark_codec.py
+# /score_landmarks 用のバイナリ形式ランドマークの読み書き
+#
+# 形式（すべてリトルエンディアン）:
+#   ヘッダ 16 byte
+#     magic        4s   b"RTLM"
+#     version      u8   1
+#     dtype        u8   1 = float32, 2 = int16 量子化
+#     n_landmarks  u16  33
+#     n_frames     u32  T
+#     fps          f32  録画時のフレームレート
+#   本体（dtype = 1）
+#     float32 × T × n_landmarks × 4   （x, y, z, visibility の順）
+#   本体（dtype = 2）
+#     int16 × T × n_landmarks × 3     （x, y, z を QUANT_SCALE 倍して丸めた値）
+#     uint8 × T × n_landmarks         （visibility を 255 倍して丸めた値）
+#
+# 量子化の精度:
+#   x, y, z   : 1/8192 刻み、誤差 ≤ 1/16384 ≈ 6.1e-5（640px 幅で 0.04px）
+#               表せる範囲は ±32767/8192 ≈ ±4.0（外は端に丸める）
+#               -32768 は NaN（見失った点）
+#   visibility: 1/255 刻み、誤差 ≤ 1/510 ≈ 0.002（0〜1 の外は端に丸める）
+#   1 フレーム 33 点で 231 byte（float32 の 528 byte の約 0.44 倍）
+#
+# static/js/index.js の encodeLandmarks() と対になっている
+
+import struct
+import numpy as np
+
+MAGIC = b"RTLM"
+VERSION = 1
+
+DTYPE_FLOAT32 = 1
+DTYPE_INT16 = 2
+
+# 量子化: 座標 × QUANT_SCALE を int16 に、visibility × 255 を uint8 に
+QUANT_SCALE = 8192
+QUANT_NAN = -32768
+
+HEADER = struct.Struct("<4sBBHIf")
+CONTENT_TYPE = "application/octet-stream"
+
+N_CHANNELS = 4   # x, y, z, visibility
+N_LANDMARKS = 33  # MediaPipe Pose の点数（採点は 33 点の index を直接使う）
+
+
+def encode_landmarks(landmarks, fps=30.0, quantize=False):
+    """
+    landmarks: (T,33,4) → bytes
+    quantize=True なら int16 量子化形式（dtype = 2）
+    （サーバー側のテスト・ベンチマーク用。ブラウザは index.js で同じ形式を作る）
+    """
+    arr = np.ascontiguousarray(landmarks, dtype="<f4")
+    T, L, C = arr.shape
+    if C != N_CHANNELS:
+        raise ValueError(f"チャンネル数が {N_CHANNELS} ではありません: {C}")
+
+    if not quantize:
+        header = HEADER.pack(MAGIC, VERSION, DTYPE_FLOAT32, L, T, float(fps))
+        return header + arr.tobytes()
+
+    header = HEADER.pack(MAGIC, VERSION, DTYPE_INT16, L, T, float(fps))
+    q, v = quantize_landmarks(arr)
+    return header + q.tobytes() + v.tobytes()
+
+
+def decode_landmarks(body):
+    """
+    bytes → (landmarks (T,33,4) float32, fps)
+    不正な形式（点数が 33 でないものを含む）は ValueError
+    """
+    if len(body) < HEADER.size:
+        raise ValueError("ヘッダが短すぎます")
+
+    magic, version, dtype, L, T, fps = HEADER.unpack_from(body, 0)
+    if magic != MAGIC:
+        raise ValueError("magic が一致しません")
+    if version != VERSION:
+        raise ValueError(f"未対応のバージョン: {version}")
+    if dtype not in (DTYPE_FLOAT32, DTYPE_INT16):
+        raise ValueError(f"未対応の dtype: {dtype}")
+    if L != N_LANDMARKS:
+        raise ValueError(f"点数が {N_LANDMARKS} ではありません: {L}")
+    if not fps > 0:
+        raise ValueError(f"fps が不正です: {fps}")
+
+    n = T * L
+    if dtype == DTYPE_FLOAT32:
+        expected = HEADER.size + n * N_CHANNELS * 4
+    else:
+        expected = HEADER.size + n * 3 * 2 + n
+    if len(body) != expected:
+        raise ValueError(f"サイズ不一致: {len(body)} byte（期待値 {expected}）")
+
+    if dtype == DTYPE_FLOAT32:
+        arr = np.frombuffer(body, dtype="<f4", count=n * N_CHANNELS, offset=HEADER.size)
+        return arr.reshape(T, L, N_CHANNELS), float(fps)
+
+    q = np.frombuffer(body, dtype="<i2", count=n * 3, offset=HEADER.size).reshape(T, L, 3)
+    v = np.frombuffer(body, dtype=np.uint8, count=n, offset=HEADER.size + n * 3 * 2).reshape(T, L)
+    return dequantize_landmarks(q, v), float(fps)
+
+
+# ============================================================
+# 量子化（session_artifact.py の保存形式でも使う）
+# ============================================================
+def quantize_landmarks(landmarks):
+    """
+    (T,L,4) → (xyz int16 (T,L,3), visibility uint8 (T,L))
+    """
+    arr = np.asarray(landmarks, dtype=np.float32)
+    xyz = arr[..., :3]
+    q = np.clip(np.rint(xyz * QUANT_SCALE), -32767, 32767)
+    q = np.where(np.isnan(xyz), QUANT_NAN, q).astype("<i2")
+    v = np.clip(np.rint(np.nan_to_num(arr[..., 3]) * 255), 0, 255).astype(np.uint8)
+    return q, v
+
+
+def dequantize_landmarks(q, v):
+    """(xyz int16 (T,L,3), visibility uint8 (T,L)) → float32 (T,L,4)"""
+    T, L = v.shape
+    out = np.empty((T, L, N_CHANNELS), dtype=np.float32)
+    np.multiply(q, np.float32(1.0 / QUANT_SCALE), out=out[..., :3], casting="unsafe")
+    out[..., :3][q == QUANT_NAN] = np.nan
+    np.multiply(v, np.float32(1.0 / 255), out=out[..., 3], casting="unsafe")
+    return out
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+live_feedback.py（録画中のウィンドウごとの即時スコア）
+============================================================
+録画中に index.js から HOP フレームずつ届く landmarks チャンク
+（/score_session/<sid>/chunk。逐次採点と同じアップロード）を
+新しいフレームの分だけ 20角度にして motion_features.WindowFeatureStream に入れ、
+HOP フレームごとに
+  ・そのウィンドウの 83次元特徴量（累積和・単調デック・スライディング DFT を
+    届いた HOP フレームの分だけ進めるので O(HOP)。一括版とビット単位で同じ値）
+  ・同じ時刻の教師ウィンドウ（teacher_profile_window_median.npz）との距離 → スコア
+  ・いちばんずれている部位
+を計算してイベントとして溜める。server.py は溜まったイベントを
+Server-Sent Events（GET /score_session/<sid>/feedback）でブラウザへ流す。
+
+  ・1 ウィンドウ分の計算は 1 ms 未満
+    （bench_pipeline.py の live で確認。予算 LIVE_BUDGET_MS）
+  ・教師ウィンドウは E01 開始 t0 からの時刻で選ぶ。
+    t0 は逐次採点セッション（incremental_scoring）が決めたものを使い、
+    決まるまでは録画開始 = E01 開始とみなす
+  ・最終スコアには使わない（録画終了後の採点は今までどおり）
+
+環境変数:
+  LIVE_KEEPALIVE_SEC   イベントが無いときに SSE のコメント行を送る間隔（既定 15）
+  LIVE_EVENT_BACKLOG   再接続（Last-Event-ID）用に残しておくイベント数（既定 64）
+
+SSE は 1 本につき gunicorn のスレッドを 1 本使うので、
+クラス全員分のスレッド（--threads）を用意する。
+============================================================
+"""
+
+import os
+import json
+import threading
+from collections import deque
+
+import numpy as np
+
+import metrics
+from compute_20_angles import compute_20_angles
+from motion_features import WindowFeatureStream
+from make_student_window_features import E_TIMES, WIN, HOP
+from score_student_windows import score_windows, part_mean_abs_error
+
+LIVE_KEEPALIVE_SEC = float(os.getenv("LIVE_KEEPALIVE_SEC", "15"))
+LIVE_EVENT_BACKLOG = int(os.getenv("LIVE_EVENT_BACKLOG", "64"))
+
+
+class LiveFeedback:
+    """1 録画分の窓の特徴量ストリームとイベント置き場"""
+
+    def __init__(self, profile, fps=30.0, dtype=np.float64):
+        self.profile = profile
+        self.fps = float(fps)
+        self.dtype = dtype
+        self.stream = WindowFeatureStream(WIN, HOP)
+        self.seq = 0                    # 最後に出したイベントの番号
+        self.events = deque(maxlen=LIVE_EVENT_BACKLOG)
+        self.closed = False
+        self.lock = threading.Lock()        # push どうし（累積和・デック）
+        self.cond = threading.Condition()   # イベント置き場（SSE が待つ）
+
+    # --------------------------------------------------------
+    # フレーム投入
+    # --------------------------------------------------------
+    def push(self, landmarks, t0=None, offsets=None):
+        """
+        landmarks: (n,33,4) または (n,33,3) の生座標（届いた順）
+        t0       : E01 開始 [sec]（None なら 0 = 録画開始）
+        offsets  : {eid: t0 からの追加のずれ [sec]}
+        return   : 新しく出たイベントのリスト
+        """
+        xyz = np.asarray(landmarks)[..., :3].astype(self.dtype, copy=False)
+        new = []
+        with self.lock, metrics.timer("live"):
+            # 角度はフレームごとなので、新しいフレームの分だけ計算すればよい
+            angles = compute_20_angles(xyz).to_numpy()
+            pelvis = (xyz[:, 23] + xyz[:, 24]) / 2
+            for frame_end, vec in self.stream.push(angles, pelvis):
+                event = self._score_window(frame_end, vec, t0 or 0.0, offsets or {})
+                if event is not None:
+                    new.append(event)
+
+        if new:
+            with self.cond:
+                for event in new:
+                    self.seq += 1
+                    event["seq"] = self.seq
+                    self.events.append(event)
+                self.cond.notify_all()
+        return new
+
+    @property
+    def n(self):
+        """届いたフレーム数（録画開始から）"""
+        return self.stream.n
+
+    def _teacher_window(self, t_start, offsets):
+        """ウィンドウ開始時刻（録画開始から [sec]）→ (eid, 教師ウィンドウ index)（範囲外は None）"""
+        found = None
+        for eid, se in E_TIMES.items():
+            mat = self.profile.get(eid)
+            if mat is None or len(mat) == 0:
+                continue
+            t = t_start - offsets.get(eid, 0.0)
+            # 区間は 1 秒ずつ重なっているので、後ろの体操を優先
+            if se["start"] <= t < se["end"]:
+                k = int(round((t - se["start"]) * self.fps / HOP))
+                found = (eid, min(max(k, 0), len(mat) - 1))
+        return found
+
+    def _score_window(self, frame_end, vec, t0, offsets):
+        t_start = (frame_end - WIN) / self.fps - t0
+        match = self._teacher_window(t_start, offsets)
+        if match is None:
+            return None
+        eid, k = match
+
+        S = vec[None, :]
+        Tm = self.profile[eid][k:k + 1]
+        score = float(score_windows(S, Tm, self.profile.min_dist[eid])[0])
+
+        # 部位ごとの平均絶対誤差がいちばん大きい部位（NaN の部位は除く）
+        err = part_mean_abs_error(S, Tm, self.profile.parts, self.profile.part_matrix)
+        part = self.profile.parts[int(np.nanargmax(err))] if np.isfinite(err).any() else None
+
+        return {
+            "frame": frame_end,
+            "exercise": eid,
+            "window_index": k,
+            "score": round(score, 1) if np.isfinite(score) else None,
+            "part": part,
+        }
+
+    # --------------------------------------------------------
+    # SSE 側
+    # --------------------------------------------------------
+    def wait_events(self, after, timeout=LIVE_KEEPALIVE_SEC):
+        """
+        seq が after より大きいイベントを待つ
+        return: (イベントのリスト, 終了したか)（timeout までに何も無ければ空リスト）
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > after or self.closed, timeout)
+            return [e for e in self.events if e["seq"] > after], self.closed
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+def sse_stream(live, last_id=0, keepalive_sec=LIVE_KEEPALIVE_SEC):
+    """LiveFeedback → text/event-stream の行（close() されたら event: end で終わる）"""
+    yield "retry: 2000\n\n"
+    after = last_id
+    while True:
+        events, closed = live.wait_events(after, keepalive_sec)
+        for e in events:
+            after = e["seq"]
+            yield f"id: {e['seq']}\ndata: {json.dumps(e, ensure_ascii=False)}\n\n"
+        if closed and not events:
+            yield "event: end\ndata: {}\n\n"
+            return
+        if not events:
+            yield ": keepalive\n\n"
@@ -3,15 +3,32 @@
 """
 make_student_window_features.py（教師と完全一致版）
 ============================================================
-・前奏(E00)の自動検出
+・前奏(E00)の自動検出（--align xcorr で教師との相互相関による位置合わせ）
 ・E01開始を t=0 に正規化
 ・E01〜E13 を教師モデルの秒数で自動分割
 ・各Eについて 20角度 → 83次元特徴量を生成し保存
+  （全ウィンドウをストライドビューで一括計算）
 
-出力:
+出力（--format csv、既定）:
   data/student_window_features/E01/student_xxx_E01.csv
   data/student_window_features/E02/student_xxx_E02.csv
   ...
+出力（--format npz）:
+  data/student_window_features/student_xxx_features.npz（1 人 1 ファイル）
+
+--score-outdir を付けると、特徴量をメモリのまま採点して
+<score-outdir>/<name>/results_score/*.csv まで出す（CSV の読み直し無し）。
+特徴量の保存はバックグラウンドのスレッドで行い、次の人の計算と重ねる。
+
+環境変数:
+  FEATURE_WORKERS   E01〜E13 の特徴量を並列に計算する数（既定 1 = 順番に。
+                    3.5 分の録画でも特徴量は全体で数十 ms なので、Web では
+                    SCORING_WORKERS のジョブ単位の並列で足りる。バッチ処理を
+                    空いたコアで速くしたいときに上げる）
+  FEATURE_EXECUTOR  thread（既定）/ process
+                    gunicorn で 1 台を共有するときは
+                    FEATURE_WORKERS × Web ワーカー数 × SCORING_WORKERS が
+                    コア数を超えないように
 ============================================================
 """
 
@@ -20,20 +37,30 @@ import numpy as np
 import pandas as pd
 import argparse 
 import json
+import threading
+import multiprocessing
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from tqdm import tqdm
 
 from compute_20_angles import compute_20_angles   # ← DataFrame版を使用
-from motion_features import extract_features      # 83次元を返す
+from motion_features import extract_window_features, FEATURE_COLUMNS  # (n_windows,83) を返す
+from session_artifact import save_features
+import metrics
 
 
 # ====== 定数 ======
 WIN = 30
 HOP = 15
 
+FEATURE_WORKERS = int(os.getenv("FEATURE_WORKERS", "1"))
+FEATURE_EXECUTOR = os.getenv("FEATURE_EXECUTOR", "thread")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 # ====== 教師の時間モデル読み込み ======
-MODEL_JSON = "data/teacher_timing_model.json"
+MODEL_JSON = os.path.join(BASE_DIR, "data", "teacher_timing_model.json")
 with open(MODEL_JSON, "r") as f:
     E_TIMES_LIST = json.load(f)
 
@@ -48,7 +75,7 @@ E_TIMES = {
 
 
 # ====== 前奏検出 ======
-def detect_start_t0(angles8, fps=15):
+def detect_start_t0(angles8, fps=30):
     d = np.abs(np.diff(angles8, axis=0))
     speed = d.mean(axis=1)
     smooth = np.convolve(speed, np.ones(5)/5, mode="same")
@@ -57,74 +84,254 @@ def detect_start_t0(angles8, fps=15):
     return idx[0] / fps if len(idx) > 0 else 0.0
 
 
+# ---- 録画中の仮の t0（incremental_scoring 専用。一括採点では使わない） ----
+# 録画の先頭この秒数（前奏中でほぼ静止）の動きの大きさを基準にする
+START_BASELINE_SEC = 3.0
+# 基準の平均 + START_SIGMA × 標準偏差 を超えたら動いているとみなす
+START_SIGMA = 4.0
+# 動いている状態がこの秒数続いたら E01 開始として確定
+START_HOLD_SEC = 0.5
+# 動きの大きさ: START_LAG_SEC 秒前との角度差を START_SMOOTH_SEC 秒で平均
+START_LAG_SEC = 1 / 3
+START_SMOOTH_SEC = 0.5
+
+
+def detect_start_onset(angles8, fps=30):
+    """
+    前奏のあとの動き出し（E01 開始）を先頭からのフレームだけで求める
+    return: t0 [sec]（まだ確定できなければ None）
+
+    t0 は t0 + 約 1 秒までのフレームだけで決まるので、録画途中（チャンクごと）に
+    求めた t0 は、あとからフレームが増えても変わらない。
+    incremental_scoring が録画中の仮の t0 として使い、終了時には detect_start_t0
+    （一括採点と同じ全体のしきい値）で求め直す
+    """
+    lag = max(int(round(START_LAG_SEC * fps)), 1)
+    sw = max(int(round(START_SMOOTH_SEC * fps)), 1)
+    hold = max(int(round(START_HOLD_SEC * fps)), 1)
+    nb = int(round(START_BASELINE_SEC * fps))
+    if len(angles8) < nb + lag + sw + hold:
+        return None
+
+    # energy[i] はフレーム i〜i+lag+sw-1 の動き（valid なので端の扱いで値が変わらない）
+    d = np.abs(angles8[lag:] - angles8[:-lag]).mean(axis=1)
+    energy = np.convolve(d, np.ones(sw) / sw, mode="valid")
+
+    base = energy[:nb]
+    th = base.mean() + START_SIGMA * base.std()
+
+    # hold 個続けて th を超えた最初の位置
+    above = np.concatenate([[0], np.cumsum(energy > th)])
+    run = np.nonzero(above[hold:] - above[:-hold] == hold)[0]
+    run = run[run >= nb]
+    if len(run) == 0:
+        return None
+    # 窓の中央を動き出しの時刻とする
+    return (run[0] + (lag + sw) // 2) / fps
+
+
+def frame_rate(ts, default=30.0):
+    """時刻列 ts [sec] → fps"""
+    if len(ts) < 2 or ts[-1] <= ts[0]:
+        return default
+    return (len(ts) - 1) / (ts[-1] - ts[0])
+
+
+# ====== E01 開始時刻（＋体操ごとのずれ） ======
+def detect_alignment(angles8, ts, angle20=None, aligner=None):
+    """
+    aligner が無ければ前奏のしきい値検出、あれば教師との相互相関（alignment.Aligner）
+    return: (t0 [sec], {eid: t0 からの追加のずれ [sec]})
+    """
+    if aligner is None:
+        t0 = detect_start_t0(angles8, fps=frame_rate(ts))
+        print(f"   🔍 E01開始検出: {t0:.3f} sec")
+        return t0, {}
+
+    al = aligner(angle20, ts)
+    print(f"   🔍 E01開始検出（相互相関）: {al.t0_ms / 1000:.3f} sec（一致度 {al.peak:.2f}）")
+    return al.t0_ms / 1000.0, {eid: ms / 1000.0 for eid, ms in al.exercise_offsets_ms.items()}
+
+
 # ====== ウィンドウ作成 ======
 def create_windows(X, win=30, hop=15):
     T = X.shape[0]
     return [X[s:s+win] for s in range(0, T-win+1, hop)]
 
 
+# ====== 1人分の特徴量生成（メモリ上） ======
+@metrics.timer("features")
+def make_window_features(P, angles8, ts, aligner=None):
+    """
+    P      : (T,33,3) 正規化済み座標
+    angles8: (T,8)    基本角度（前奏検出用）
+    ts     : (T,)     各フレームの時刻 [sec]
+    aligner: alignment.Aligner（None なら前奏のしきい値検出）
+    return : {"E01": DataFrame(n_windows,83), ...}
+    """
+    # -------- ここが超重要！！教師と同じ DataFrame 20角度 --------
+    angle20_df = compute_20_angles(P)  # DataFrame (T,20)
+    angle20 = angle20_df.to_numpy()
+
+    # -------- E01 の最初の動き detect --------
+    t0, offsets = detect_alignment(angles8, ts, angle20, aligner)
+    t_norm = ts - t0
+
+    # -------- E01〜E13 の区間 --------
+    segments = []
+    for eid in E_TIMES:
+        idx = segment_index(t_norm - offsets.get(eid, 0.0), eid)
+
+        if len(idx) < WIN:
+            print(f"   ⚠ {eid}: フレーム不足 → スキップ")
+            continue
+
+        # ★ DataFrame → 行抽出 → NumPy化（教師と完全一致）
+        segments.append((eid, P[idx], angle20[idx]))
+
+    # -------- 区間ごとの特徴量（FEATURE_WORKERS > 1 なら並列、順番は E 番号順のまま） --------
+    features = {}
+    for (eid, _, _), df in zip(segments, map_segment_features(segments)):
+        features[eid] = df
+        metrics.count_windows(eid, len(df))
+
+    return features
+
+
+# ====== 区間ごとの特徴量を並列に ======
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _get_executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            if FEATURE_EXECUTOR == "process":
+                # スレッドを持つ Web プロセスを fork しないよう forkserver / spawn を使う
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _EXECUTOR = ProcessPoolExecutor(
+                    max_workers=FEATURE_WORKERS, mp_context=multiprocessing.get_context(method))
+            elif FEATURE_EXECUTOR == "thread":
+                # 角度・統計・FFT は numpy の中で GIL を離すのでスレッドでも重なる
+                _EXECUTOR = ThreadPoolExecutor(
+                    max_workers=FEATURE_WORKERS, thread_name_prefix="features")
+            else:
+                raise ValueError(f"未対応の FEATURE_EXECUTOR: {FEATURE_EXECUTOR}")
+        return _EXECUTOR
+
+
+def map_segment_features(segments):
+    """
+    segments: [(eid, L (T',33,3), A (T',20)), ...]
+    return  : segment_features の結果のリスト（segments と同じ順）
+    """
+    if FEATURE_WORKERS <= 1 or len(segments) <= 1:
+        return [segment_features(L, A) for _, L, A in segments]
+    _, Ls, As = zip(*segments)
+    return list(_get_executor().map(segment_features, Ls, As))
+
+
+# ====== E区間のフレーム index ======
+def segment_index(t_norm, eid):
+    """t_norm（E01開始=0 の時刻）のうち eid 区間に入るフレーム"""
+    s, e = E_TIMES[eid]["start"], E_TIMES[eid]["end"]
+    mask = (t_norm >= s) & (t_norm < e)
+    return np.where(mask)[0]
+
+
+# ====== E区間 → 83次元特徴量 ======
+def segment_features(L, A):
+    """
+    L: (T',33,3) 区間の座標
+    A: (T',20)   区間の20角度
+    全ウィンドウ × 83次元を一括計算（extract_features の結果と一致）
+    """
+    X = extract_window_features(L, A, WIN, HOP)
+    return pd.DataFrame(X, columns=FEATURE_COLUMNS)
+
+
+# ====== 特徴量CSV保存 ======
+def save_window_features(features, out_dir, name):
+    for eid, df in features.items():
+        out_e_dir = os.path.join(out_dir, eid)
+        os.makedirs(out_e_dir, exist_ok=True)
+
+        out_path = os.path.join(out_e_dir, f"{name}_{eid}.csv")
+        df.to_csv(out_path, index=False)
+
+        print(f"   ✔ {eid}: {len(df)} windows → {out_path}")
+
+
+def features_npz_path(out_dir, name):
+    return os.path.join(out_dir, f"{name}_features.npz")
+
+
+def save_window_features_npz(features, out_dir, name):
+    path = save_features(features_npz_path(out_dir, name), features)
+    print(f"   ✔ {len(features)} 体操 → {path}")
+    return path
+
+
 # ====== メイン処理 ======
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--indir", required=True)
-    parser.add_argument("--outdir", required=True)
+    parser.add_argument("--outdir", default=None,
+                        help="特徴量の保存先（省略時は保存しない。--score-outdir が必要）")
+    parser.add_argument("--format", choices=["csv", "npz"], default="csv",
+                        help="特徴量の保存形式（npz = 1 人 1 ファイル）")
+    parser.add_argument("--score-outdir", default=None,
+                        help="特徴量をメモリのまま採点して <score-outdir>/<name>/results_score に出す")
+    parser.add_argument("--align", choices=["threshold", "xcorr"], default="threshold",
+                        help="E01 開始の求め方（xcorr = 教師プロファイルとの相互相関）")
+    parser.add_argument("--per-exercise", action="store_true",
+                        help="xcorr のとき体操ごとのずれも合わせる")
+    parser.add_argument("--match", choices=["index", "dtw"], default="index",
+                        help="--score-outdir のときの教師ウィンドウとの対応付け")
     args = parser.parse_args()
 
+    if args.outdir is None and args.score_outdir is None:
+        parser.error("--outdir か --score-outdir のどちらかが必要です")
+
+    prof = None
+    if args.align == "xcorr" or args.score_outdir is not None:
+        from score_student_windows import load_teacher_profile, score_features, save_scores
+        prof = load_teacher_profile()
+
+    aligner = None
+    if args.align == "xcorr":
+        from alignment import Aligner
+        aligner = Aligner(prof, per_exercise=args.per_exercise)
+
     IN_DIR = args.indir
     OUT_DIR = args.outdir
-    os.makedirs(OUT_DIR, exist_ok=True)
+    if OUT_DIR is not None:
+        os.makedirs(OUT_DIR, exist_ok=True)
+    save = save_window_features_npz if args.format == "npz" else save_window_features
 
     files = sorted(glob(os.path.join(IN_DIR, "*_landmarks.npz")))
     print(f"🔍 生徒ランドマーク: {len(files)} 件")
 
-    for path in tqdm(files):
-        name = os.path.splitext(os.path.basename(path))[0].replace("_landmarks", "")
-        print(f"\n▶ {name} 処理中...")
-
-        d = np.load(path)
-        P = d["norm"]      # (T,33,3)
-        angles8 = d["angles"]
-        ts = d["ts"]
-
-        # -------- E01 の最初の動き detect --------
-        t0 = detect_start_t0(angles8)
-        t_norm = ts - t0
-        print(f"   🔍 E01開始検出: {t0:.3f} sec")
-
-        # -------- ここが超重要！！教師と同じ DataFrame 20角度 --------
-        angle20_df = compute_20_angles(P)  # DataFrame (T,20)
-
-        # -------- E01〜E13 ループ --------
-        for eid, se in E_TIMES.items():
-            s, e = se["start"], se["end"]
-
-            mask = (t_norm >= s) & (t_norm < e)
-            idx = np.where(mask)[0]
-
-            if len(idx) < WIN:
-                print(f"   ⚠ {eid}: フレーム不足 → スキップ")
-                continue
-
-            # ★ DataFrame → 行抽出 → NumPy化（教師と完全一致）
-            A = angle20_df.iloc[idx].to_numpy()   # (T',20)
-            L = P[idx]                            # (T',33,3)
-
-            wins_A = create_windows(A, WIN, HOP)
-            wins_L = create_windows(L, WIN, HOP)
-
-            rows = []
-            for wA, wL in zip(wins_A, wins_L):
-                rows.append(extract_features(wL, wA))
+    # 特徴量の保存は 1 本のスレッドで順番に（採点・次の人の計算を待たせない）
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending = []
+        for path in tqdm(files):
+            name = os.path.splitext(os.path.basename(path))[0].replace("_landmarks", "")
+            print(f"\n▶ {name} 処理中...")
 
-            df = pd.DataFrame(rows)
+            d = np.load(path)
+            features = make_window_features(d["norm"], d["angles"], d["ts"], aligner)
 
-            out_e_dir = os.path.join(OUT_DIR, eid)
-            os.makedirs(out_e_dir, exist_ok=True)
+            if OUT_DIR is not None:
+                pending.append(writer.submit(save, features, OUT_DIR, name))
 
-            out_path = os.path.join(out_e_dir, f"{name}_{eid}.csv")
-            df.to_csv(out_path, index=False)
+            if args.score_outdir is not None:
+                df_detail, df_summary, df_part = score_features(features, prof, args.match)
+                save_scores(os.path.join(args.score_outdir, name), df_detail, df_summary, df_part)
 
-            print(f"   ✔ {eid}: {len(df)} windows → {out_path}")
+        for f in pending:
+            f.result()   # 保存エラーはここで出す
 
     print("\n🎉 生徒ウィンドウ特徴量生成 完了！")
 
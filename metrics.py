@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+metrics.py（採点処理の計測 → Prometheus 形式）
+============================================================
+採点の各段階の処理時間・処理フレーム数・ウィンドウ数・失敗数を
+プロセス内に集計し、server.py の /metrics で Prometheus の
+テキスト形式として返す。
+
+  with metrics.timer("features"):        # 段階の時間（失敗も数える）
+      ...
+  metrics.count_frames(len(landmarks), "upload")
+  metrics.count_windows("E01", n)
+
+採点ジョブのワーカープロセスで記録した値は、capture() で溜めて
+ジョブの戻り値と一緒に Web プロセスへ返し、replay() で取り込む
+（scoring_jobs.py が自動で行う）。
+============================================================
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+PREFIX = "radio_taiso"
+
+# 段階の処理時間のバケット [sec]
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# ============================================================
+# 集計の入れ物
+# ============================================================
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, labels=(), value=1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def samples(self):
+        for labels, v in sorted(self._values.items()):
+            yield self.name, labels, v
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, labels=(), value=0.0):
+        self._values[labels] = float(value)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels → [bucket ごとの数..., +Inf の数, 合計]
+
+    def observe(self, labels=(), value=0.0):
+        v = self._values.get(labels)
+        if v is None:
+            v = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                v[i] += 1
+        v[-2] += 1
+        v[-1] += value
+
+    def samples(self):
+        for labels, v in sorted(self._values.items()):
+            for i, b in enumerate(self.buckets):
+                yield f"{self.name}_bucket", labels + (("le", _fmt(b)),), v[i]
+            yield f"{self.name}_bucket", labels + (("le", "+Inf"),), v[-2]
+            yield f"{self.name}_count", labels, v[-2]
+            yield f"{self.name}_sum", labels, v[-1]
+
+
+def _fmt(x):
+    return repr(float(x))
+
+
+# ============================================================
+# このプロセスの集計
+# ============================================================
+STAGE_SECONDS = Histogram(
+    f"{PREFIX}_stage_seconds", "採点の段階ごとの処理時間", ["stage"])
+STAGE_FAILURES = Counter(
+    f"{PREFIX}_stage_failures_total", "採点の段階ごとの失敗数", ["stage"])
+FRAMES = Counter(
+    f"{PREFIX}_frames_total", "受け取ったランドマークのフレーム数", ["source"])
+WINDOWS = Counter(
+    f"{PREFIX}_windows_total", "特徴量を計算したウィンドウ数", ["exercise"])
+QUEUE_DEPTH = Gauge(
+    f"{PREFIX}_scoring_queue_depth", "待ち＋実行中の採点ジョブ数")
+CHAT_REQUESTS = Counter(
+    f"{PREFIX}_chat_requests_total", "チャットの質問数（hit / coalesced / miss / busy）", ["result"])
+
+_METRICS = {m.name: m for m in (STAGE_SECONDS, STAGE_FAILURES, FRAMES, WINDOWS, QUEUE_DEPTH,
+                                CHAT_REQUESTS)}
+_LOCK = threading.Lock()
+
+# ワーカープロセスで capture() 中は、集計せずにここへ溜める
+_captured = None
+
+
+def _record(method, name, labels, value):
+    with _LOCK:
+        if _captured is not None:
+            _captured.append((method, name, labels, value))
+            return
+        getattr(_METRICS[name], method)(labels, value)
+
+
+# ============================================================
+# 記録
+# ============================================================
+def observe_stage(stage, seconds):
+    _record("observe", STAGE_SECONDS.name, (("stage", stage),), seconds)
+
+
+def count_failure(stage):
+    _record("inc", STAGE_FAILURES.name, (("stage", stage),), 1.0)
+
+
+def count_frames(n, source):
+    _record("inc", FRAMES.name, (("source", source),), float(n))
+
+
+def count_windows(exercise, n):
+    _record("inc", WINDOWS.name, (("exercise", exercise),), float(n))
+
+
+def set_queue_depth(n):
+    _record("set", QUEUE_DEPTH.name, (), float(n))
+
+
+def count_chat(result):
+    _record("inc", CHAT_REQUESTS.name, (("result", result),), 1.0)
+
+
+@contextmanager
+def timer(stage):
+    """with の中の処理時間を stage として記録（例外なら失敗数も +1）"""
+    t = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        count_failure(stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - t)
+
+
+# ============================================================
+# ワーカープロセス → Web プロセス
+# ============================================================
+@contextmanager
+def capture():
+    """
+    with の中で記録した値を集計せずにリストへ溜める
+    （ProcessPoolExecutor のワーカーは 1 度に 1 ジョブなのでプロセス全体で切り替える）
+    """
+    global _captured
+    events = []
+    with _LOCK:
+        _captured = events
+    try:
+        yield events
+    finally:
+        with _LOCK:
+            _captured = None
+
+
+def replay(events):
+    """capture() で溜めた値をこのプロセスの集計に足す"""
+    for method, name, labels, value in events:
+        _record(method, name, labels, value)
+
+
+# ============================================================
+# Prometheus テキスト形式
+# ============================================================
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def render():
+    lines = []
+    with _LOCK:
+        for m in _METRICS.values():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, v in m.samples():
+                lines.append(f"{name}{_labels(labels)} {_fmt(v)}")
+    return "\n".join(lines) + "\n"
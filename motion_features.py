@@ -4,9 +4,14 @@
 # 20角度×4統計＝83次元モデルの最終特徴量を作るためのファイル
 # ================================================================
 
+from collections import deque
+
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy.signal import find_peaks
 
+from compute_20_angles import angle_between_batch
+
 # ---------------------------------------------------------------
 # 基本統計
 # ---------------------------------------------------------------
@@ -45,76 +50,74 @@ def compute_20_angles(coords):
     return: (T,20) の角度行列
     """
 
-    T = coords.shape[0]
-    vals = []
+    P = coords
 
     gravity = np.array([0, -1, 0], dtype=float)
     right_axis = np.array([1, 0, 0])
     forward_axis = np.array([0, 1, 0])
 
-    for t in range(T):
-        P = coords[t]
+    # 関節位置（全フレーム一括, 各 (T,3)）
+    L_SHO, R_SHO = P[:, 11], P[:, 12]
+    L_ELB, R_ELB = P[:, 13], P[:, 14]
+    L_WRI, R_WRI = P[:, 15], P[:, 16]
+    L_HIP, R_HIP = P[:, 23], P[:, 24]
+    L_KNE, R_KNE = P[:, 25], P[:, 26]
+    L_ANK, R_ANK = P[:, 27], P[:, 28]
 
-        # 関節位置
-        L_SHO, R_SHO = P[11], P[12]
-        L_ELB, R_ELB = P[13], P[14]
-        L_WRI, R_WRI = P[15], P[16]
-        L_HIP, R_HIP = P[23], P[24]
-        L_KNE, R_KNE = P[25], P[26]
-        L_ANK, R_ANK = P[27], P[28]
+    MID_SHO = (L_SHO + R_SHO) / 2
+    MID_HIP = (L_HIP + R_HIP) / 2
 
-        MID_SHO = (L_SHO + R_SHO) / 2
-        MID_HIP = (L_HIP + R_HIP) / 2
+    # ベクトル
+    TORSO = MID_SHO - MID_HIP
 
-        # ベクトル
-        TORSO = MID_SHO - MID_HIP
+    L_UP  = L_ELB - L_SHO
+    R_UP  = R_ELB - R_SHO
+    L_LOW = L_WRI - L_ELB
+    R_LOW = R_WRI - R_ELB
 
-        L_UP  = L_ELB - L_SHO
-        R_UP  = R_ELB - R_SHO
-        L_LOW = L_WRI - L_ELB
-        R_LOW = R_WRI - R_ELB
+    L_THI = L_KNE - L_HIP
+    R_THI = R_KNE - R_HIP
+    L_CALF = L_ANK - L_KNE
+    R_CALF = R_ANK - R_KNE
 
-        L_THI = L_KNE - L_HIP
-        R_THI = R_KNE - R_HIP
-        L_CALF = L_ANK - L_KNE
-        R_CALF = R_ANK - R_KNE
+    # 20角度
+    pairs = [
 
-        # 20角度
-        angles = [
+        # 腕 6本
+        (L_UP, -TORSO),   # shoulder_L
+        (R_UP, -TORSO),   # shoulder_R
+        (L_UP, L_LOW),    # elbow_L
+        (R_UP, R_LOW),    # elbow_R
+        (L_LOW, gravity), # wrist_L
+        (R_LOW, gravity), # wrist_R
 
-            # 腕 6本
-            angle_between(L_UP, -TORSO),   # shoulder_L
-            angle_between(R_UP, -TORSO),   # shoulder_R
-            angle_between(L_UP, L_LOW),    # elbow_L
-            angle_between(R_UP, R_LOW),    # elbow_R
-            angle_between(L_LOW, gravity), # wrist_L
-            angle_between(R_LOW, gravity), # wrist_R
+        # 脚 6本
+        (L_THI, TORSO),   # hip_L
+        (R_THI, TORSO),   # hip_R
+        (L_THI, L_CALF),  # knee_L
+        (R_THI, R_CALF),  # knee_R
+        (L_CALF, gravity),# ankle_L
+        (R_CALF, gravity),# ankle_R
 
-            # 脚 6本
-            angle_between(L_THI, TORSO),   # hip_L
-            angle_between(R_THI, TORSO),   # hip_R
-            angle_between(L_THI, L_CALF),  # knee_L
-            angle_between(R_THI, R_CALF),  # knee_R
-            angle_between(L_CALF, gravity),# ankle_L
-            angle_between(R_CALF, gravity),# ankle_R
+        # 体幹 4本
+        (TORSO, forward_axis), # torso_forward
+        (TORSO, right_axis),   # torso_side
 
-            # 体幹 4本
-            angle_between(TORSO, forward_axis), # torso_forward
-            angle_between(TORSO, right_axis),   # torso_side
+        (R_SHO - L_SHO, R_HIP - L_HIP), # twist_shoulder
+        (R_HIP - L_HIP, R_SHO - L_SHO), # twist_hip
 
-            angle_between(R_SHO - L_SHO, R_HIP - L_HIP), # twist_shoulder
-            angle_between(R_HIP - L_HIP, R_SHO - L_SHO), # twist_hip
+        # 開き 4本
+        (L_UP,  right_axis),  # arm_open_L
+        (R_UP, -right_axis),  # arm_open_R
+        (L_THI, right_axis),  # leg_open_L
+        (R_THI, -right_axis), # leg_open_R
+    ]
 
-            # 開き 4本
-            angle_between(L_UP,  right_axis),  # arm_open_L
-            angle_between(R_UP, -right_axis),  # arm_open_R
-            angle_between(L_THI, right_axis),  # leg_open_L
-            angle_between(R_THI, -right_axis), # leg_open_R
-        ]
+    # 定数軸は (T,3) にブロードキャストしてから (T,20,3) に積む
+    V1 = np.stack([np.broadcast_to(a, L_UP.shape) for a, _ in pairs], axis=1)
+    V2 = np.stack([np.broadcast_to(b, L_UP.shape) for _, b in pairs], axis=1)
 
-        vals.append(angles)
-
-    return np.array(vals)  # (T,20)
+    return angle_between_batch(V1, V2)  # (T,20)
 
 # ================================================================
 # 体幹3指標
@@ -160,3 +163,254 @@ def extract_features(norm_landmarks, angles):
     feats["symmetry"] = float(np.nanmean(np.abs(angles[:, 6] - angles[:, 7])))
 
     return feats
+
+
+# ================================================================
+# extract_window_features（全ウィンドウ一括版）
+# ================================================================
+STAT_NAMES = ["mean", "range", "var", "periodicity"]
+
+FEATURE_COLUMNS = [
+    f"f{i:02d}_{stat}" for i in range(20) for stat in STAT_NAMES
+] + ["trunk_range", "trunk_vel", "symmetry"]
+
+
+def sliding_windows(x, win, hop):
+    """
+    (T, ...) → (n_windows, ..., win)
+    時間軸をストライドビューで切り出し、最後の軸を連続メモリにする
+    （1ウィンドウずつ計算したときと同じ集計順になる）
+    """
+    view = sliding_window_view(x, win, axis=0)[::hop]
+    return np.ascontiguousarray(view)
+
+
+# ================================================================
+# 窓の統計（累積和 + 単調デック + スライディング DFT）
+#   一括版（extract_window_features）と逐次版（WindowFeatureStream）の共通部分
+#
+#   ・mean / var / symmetry / trunk_vel: フレームごとの量の累積和 P を float64 で持ち、
+#     窓 [s, e) の和を P[e] - P[s] で求める（個数も累積して NaN を除く）
+#   ・periodicity: x[t]·e^{-2πi·k·t/win} の累積和の差が、窓の rfft の k 番目と
+#     絶対値が同じ（位相 e^{2πi·k·s/win} がかかるだけ）ことを使う
+#   ・range: 一括版は窓ごとの nanmax - nanmin、逐次版は単調デック（どちらも丸め無し）
+#
+#   累積和はどちらも先頭フレームから同じ順に足すので、一括版と逐次版はビット単位で同じ。
+#   窓ごとに足し直す calc_mean / calc_var / calc_periodicity とは丸め誤差の範囲で違う
+# ================================================================
+N_ANGLES = 20
+
+# フレームごとの量の列（_frame_terms）
+_X, _X2, _XN = slice(0, 20), slice(20, 40), slice(40, 60)   # 角度・角度²・角度の個数
+_SYM, _SYMN = 60, 61                                         # |左股 - 右股|・個数
+_VEL, _VELN = 62, 63                                         # 骨盤の |速度|（3軸の和）・個数
+_DFT = 64                                                    # 以降 x·cos, x·sin (20,K) ずつ
+
+
+def _dft_table(win):
+    """k = 1..win//2 の cos / sin（フレーム番号 mod win ごと） → (win, K) ずつ"""
+    k = np.arange(1, win // 2 + 1)
+    phase = 2 * np.pi * ((np.arange(win)[:, None] * k[None, :]) % win) / win
+    return np.cos(phase), np.sin(phase)
+
+
+def _frame_terms(angles, pelvis, prev_pelvis, t0, table, last):
+    """
+    フレーム t0, t0+1, ... の累積和 → (n + 1, _DFT + 2·20·K) float64
+      0 行目 = last（フレーム t0 より前の和）、i 行目 = フレーム t0+i-1 までの和
+    prev_pelvis: フレーム t0-1 の骨盤位置（t0 = 0 なら None）
+    """
+    cos, sin = table
+    n, K = len(angles), cos.shape[1]
+    A = np.asarray(angles, dtype=np.float64)
+    ok = ~np.isnan(A)
+    X = np.where(ok, A, 0.0)
+
+    buf = np.empty((n + 1, _DFT + 2 * N_ANGLES * K))
+    buf[0] = last
+    out = buf[1:]
+    out[:, _X] = X
+    np.multiply(X, X, out=out[:, _X2])
+    out[:, _XN] = ok
+
+    sym = np.abs(A[:, 6] - A[:, 7])
+    sym_ok = ~np.isnan(sym)
+    out[:, _SYM] = np.where(sym_ok, sym, 0.0)
+    out[:, _SYMN] = sym_ok
+
+    Pv = np.asarray(pelvis, dtype=np.float64)
+    if prev_pelvis is not None:
+        Pv = np.concatenate([np.asarray(prev_pelvis, dtype=np.float64)[None], Pv])
+    d = np.abs(np.diff(Pv, axis=0))
+    d_ok = ~np.isnan(d)
+    d = np.where(d_ok, d, 0.0)
+    m = n - len(d)   # 先頭フレーム（前が無い）は 0
+    out[:m, _VEL:_VELN + 1] = 0.0
+    out[m:, _VEL] = d[:, 0] + d[:, 1] + d[:, 2]
+    out[m:, _VELN] = d_ok.sum(axis=1)
+
+    ph = (t0 + np.arange(n)) % len(cos)
+    dft = out[:, _DFT:].reshape(n, 2, N_ANGLES, K)
+    np.einsum("tc,tk->tck", X, cos[ph], out=dft[:, 0])    # 積だけ（和は取らない）
+    np.einsum("tc,tk->tck", X, sin[ph], out=dft[:, 1])
+
+    # 1 行ずつ順に足す（一括版・逐次版で足す順番をそろえる）
+    for i in range(1, n + 1):
+        np.add(buf[i - 1], buf[i], out=buf[i])
+    return buf
+
+
+def _stats_from_sums(D, vel, ranges, win):
+    """
+    D     : (n, C) 窓 [s, e) の和（P[e] - P[s]）
+    vel   : (n, 2) 骨盤の |速度| の和と個数（窓の 2 フレーム目から: P[e] - P[s+1]）
+    ranges: (n, 21) 20角度と骨盤 y の max - min
+    return: (n, 83) float64
+    """
+    n = len(D)
+    K = win // 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = D[:, _X] / D[:, _XN]
+        var = np.maximum(D[:, _X2] / D[:, _XN] - mean * mean, 0.0)
+        if win < 4:
+            periodicity = np.zeros((n, N_ANGLES))
+        else:
+            dft = D[:, _DFT:].reshape(n, 2, N_ANGLES, K)
+            mag = np.hypot(dft[:, 0], dft[:, 1])            # (n,20,K)
+            total = np.sum(mag, axis=-1)
+            peak = np.max(mag, axis=-1)
+            periodicity = np.where(total == 0, 0.0, peak / np.where(total == 0, 1.0, total))
+        trunk_vel = vel[:, 0] / vel[:, 1]
+        symmetry = D[:, _SYM] / D[:, _SYMN]
+
+    stats = np.stack([mean, ranges[:, :N_ANGLES], var, periodicity], axis=-1)   # (n,20,4)
+    return np.column_stack([stats.reshape(n, -1), ranges[:, N_ANGLES], trunk_vel, symmetry])
+
+
+# ================================================================
+# extract_window_features（全ウィンドウ一括版）
+# ================================================================
+def extract_window_features(norm_landmarks, angles, win=30, hop=15):
+    """
+    norm_landmarks: (T,33,3)
+    angles        : (T,20)
+    return        : (n_windows, 83)  列順は FEATURE_COLUMNS
+                    dtype は angles と同じ（集計は float64 で行い、最後に戻す）
+    extract_features を create_windows の各ウィンドウに適用した結果と同じ（丸め誤差の範囲）
+    """
+    T = angles.shape[0]
+    dtype = np.result_type(angles, np.float32)
+    if T < win:
+        return np.empty((0, len(FEATURE_COLUMNS)), dtype=dtype)
+
+    LEFT_HIP = 23
+    RIGHT_HIP = 24
+    pelvis = (norm_landmarks[:, LEFT_HIP, :] + norm_landmarks[:, RIGHT_HIP, :]) / 2
+
+    P = _frame_terms(angles, pelvis, None, 0, _dft_table(win), 0.0)   # P[t] = フレーム t より前の和
+    s = np.arange(0, T - win + 1, hop)
+    e = s + win
+    D = P[e] - P[s]
+    vel = P[e][:, [_VEL, _VELN]] - P[s + 1][:, [_VEL, _VELN]]
+
+    # range（max / min は丸めが無いので窓ごとに求めても逐次版と同じ）
+    W = sliding_windows(np.column_stack([angles, pelvis[:, 1]]), win, hop)   # (n,21,win)
+    ranges = (np.nanmax(W, axis=-1).astype(np.float64)
+              - np.nanmin(W, axis=-1).astype(np.float64))
+
+    return _stats_from_sums(D, vel, ranges, win).astype(dtype, copy=False)
+
+
+# ================================================================
+# 逐次版（録画中にフレームが届くたびに窓を 1 つずつ）
+#   累積和は直近 win + 1 フレーム分だけリングバッファに持ち、
+#   max / min は 20角度と骨盤 y の 21 本それぞれ単調デックで持つ
+#   → 新しい窓は届いた HOP フレームの分を足すだけで O(HOP)。
+#     extract_window_features と同じ窓（0, hop, 2·hop, ... フレーム目から）・
+#     ビット単位で同じ値（win が hop の倍数でなくてもよい）
+# ================================================================
+class WindowFeatureStream:
+    """
+    20角度と骨盤位置を届いた順に push し、窓が揃うたびに 83次元を返す
+
+      stream = WindowFeatureStream()
+      for frame_end, vec in stream.push(angles, pelvis):   # vec: (83,)
+          ...
+    """
+
+    def __init__(self, win=30, hop=15):
+        if win < 1 or hop < 1:
+            raise ValueError(f"win / hop は 1 以上にしてください: win={win}, hop={hop}")
+        self.win, self.hop = win, hop
+        self.n = 0                  # 届いたフレーム数
+        self.dtype = None           # 最初の push の dtype（extract_window_features と同じ）
+        self._table = _dft_table(win)
+        self._ring = None           # 累積和 P[t] を t % (win + 1) 行目に
+        self._last_pelvis = None
+        self._next_end = win        # 次の窓の終わり（フレーム数）
+        self._max = [deque() for _ in range(N_ANGLES + 1)]   # (フレーム番号, 値) 値は減少順
+        self._min = [deque() for _ in range(N_ANGLES + 1)]   # 値は増加順
+
+    def push(self, angles, pelvis):
+        """
+        angles: (n,20) 20角度, pelvis: (n,3) 骨盤中心（左右股関節の中点）
+        return: [(窓の終わりのフレーム数, (83,) の特徴量), ...]
+        """
+        if self.dtype is None:
+            self.dtype = np.result_type(angles, np.float32)
+            self._ring = np.zeros((self.win + 1, _DFT + 2 * N_ANGLES * (self.win // 2)))
+
+        out = []
+        i = 0
+        while i < len(angles):
+            # 次の窓の終わりまでずつ足す（1 回に足すのは最大 max(win, hop) フレーム）
+            k = min(len(angles) - i, self._next_end - self.n)
+            self._extend(angles[i:i + k], pelvis[i:i + k])
+            i += k
+            if self.n == self._next_end:
+                out.append((self.n, self._window()))
+                self._next_end += self.hop
+        return out
+
+    def _extend(self, angles, pelvis):
+        t0, R = self.n, len(self._ring)
+        rows = _frame_terms(angles, pelvis, self._last_pelvis, t0, self._table,
+                            self._ring[t0 % R])[1:]         # P[t0+1], ..., P[t0+k]
+        keep = min(len(rows), R)
+        self._ring[(t0 + 1 + np.arange(len(rows) - keep, len(rows))) % R] = rows[-keep:]
+        self._last_pelvis = np.asarray(pelvis[-1])
+        self.n += len(angles)
+
+        # 次の窓より前のフレーム（hop > win のとき）はデックに入れない
+        start = self._next_end - self.win
+        V = np.column_stack([angles, pelvis[:, 1]]).tolist()
+        for t, row in enumerate(V, t0):
+            if t < start:
+                continue
+            for c, v in enumerate(row):
+                if v != v:          # NaN は nanmax / nanmin と同じく無視
+                    continue
+                mx, mn = self._max[c], self._min[c]
+                while mx and mx[-1][1] <= v:
+                    mx.pop()
+                mx.append((t, v))
+                while mn and mn[-1][1] >= v:
+                    mn.pop()
+                mn.append((t, v))
+
+    def _window(self):
+        e, R = self.n, len(self._ring)
+        s = e - self.win
+        Pe, Ps = self._ring[e % R], self._ring[s % R]
+        D = (Pe - Ps)[None]
+        vel = (Pe[[_VEL, _VELN]] - self._ring[(s + 1) % R][[_VEL, _VELN]])[None]
+
+        ranges = np.empty((1, N_ANGLES + 1))
+        for c in range(N_ANGLES + 1):
+            mx, mn = self._max[c], self._min[c]
+            while mx and mx[0][0] < s:
+                mx.popleft()
+            while mn and mn[0][0] < s:
+                mn.popleft()
+            ranges[0, c] = mx[0][1] - mn[0][1] if mx else np.nan
+        return _stats_from_sums(D, vel, ranges, self.win)[0].astype(self.dtype, copy=False)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rescore_sessions.py（保存済みセッションの一括再採点）
+============================================================
+教師プロファイルや score_window の TOL / ALPHA を変えたあと、
+data/results/student_* の全セッションを採り直す。
+
+  ・session_artifact.npz に残っている特徴量から採点し直す
+    （--from-landmarks なら landmarks から特徴量も作り直す。
+      landmarks が整理済みのセッションは特徴量を使う。
+      artifact の landmarks は int16 量子化済みなので、作り直した特徴量は
+      保存時のものと少しずれる → 設定を変えずに実行してもスコアは完全には一致しない。
+      ずれの上限は session_artifact.py の説明を参照）
+  ・結果は scores_<version>.npz として元の結果の隣に保存
+    （結果ページは最新の scores_<version>.npz を表示する）
+  ・ログインユーザーの履歴（history_store）のスコアも書き換える
+  ・終わったセッションは data/rescore/<version>/done.txt に記録し、
+    中断しても同じ version でもう一度実行すれば続きから
+  ・採点はプロセスプール（--workers）で並列に行う
+
+version は教師プロファイルの中身・TOL・ALPHA・対応付け・dtype から自動で決まる
+（同じ設定なら同じ version → 続きから再開できる）。
+
+使い方:
+  python rescore_sessions.py
+  python rescore_sessions.py --workers 8 --match dtw
+  python rescore_sessions.py --from-landmarks --alignment xcorr
+  python rescore_sessions.py --version v2 --restart
+============================================================
+"""
+
+import os
+import io
+import math
+import sys
+import time
+import hashlib
+import argparse
+import contextlib
+import multiprocessing
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import score_student_windows
+from scoring_pipeline import (
+    ScoringPipeline, SCORING_ALIGNMENT, SCORING_ALIGN_PER_EXERCISE, SCORING_MATCH, SCORING_DTYPE, DTYPES,
+)
+from score_student_windows import resolve_profile_path
+from session_artifact import (
+    artifact_path, has_result, compact_legacy_dir,
+    load_features, load_landmarks, save_scores_version,
+)
+from history_store import get_history_store
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "../data")
+RESULTS_DIR = os.path.join(DATA_DIR, "results")
+HISTORY_DIR = os.path.join(DATA_DIR, "history")
+RESCORE_DIR = os.path.join(DATA_DIR, "rescore")
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# 何セッションごとに履歴とチェックポイントを書くか
+CHECKPOINT_EVERY = 200
+
+
+def scoring_version(profile_path, match, alignment=None, per_exercise=False, dtype=SCORING_DTYPE):
+    """採点設定（プロファイルの中身・TOL・ALPHA・対応付け・dtype）から決まる短い ID"""
+    h = hashlib.sha1()
+    with open(profile_path, "rb") as f:
+        h.update(f.read())
+    h.update(repr((score_student_windows.TOL, score_student_windows.ALPHA, match,
+                   alignment, per_exercise, dtype)).encode("utf-8"))
+    return h.hexdigest()[:10]
+
+
+# ============================================================
+# ワーカー側
+# ============================================================
+_PIPELINE = None
+
+
+def _init_worker(profile_path, alignment, per_exercise, match, dtype):
+    global _PIPELINE
+    _PIPELINE = ScoringPipeline(profile_path, alignment, per_exercise, match, dtype)
+
+
+def _rescore_one(student_dir, version, from_landmarks):
+    """
+    return: (session_id, [(exercise, mean_score), ...], エラー文 or None)
+    """
+    sid = os.path.basename(student_dir)[len("student_"):]
+    try:
+        # 採点の途中経過の print はここでは不要（数万件分になる）
+        with contextlib.redirect_stdout(io.StringIO()):
+            if not os.path.exists(artifact_path(student_dir)):
+                compact_legacy_dir(student_dir)
+            path = artifact_path(student_dir)
+
+            landmarks = None
+            if from_landmarks:
+                landmarks, fps = load_landmarks(path)
+            if landmarks is not None:
+                result = _PIPELINE.run_landmarks(landmarks, fps=fps if math.isfinite(fps) else 30.0)
+            else:
+                result = _PIPELINE.score(load_features(path))
+
+            save_scores_version(student_dir, version, result)
+        summary = result["summary"]
+        return sid, list(zip(summary["exercise"], summary["mean_score"])), None
+    except Exception as e:
+        return sid, None, str(e)
+
+
+# ============================================================
+# チェックポイント
+# ============================================================
+def _read_done(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def _flush(store, ckpt, batch):
+    """履歴を書き換えてから done.txt に追記（途中で落ちても履歴は取りこぼさない）"""
+    if not batch:
+        return 0
+    n = store.replace_sessions(batch)
+    ckpt.write("".join(f"{sid}\n" for sid, _ in batch))
+    ckpt.flush()
+    os.fsync(ckpt.fileno())
+    batch.clear()
+    return n
+
+
+# ============================================================
+# 一括再採点
+# ============================================================
+def rescore_all(results_dir=RESULTS_DIR, history_dir=HISTORY_DIR, rescore_dir=RESCORE_DIR,
+                workers=DEFAULT_WORKERS, version=None, profile_path=None,
+                alignment=SCORING_ALIGNMENT, per_exercise=SCORING_ALIGN_PER_EXERCISE,
+                match=SCORING_MATCH, from_landmarks=False, restart=False, dtype=SCORING_DTYPE):
+    """
+    return: {"version", "total", "skipped", "scored", "failed", "history"}
+    """
+    profile_path = resolve_profile_path(profile_path)
+    if version is None:
+        version = scoring_version(profile_path, match,
+                                  alignment if from_landmarks else None,
+                                  per_exercise if from_landmarks else False, dtype)
+
+    run_dir = os.path.join(rescore_dir, version)
+    os.makedirs(run_dir, exist_ok=True)
+    done_path = os.path.join(run_dir, "done.txt")
+    if restart and os.path.exists(done_path):
+        os.remove(done_path)
+    done = _read_done(done_path)
+
+    dirs = [d for d in sorted(glob(os.path.join(results_dir, "student_*")))
+            if os.path.isdir(d) and has_result(d)]
+    todo = [d for d in dirs if os.path.basename(d)[len("student_"):] not in done]
+    stats = {"version": version, "total": len(dirs), "skipped": len(dirs) - len(todo),
+             "scored": 0, "failed": 0, "history": 0}
+    print(f"🔁 再採点 {version}: {len(todo)} 件（済み {stats['skipped']} 件）")
+    if not todo:
+        return stats
+
+    store = get_history_store(history_dir)
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    executor = ProcessPoolExecutor(
+        max_workers=max(1, workers),
+        mp_context=multiprocessing.get_context(method),
+        initializer=_init_worker,
+        initargs=(profile_path, alignment, per_exercise, match, dtype),
+    )
+
+    started = time.perf_counter()
+    batch = []
+    with executor, open(done_path, "a", encoding="utf-8") as ckpt, \
+            open(os.path.join(run_dir, "errors.txt"), "a", encoding="utf-8") as errors:
+        chunksize = max(1, min(64, len(todo) // (4 * max(1, workers))))
+        results = executor.map(_rescore_one, todo, [version] * len(todo),
+                               [from_landmarks] * len(todo), chunksize=chunksize)
+        for i, (sid, scores, error) in enumerate(results, 1):
+            if error is not None:
+                stats["failed"] += 1
+                errors.write(f"{sid}\t{error}\n")
+                print(f"⚠ {sid}: {error}")
+            else:
+                stats["scored"] += 1
+                batch.append((sid, scores))
+
+            if len(batch) >= CHECKPOINT_EVERY:
+                stats["history"] += _flush(store, ckpt, batch)
+            if i % 1000 == 0:
+                rate = i / (time.perf_counter() - started)
+                print(f"   {i}/{len(todo)} 件（{rate:.0f} 件/秒）")
+        stats["history"] += _flush(store, ckpt, batch)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存済みセッションを一括で再採点する")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--history-dir", default=HISTORY_DIR)
+    parser.add_argument("--rescore-dir", default=RESCORE_DIR, help="チェックポイントの置き場所")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--profile", default=None, help="教師プロファイル npz（既定は採点と同じ）")
+    parser.add_argument("--version", default=None, help="結果の version（既定は採点設定から自動）")
+    parser.add_argument("--match", choices=["index", "dtw"], default=SCORING_MATCH)
+    parser.add_argument("--from-landmarks", action="store_true",
+                        help="landmarks から特徴量も作り直す（整理済みなら保存済み特徴量）。"
+                             "landmarks は int16 量子化済みの値")
+    parser.add_argument("--alignment", choices=["threshold", "xcorr"], default=SCORING_ALIGNMENT,
+                        help="--from-landmarks のときの E01 開始の求め方")
+    parser.add_argument("--per-exercise", action="store_true", default=SCORING_ALIGN_PER_EXERCISE)
+    parser.add_argument("--restart", action="store_true", help="チェックポイントを捨てて最初から")
+    parser.add_argument("--dtype", choices=DTYPES, default=SCORING_DTYPE,
+                        help="採点の dtype（既定は SCORING_DTYPE）")
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    stats = rescore_all(
+        args.results_dir, args.history_dir, args.rescore_dir, args.workers, args.version,
+        args.profile, args.alignment, args.per_exercise, args.match,
+        args.from_landmarks, args.restart, args.dtype,
+    )
+    print(f"🎉 再採点 {stats['version']}: 採点 {stats['scored']} / 失敗 {stats['failed']} / "
+          f"済み {stats['skipped']} / 履歴更新 {stats['history']}（{time.perf_counter() - t:.1f} 秒）")
+    sys.exit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+result_retention.py（data/results の整理）
+============================================================
+採点結果（スコア・特徴量）はずっと残し、容量の大半を占める
+生の landmarks だけを古いものから消す。
+
+  1. 旧形式（CSV だらけ）のフォルダを session_artifact.npz 1 つにまとめる
+  2. RESULT_LANDMARK_TTL_DAYS より古いセッションの landmarks を消す
+  3. それでも RESULTS_DISK_BUDGET_MB を超えていたら、古い順に landmarks を消す
+  4. 採点結果が無いまま TTL を過ぎたフォルダ（失敗したジョブ）を消す
+
+server.py は RETENTION_INTERVAL_SEC ごとにバックグラウンドのスレッドで実行する
+（gunicorn のワーカーが複数でもロックファイルで 1 つだけが動く）。
+
+環境変数:
+  RESULT_LANDMARK_TTL_DAYS  landmarks を残す日数（既定 14）
+  RESULTS_DISK_BUDGET_MB    data/results 全体の上限 [MB]（既定 1024）
+  RETENTION_INTERVAL_SEC    実行間隔 [sec]（既定 3600、0 なら実行しない）
+
+使い方（手動で 1 回だけ）:
+  python result_retention.py
+  python result_retention.py --ttl-days 7 --budget-mb 512
+============================================================
+"""
+
+import os
+import time
+import shutil
+import fcntl
+import argparse
+import threading
+from glob import glob
+
+import metrics
+from session_artifact import (
+    artifact_path, has_result, read_meta, strip_landmarks, compact_legacy_dir,
+)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, "../data/results")
+
+RESULT_LANDMARK_TTL_DAYS = float(os.getenv("RESULT_LANDMARK_TTL_DAYS", "14"))
+RESULTS_DISK_BUDGET_MB = float(os.getenv("RESULTS_DISK_BUDGET_MB", "1024"))
+RETENTION_INTERVAL_SEC = float(os.getenv("RETENTION_INTERVAL_SEC", "3600"))
+
+# 書き込み中かもしれないので、これより新しい旧形式フォルダはまとめない
+COMPACT_MIN_AGE_SEC = 10 * 60
+
+LOCK_NAME = ".retention.lock"
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _dir_mtime(path):
+    """フォルダ内でいちばん新しい更新時刻"""
+    latest = os.path.getmtime(path)
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(root, f)))
+            except FileNotFoundError:
+                pass
+    return latest
+
+
+# ============================================================
+# 1 回分の整理
+# ============================================================
+def run_retention(results_dir=RESULTS_DIR, ttl_days=RESULT_LANDMARK_TTL_DAYS,
+                  budget_mb=RESULTS_DISK_BUDGET_MB, now=None):
+    """
+    return: {"compacted", "stripped", "removed", "freed_bytes"}
+    """
+    now = time.time() if now is None else now
+    ttl_sec = ttl_days * 24 * 3600
+    stats = {"compacted": 0, "stripped": 0, "removed": 0, "freed_bytes": 0}
+
+    sessions = []   # (created_at, artifact のパス)（landmarks があるものだけ）
+    for student_dir in sorted(glob(os.path.join(results_dir, "student_*"))):
+        if not os.path.isdir(student_dir):
+            continue
+        try:
+            age = now - _dir_mtime(student_dir)
+
+            # ---- 旧形式 → 1 ファイル ----
+            if not os.path.exists(artifact_path(student_dir)) and has_result(student_dir):
+                if age < COMPACT_MIN_AGE_SEC:
+                    continue
+                before = _dir_size(student_dir)
+                compact_legacy_dir(student_dir)
+                stats["compacted"] += 1
+                stats["freed_bytes"] += before - _dir_size(student_dir)
+
+            # ---- 採点結果が無いまま古くなったフォルダ ----
+            if not has_result(student_dir):
+                if age > ttl_sec:
+                    stats["freed_bytes"] += _dir_size(student_dir)
+                    shutil.rmtree(student_dir)
+                    stats["removed"] += 1
+                continue
+
+            path = artifact_path(student_dir)
+            meta = read_meta(path)
+            if not meta["has_landmarks"]:
+                continue
+
+            # ---- TTL 切れの landmarks ----
+            if now - meta["created_at"] > ttl_sec:
+                stats["freed_bytes"] += strip_landmarks(path)
+                stats["stripped"] += 1
+                continue
+
+            sessions.append((meta["created_at"], path))
+        except Exception as e:
+            print(f"⚠ 整理できません: {student_dir}: {e}")
+            metrics.count_failure("retention")
+
+    # ---- 容量オーバー分は古い順に landmarks を消す ----
+    budget = budget_mb * 1024 * 1024
+    used = _dir_size(results_dir)
+    for _, path in sorted(sessions):
+        if used <= budget:
+            break
+        try:
+            freed = strip_landmarks(path)
+        except Exception as e:
+            print(f"⚠ 整理できません: {path}: {e}")
+            metrics.count_failure("retention")
+            continue
+        used -= freed
+        stats["freed_bytes"] += freed
+        stats["stripped"] += 1
+
+    return stats
+
+
+# ============================================================
+# バックグラウンド実行（server.py から）
+# ============================================================
+def _run_locked(results_dir):
+    """ロックが取れたときだけ実行（他のワーカーが実行中なら何もしない）"""
+    with open(os.path.join(results_dir, LOCK_NAME), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            with metrics.timer("retention"):
+                return run_retention(results_dir)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def start_retention_thread(results_dir=RESULTS_DIR, interval_sec=RETENTION_INTERVAL_SEC):
+    if interval_sec <= 0:
+        return None
+
+    def loop():
+        while True:
+            try:
+                stats = _run_locked(results_dir)
+                if stats and (stats["compacted"] or stats["stripped"] or stats["removed"]):
+                    print(f"🧹 結果フォルダ整理: {stats}")
+            except Exception as e:
+                print("結果フォルダ整理エラー:", e)
+            time.sleep(interval_sec)
+
+    t = threading.Thread(target=loop, name="result-retention", daemon=True)
+    t.start()
+    return t
+
+
+def main():
+    parser = argparse.ArgumentParser(description="data/results の landmarks を整理する")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--ttl-days", type=float, default=RESULT_LANDMARK_TTL_DAYS)
+    parser.add_argument("--budget-mb", type=float, default=RESULTS_DISK_BUDGET_MB)
+    args = parser.parse_args()
+
+    stats = run_retention(args.results_dir, args.ttl_days, args.budget_mb)
+    print(f"🧹 まとめた: {stats['compacted']}  landmarks 削除: {stats['stripped']}  "
+          f"フォルダ削除: {stats['removed']}  空いた容量: {stats['freed_bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
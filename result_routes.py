@@ -13,9 +13,13 @@
 # server.py から Blueprint として読み込んで使用します。
 # =============================================================
 
-from flask import Blueprint, render_template, session
+from flask import Blueprint, render_template, session, request, make_response
 from recommend_game import recommend_game
-import os, csv, random
+from scoring_jobs import get_job_queue
+from history_store import get_history_store
+from session_artifact import artifact_path, latest_scores_path, legacy_summary_path, has_result, load_tables
+from collections import OrderedDict
+import os, math, hashlib, threading
 import pandas as pd
 
 # === Blueprint ===
@@ -26,6 +30,9 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "../data")
 RESULTS_DIR = os.path.join(DATA_DIR, "results")
 
+# 結果ページの表示用データを何人分までメモリに置くか
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "128"))
+
 # === 定義（server.py と共有したい） ===
 EXERCISE_LABEL = {
     "E01": "両腕を前から上に上げて背伸びの運動",
@@ -52,51 +59,102 @@ ADVICE_TAILS = [
 ]
 
 # =============================================================
-# /result/<student_id>
+# 結果ページの表示用データ（student_id ごとにキャッシュ）
+#
+#   採点結果は一度できたら変わらないので、結果ファイルの読み込みと
+#   下位3つ・部位別コメント・総合スコアの計算は 1 回だけ行う。
+#   結果ファイルの更新時刻・サイズが変わったら作り直す。
+#   ※ ログインユーザーごとの「前回との比較」とおすすめゲームは毎回計算
 # =============================================================
-@result_bp.route("/result/<student_id>")
-def show_result(student_id):
-    # ===== パス類 =====
-    student_dir = os.path.join(RESULTS_DIR, f"student_{student_id}")
-    summary_path = os.path.join(student_dir, "results_score", "student_score_summary.csv")
-    part_path    = os.path.join(student_dir, "results_score", "student_part_error.csv")
+_VIEW_CACHE = OrderedDict()   # student_id → (signature, view)
+_VIEW_LOCK = threading.Lock()
+
+
+def _result_files(student_dir):
+    """
+    最新の再採点結果（無ければ session_artifact.npz）と
+    旧形式の CSV（まとめる前のフォルダ用）
+    """
+    score_dir = os.path.join(student_dir, "results_score")
+    return (
+        latest_scores_path(student_dir) or artifact_path(student_dir),
+        legacy_summary_path(student_dir),
+        os.path.join(score_dir, "student_part_error.csv"),
+    )
+
+
+def _file_signature(*paths):
+    sig = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
+
+
+def get_result_view(student_id, student_dir):
+    sig = _file_signature(*_result_files(student_dir))
+
+    with _VIEW_LOCK:
+        hit = _VIEW_CACHE.get(student_id)
+        if hit is not None and hit[0] == sig:
+            _VIEW_CACHE.move_to_end(student_id)
+            return hit[1], sig
+
+    view = build_result_view(student_id, student_dir)
+
+    with _VIEW_LOCK:
+        _VIEW_CACHE[student_id] = (sig, view)
+        _VIEW_CACHE.move_to_end(student_id)
+        while len(_VIEW_CACHE) > RESULT_CACHE_SIZE:
+            _VIEW_CACHE.popitem(last=False)
+    return view, sig
+
+
+def read_result_tables(student_dir):
+    """
+    return: (summary, part_error（無ければ None）, 結果ファイルのパス)
+    npz（再採点結果 / session_artifact.npz）が無ければ旧形式の CSV を読む
+    """
+    path, summary_path, part_path = _result_files(student_dir)
+    if os.path.exists(path):
+        tables = load_tables(path, ["summary", "part_error"])
+        return tables["summary"], tables.get("part_error"), path
 
-    # 結果が無ければ 404 返して終了
-    # 結果が無ければ採点待ち画面を表示
-    if not os.path.exists(summary_path):
-        return f"結果ファイルが見つかりません: {summary_path}", 404
+    dfp = pd.read_csv(part_path) if os.path.exists(part_path) else None
+    return pd.read_csv(summary_path), dfp, summary_path
 
 
-    # ===== 今回のスコア（DataFrame） =====
-    df_curr = pd.read_csv(summary_path)
-    if "exercise" not in df_curr.columns and "exercise_id" in df_curr.columns:
-        df_curr = df_curr.rename(columns={"exercise_id": "exercise"})
-    if "mean_score" not in df_curr.columns and "score" in df_curr.columns:
-        df_curr = df_curr.rename(columns={"score": "mean_score"})
+def _to_score(val):
+    try:
+        ms = float(val)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(ms) else ms
+
+
+def build_result_view(student_id, student_dir):
+    df_summary, dfp, result_path = read_result_tables(student_dir)
 
     # ===== テーブル & グラフ用データ =====
     table_data = []
     exercises = []
     scores = []
 
-    with open(summary_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            ex = (
-                row.get("exercise")
-                or row.get("exercise_id")
-                or row.get("label")
-                or ""
-            )
-            val = row.get("mean_score", "") or row.get("score", "") or "0"
-            try:
-                ms = float(val)
-            except ValueError:
-                ms = 0.0
-
-            table_data.append({"exercise_id": ex, "mean_score": ms})
-            exercises.append(ex)
-            scores.append(ms)
+    for row in df_summary.to_dict("records"):
+        ex = (
+            row.get("exercise")
+            or row.get("exercise_id")
+            or row.get("label")
+            or ""
+        )
+        ms = _to_score(row.get("mean_score", row.get("score")))
+
+        table_data.append({"exercise_id": ex, "mean_score": ms})
+        exercises.append(ex)
+        scores.append(ms)
 
     # ★ 下位3つ体操（E番号 & 日本語ラベル）
     sorted_by_score = sorted(table_data, key=lambda r: r["mean_score"])
@@ -108,9 +166,7 @@ def show_result(student_id):
     part_feedback   = {}   # 各Eの「悪かった部位」リスト
     global_feedback = []   # 全体で悪かった部位TOP3
 
-    if os.path.exists(part_path):
-        dfp = pd.read_csv(part_path)
-
+    if dfp is not None and len(dfp) > 0:
         # --- 体操ごと（下位3つだけ） ---
         for eid in low_eids:
             sub = dfp[dfp["exercise"] == eid]
@@ -129,69 +185,9 @@ def show_result(student_id):
         df_global = df_global.sort_values("mean_abs_error", ascending=False)
         global_feedback = [row["part"] for _, row in df_global.head(3).iterrows()]
 
-    # ===== 前回との比較 ＋ 自己ベスト =====
-    compare_rows = []                 # 比較結果（ログインしてない or 履歴無しなら空のまま）
-    user_id = session.get("user_id")  # None ならゲスト
-
-    if user_id is not None:
-        history_dir = os.path.join(DATA_DIR, "history")
-        history_path = os.path.join(history_dir, f"{user_id}_history.csv")
-
-        if os.path.exists(history_path):
-            df_hist = pd.read_csv(history_path)
-
-            # カラム名をそろえる
-            if "exercise" not in df_hist.columns and "exercise_id" in df_hist.columns:
-                df_hist = df_hist.rename(columns={"exercise_id": "exercise"})
-            if "mean_score" not in df_hist.columns and "score" in df_hist.columns:
-                df_hist = df_hist.rename(columns={"score": "mean_score"})
-
-            curr_sid = student_id  # URL の <student_id> をセッションIDとして使う
-
-            # このユーザーのセッション一覧（古い順）
-            sids = df_hist["session_id"].dropna().unique().tolist()
-
-            if curr_sid in sids:
-                idx = sids.index(curr_sid)
-
-                # ① 前回セッションとの比較（1つ前があれば）
-                if idx > 0:
-                    prev_sid = sids[idx - 1]
-                    df_prev = df_hist[df_hist["session_id"] == prev_sid]
-
-                    df_merged = df_curr.merge(
-                        df_prev[["exercise", "mean_score"]],
-                        on="exercise",
-                        how="left",
-                        suffixes=("_curr", "_prev")
-                    )
-
-                    # ② 自己ベスト（全履歴の max）
-                    df_best = (
-                        df_hist
-                        .groupby("exercise")["mean_score"]
-                        .max()
-                        .reset_index()
-                        .rename(columns={"mean_score": "best_score"})
-                    )
-
-                    df_merged = df_merged.merge(df_best, on="exercise", how="left")
-
-                    df_merged["diff_prev"] = df_merged["mean_score_curr"] - df_merged["mean_score_prev"]
-                    df_merged["diff_best"] = df_merged["mean_score_curr"] - df_merged["best_score"]
-
-                    for _, r in df_merged.iterrows():
-                        compare_rows.append({
-                            "exercise": r["exercise"],
-                            "label": EXERCISE_LABEL.get(r["exercise"], r["exercise"]),
-                            "curr": round(r["mean_score_curr"], 2),
-                            "prev": round(r["mean_score_prev"], 2) if not pd.isna(r["mean_score_prev"]) else None,
-                            "diff_prev": round(r["diff_prev"], 2) if not pd.isna(r["diff_prev"]) else None,
-                            "best": round(r["best_score"], 2) if not pd.isna(r["best_score"]) else None,
-                            "diff_best": round(r["diff_best"], 2) if not pd.isna(r["diff_best"]) else None,
-                        })
-
     # ===== 体操ごとの一文アドバイス（下位3つだけ） =====
+    # （結びの一文は student_id・体操で決める → キャッシュから外れても、
+    #   別のワーカーが作っても同じ文言・同じ ETag のまま）
     exercise_advice = {}
     for eid, parts in part_feedback.items():
         if not parts:
@@ -200,7 +196,7 @@ def show_result(student_id):
             # 「肩・股関節・体幹」みたいに並べる
             unique_parts = list(dict.fromkeys(parts))  # 重複削除
             joined = "・".join(unique_parts)
-            tail = random.choice(ADVICE_TAILS)
+            tail = advice_tail(student_id, eid)
             exercise_advice[eid] = f"{joined}の動きが小さめです。{tail}"
 
 
@@ -211,31 +207,6 @@ def show_result(student_id):
     else:
         overall_score = 0.0
 
-    # ===== ★ メッセージ判定 =====
-    def score_message(score):
-        if score >= 90:
-            return "🌟 すごい！！完璧です！"
-        elif score >= 70:
-            return "👍 あとちょっと！かなり良いです！"
-        elif score >= 40:
-            return "🙂 少しずつ改善していきましょう！"
-        else:
-            return "🔥 一緒に頑張ろう！伸びしろがあります！"
-
-    # ===== ★ 色判定 =====
-    def score_color(score):
-        if score >= 90:
-            return "#d4edda"  # 緑
-        elif score >= 70:
-            return "#fff3cd"  # 黄
-        elif score >= 40:
-            return "#ffeeba"  # 濃い黄
-        else:
-            return "#f8d7da"  # 赤
-
-    overall_message = score_message(overall_score)
-    overall_color = score_color(overall_score)
-    
     # ===== ★ おすすめゲーム判定用のデータ =====
     # 体操ごとのスコアを dict にする（例：{"E01": 80.5, "E02": 65.0, ...}）
     exercise_scores = {
@@ -244,31 +215,155 @@ def show_result(student_id):
         if row.get("exercise_id") is not None
     }
 
+    return {
+        "result_path": result_path,
+        "table_data": table_data,
+        "exercises": exercises,
+        "scores": scores,
+        "part_feedback": part_feedback,
+        "low_eids": low_eids,
+        "low_labels": low_labels,
+        "global_feedback": global_feedback,
+        "exercise_advice": exercise_advice,
+        "overall_score": overall_score,
+        "overall_message": score_message(overall_score),
+        "overall_color": score_color(overall_score),
+        "exercise_scores": exercise_scores,
+    }
+
+
+def advice_tail(student_id, eid):
+    """ADVICE_TAILS から 1 つ（同じ student_id・体操なら毎回同じ）"""
+    h = hashlib.sha1(f"{student_id}:{eid}".encode("utf-8")).digest()
+    return ADVICE_TAILS[int.from_bytes(h[:4], "big") % len(ADVICE_TAILS)]
+
+
+# ===== ★ メッセージ判定 =====
+def score_message(score):
+    if score >= 90:
+        return "🌟 すごい！！完璧です！"
+    elif score >= 70:
+        return "👍 あとちょっと！かなり良いです！"
+    elif score >= 40:
+        return "🙂 少しずつ改善していきましょう！"
+    else:
+        return "🔥 一緒に頑張ろう！伸びしろがあります！"
+
+
+# ===== ★ 色判定 =====
+def score_color(score):
+    if score >= 90:
+        return "#d4edda"  # 緑
+    elif score >= 70:
+        return "#fff3cd"  # 黄
+    elif score >= 40:
+        return "#ffeeba"  # 濃い黄
+    else:
+        return "#f8d7da"  # 赤
+
+
+# =============================================================
+# 前回との比較 ＋ 自己ベスト（ログインユーザーのみ）
+# =============================================================
+def build_compare_rows(user_id, student_id, table_data):
+    compare_rows = []   # 比較結果（履歴無しなら空のまま）
+
+    store = get_history_store(os.path.join(DATA_DIR, "history"))
+
+    curr_sid = student_id  # URL の <student_id> をセッションIDとして使う
+
+    # ① 前回セッションとの比較（1つ前があれば）
+    prev_sid = store.previous_session(user_id, curr_sid)
+    if prev_sid is None:
+        return compare_rows
+
+    prev = store.session_scores(user_id, prev_sid)
+
+    # ② 自己ベスト（追記のたびに更新済みの値を引くだけ）
+    best = store.best_scores(user_id)
+
+    for row in table_data:
+        ex = row["exercise_id"]
+        curr = row["mean_score"]
+        p = prev.get(ex)
+        b = best.get(ex)
+        compare_rows.append({
+            "exercise": ex,
+            "label": EXERCISE_LABEL.get(ex, ex),
+            "curr": round(curr, 2),
+            "prev": round(p, 2) if p is not None else None,
+            "diff_prev": round(curr - p, 2) if p is not None else None,
+            "best": round(b, 2) if b is not None else None,
+            "diff_best": round(curr - b, 2) if b is not None else None,
+        })
+    return compare_rows
+
+
+# =============================================================
+# /result/<student_id>
+# =============================================================
+@result_bp.route("/result/<student_id>")
+def show_result(student_id):
+    # ===== パス類 =====
+    student_dir = os.path.join(RESULTS_DIR, f"student_{student_id}")
+
+    # 結果が無ければ採点待ち画面を表示（ジョブが無ければ 404）
+    if not has_result(student_dir):
+        job = get_job_queue().status(student_id)
+        if job is not None and job["status"] == "error":
+            return f"採点に失敗しました: {job['error']}", 500
+        if job is not None or os.path.isdir(student_dir):
+            status = job["status"] if job is not None else "running"
+            return render_template("scoring.html", student_id=student_id, status=status), 202
+        return f"結果ファイルが見つかりません: {artifact_path(student_dir)}", 404
+
+    # ===== 採点結果から作る表示用データ（キャッシュ） =====
+    view, sig = get_result_view(student_id, student_dir)
+
+    # ===== 前回との比較 ＋ 自己ベスト =====
+    user_id = session.get("user_id")  # None ならゲスト
+    compare_rows = []
+    if user_id is not None:
+        compare_rows = build_compare_rows(user_id, student_id, view["table_data"])
+
     # チャットのタグ（/api/chat で session["chat_tags"] に入れておく）
     chat_tags = session.get("chat_tags", [])
 
-    # バランス型ロジックでおすすめゲームを決定
-    recommended_game = recommend_game(chat_tags, exercise_scores, global_feedback)
-
-
-
-    # ===== ここで必ずテンプレートを返す（どの条件でも） =====
-    return render_template(
-        "result.html",
-        result_path=summary_path,
-        table_data=table_data,
-        exercises=exercises,
-        scores=scores,
-        part_feedback=part_feedback,
-        low_eids=low_eids,
-        low_labels=low_labels,
-        global_feedback=global_feedback,
-        EXERCISE_LABEL=EXERCISE_LABEL,
-        exercise_advice=exercise_advice,
-        compare_rows=compare_rows,
-        overall_score=overall_score,
-        overall_message=overall_message,
-        overall_color=overall_color,
-        recommended_game=recommended_game,
-        chat_tags=chat_tags,
-    )
+    # ===== ETag（結果ファイル・比較・タグのどれかが変われば変わる） =====
+    etag = hashlib.sha1(
+        repr((student_id, sig, user_id, compare_rows, chat_tags)).encode("utf-8")
+    ).hexdigest()
+    last_modified = max(os.path.getmtime(p) for p in _result_files(student_dir) if os.path.exists(p))
+
+    if request.if_none_match.contains(etag):
+        resp = make_response("", 304)
+    else:
+        # バランス型ロジックでおすすめゲームを決定
+        recommended_game = recommend_game(chat_tags, view["exercise_scores"], view["global_feedback"])
+
+        # ===== ここで必ずテンプレートを返す（どの条件でも） =====
+        resp = make_response(render_template(
+            "result.html",
+            result_path=view["result_path"],
+            table_data=view["table_data"],
+            exercises=view["exercises"],
+            scores=view["scores"],
+            part_feedback=view["part_feedback"],
+            low_eids=view["low_eids"],
+            low_labels=view["low_labels"],
+            global_feedback=view["global_feedback"],
+            EXERCISE_LABEL=EXERCISE_LABEL,
+            exercise_advice=view["exercise_advice"],
+            compare_rows=compare_rows,
+            overall_score=view["overall_score"],
+            overall_message=view["overall_message"],
+            overall_color=view["overall_color"],
+            recommended_game=recommended_game,
+            chat_tags=chat_tags,
+        ))
+
+    # ログイン状態で中身が変わるので共有キャッシュには置かせず、毎回確認させる
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
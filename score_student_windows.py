@@ -10,7 +10,14 @@ score_student_windows.py（方式A＋誤差100点方式）
 server.py から呼び出すときは:
 
 python3 score_student_windows.py --indir <student_window_features_dir> \
-                                 --outdir <student_result_dir>
+                                 --outdir <student_result_dir> \
+                                 [--match dtw]
+
+--indir は make_student_window_features.py の出力
+（E**/ フォルダの CSV、または --format npz の *_features.npz ファイル）。
+
+--match dtw のときは生徒ウィンドウ i と教師ウィンドウ i を比べる代わりに
+DTW（dtw_matcher.py）で対応付け、detail に teacher_window_index を出す。
 
 出力:
   <outdir>/results_score/student_score_summary.csv
@@ -20,12 +27,34 @@ python3 score_student_windows.py --indir <student_window_features_dir> \
 """
 
 import os
+import shutil
+import hashlib
+import tempfile
 import argparse
 import numpy as np
 import pandas as pd
 from glob import glob
+from functools import lru_cache
+
+from motion_features import FEATURE_COLUMNS
+from dtw_matcher import match_windows, band_windows, DTW_BAND_SEC
+from session_artifact import load_features
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROFILE_PATH = os.path.join(BASE_DIR, "../data/teacher_profile/teacher_profile_window_median.npz")
+
+# リポジトリ同梱のプロファイル（../data 側が無い環境用）
+BUNDLED_PROFILE_PATH = os.path.join(BASE_DIR, "teacher_profile/teacher_profile_window_median.npz")
 
-PROFILE_PATH = "../data/teacher_profile/teacher_profile_window_median.npz"
+# 1 なら教師プロファイルを非圧縮のサイドカーからメモリマップで読む（プロセス間で共有）
+# 同梱プロファイルは約 130 KB で、プロセスごとに展開しても困らないので既定は 0
+PROFILE_MMAP = os.getenv("TEACHER_PROFILE_MMAP", "0") == "1"
+
+# サイドカーの置き場所（リポジトリ・データ側には書かない）
+PROFILE_CACHE_DIR = os.getenv(
+    "TEACHER_PROFILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "radio_taiso_profile"))
 
 ANGLE_PART = {
     0:"肩",1:"肩",2:"肘",3:"肘",4:"股関節",5:"股関節",
@@ -55,131 +84,378 @@ def build_feature_part_map(columns):
 # ============================================================
 # ⭐ 方式A＋誤差100点方式のスコア関数
 # ============================================================
+# ★ 誤差として許容する距離（これ以下は100点）
+TOL = 3000
+
+# ★ 優しさ（ALPHAを大きくすると点数が上がりやすくなる）
+ALPHA = 7000
+
+
 def score_window(student_vec, teacher_vec, min_teacher_dist):
     true_dist = np.linalg.norm(student_vec - teacher_vec)
     dist_norm = max(0.0, true_dist - min_teacher_dist)
 
-    # ★ 誤差として許容する距離（これ以下は100点）
-    TOL = 3000
-
     if dist_norm <= TOL:
         return 100.0
 
-    # ★ 優しさ（ALPHAを大きくすると点数が上がりやすくなる）
-    ALPHA = 7000
-
     score = 100 * np.exp(-(dist_norm - TOL) / ALPHA)
     return max(0.0, min(score, 100.0))
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--indir", required=True)
-    parser.add_argument("--outdir", required=True)
-    args = parser.parse_args()
+def score_windows(student_mat, teacher_mat, min_teacher_dist):
+    """
+    score_window の一括版
+    student_mat, teacher_mat: (W,83)（同じ行数）
+    return: (W,) のスコア
+    """
+    true_dist = row_norms(student_mat - teacher_mat)
 
-    IN_DIR = args.indir
-    OUT_BASE = args.outdir
+    # max(0.0, x) と同じく NaN は 0 扱い
+    over = true_dist - min_teacher_dist
+    dist_norm = np.where(over > 0.0, over, 0.0)
 
-    OUT_DIR = os.path.join(OUT_BASE, "results_score")
-    os.makedirs(OUT_DIR, exist_ok=True)
+    score = 100 * np.exp(-(dist_norm - TOL) / ALPHA)
+    return np.where(dist_norm <= TOL, 100.0, np.clip(score, 0.0, 100.0))
+
+
+def row_norms(mat):
+    """
+    行ごとの np.linalg.norm（score_window とビット単位で同じ）
+      (1,83) @ (83,1) の matmul は 1 次元の np.linalg.norm と同じ dot（BLAS）で計算される。
+      np.linalg.norm(mat, axis=1) は足す順番が違い、最後の桁がずれることがある
+    """
+    return np.sqrt((mat[:, None, :] @ mat[:, :, None])[:, 0, 0])
+
+
+def part_indicator(feature_part_map, n_features):
+    """
+    feature_part_map → (parts, (n_features, n_parts) の 0/1 行列)
+    parts は特徴量の並び順で初出順
+    """
+    parts = list(dict.fromkeys(feature_part_map.values()))
+    M = np.zeros((n_features, len(parts)))
+    for fi, part in feature_part_map.items():
+        M[fi, parts.index(part)] = 1.0
+    return parts, M
+
+
+def part_mean_abs_error(student_mat, teacher_mat, parts, M):
+    """
+    部位ごとの平均絶対誤差（全ウィンドウ × 部位内の特徴量で平均）
+    return: (n_parts,)
+    足す順番は 1 ウィンドウずつ部位内の特徴量を足していく元の集計と同じ
+    （ウィンドウ × 特徴量を行順に並べて累積和）なので、CSV の値も同じになる
+    NaN を含む特徴量があればその部位は NaN
+    """
+    err = np.abs(student_mat - teacher_mat)
+    out = np.full(len(parts), np.nan)
+    for p in range(len(parts)):
+        v = err[:, np.flatnonzero(M[:, p])].ravel()
+        if len(v):
+            out[p] = np.cumsum(v)[-1] / len(v)
+    return out
 
-    print("📘 Loading teacher profile...")
-    prof = np.load(PROFILE_PATH)
 
-    for eid in sorted(prof.files):
-        print(f"  {eid}: {prof[eid].shape}")
+# ============================================================
+# 教師プロファイル（読み込み時に定数を前計算）
+# ============================================================
+class TeacherProfile:
+    """
+    教師プロファイル {"E01": (n_windows,83), ...} と、
+    採点のたびに使う定数をまとめて持つ（dict と同じように get / [] で引ける）
 
-    student_folders = sorted(glob(os.path.join(IN_DIR, "E*")))
-    print(f"\n🎯 生徒 Eフォルダ検出: {len(student_folders)} 個")
+      min_dist[eid]     : 隣り合う教師ウィンドウ間の最小距離
+                          （ファイルに保存された dtype のまま計算。float32 のプロファイルを
+                            float64 で採点しても、元の採点と同じ値）
+      feature_part_map  : FEATURE_COLUMNS の index → 部位
+      parts             : 部位名（特徴量の並び順で初出順）
+      part_matrix       : (83, n_parts) の 0/1 行列（特徴量 → 部位）
+    """
 
-    results = []
-    feature_part_map = None
-    part_error = {}
-    part_count = {}
+    def __init__(self, mats, columns=FEATURE_COLUMNS, min_dist=None):
+        self.mats = mats
+        self.columns = list(columns)
 
-    for e_folder in student_folders:
-        eid = os.path.basename(e_folder)
+        # min_dist を渡さなければ mats から計算する
+        if min_dist is None:
+            min_dist = {eid: teacher_min_dist(mat) for eid, mat in mats.items()}
+        self.min_dist = min_dist
+
+        self.feature_part_map = build_feature_part_map(self.columns)
+        self.parts, self.part_matrix = part_indicator(self.feature_part_map, len(self.columns))
+
+    @property
+    def files(self):
+        return list(self.mats)
+
+    def get(self, eid, default=None):
+        return self.mats.get(eid, default)
+
+    def __getitem__(self, eid):
+        return self.mats[eid]
+
+    def items(self):
+        return self.mats.items()
+
+
+def teacher_min_dist(teacher_mat):
+    """
+    教師の最小距離（dist-min）: 隣り合うウィンドウ間の距離の最小値（2 ウィンドウ未満は inf）
+    row_norms を使うので、1 ウィンドウずつ np.linalg.norm した値とビット単位で同じ
+    """
+    d = np.diff(teacher_mat, axis=0)
+    return row_norms(d).min() if len(d) else np.inf
+
+
+# ============================================================
+# 教師プロファイル読み込み（プロセス内で 1 回だけ）
+# ============================================================
+def resolve_profile_path(path=None):
+    if path is None:
+        path = PROFILE_PATH if os.path.exists(PROFILE_PATH) else BUNDLED_PROFILE_PATH
+    return os.path.abspath(path)
+
+
+def load_teacher_profile(path=None, dtype=np.float64):
+    """
+    dtype : 教師ウィンドウの dtype（生徒の特徴量と揃える。float32 / float64）
+    return: TeacherProfile
+    同じパス・dtype は 2 回目以降キャッシュを返す（ファイルを更新したら mtime で読み直す）
+    """
+    path = resolve_profile_path(path)
+    return _load_teacher_profile_cached(path, os.stat(path).st_mtime_ns, np.dtype(dtype).str)
+
+
+@lru_cache(maxsize=4)
+def _load_teacher_profile_cached(path, mtime_ns, dtype):
+    with np.load(path) as prof:
+        raw = {eid: prof[eid] for eid in sorted(prof.files)}
+    min_dist = {eid: teacher_min_dist(mat) for eid, mat in raw.items()}
+
+    mats = None
+    if PROFILE_MMAP:
+        mats = _load_profile_mmap(path, mtime_ns, np.dtype(dtype))
+    if mats is None:
+        mats = {eid: mat.astype(dtype, copy=False) for eid, mat in raw.items()}
+    return TeacherProfile(mats, min_dist=min_dist)
+
+
+# ============================================================
+# 非圧縮の .npy（サイドカー）をメモリマップで読む
+#
+#   TEACHER_PROFILE_MMAP=1 のときだけ使う（大きなプロファイルを多数のワーカーで
+#   読む配置向け。同梱プロファイルの大きさなら npz の展開で十分）。
+#   npz（圧縮）は読むたびに展開されて、プロセスごとに別のコピーになる。
+#   初回に PROFILE_CACHE_DIR/<プロファイル名>-<パスのハッシュ>.mmap-<dtype>-<mtime>/E01.npy ...
+#   として展開済みの配列を書き出しておき、以後は np.load(mmap_mode="r") で読む
+#   → 採点ワーカー・gunicorn ワーカーが同じページキャッシュを共有する
+#   書き出しは一時フォルダ → rename なので、同時に起動したワーカーどうしでも
+#   書きかけのサイドカーを読むことはない。
+#   書き出せないときは今までどおり npz を展開する
+# ============================================================
+def profile_sidecar_dir(path, mtime_ns, dtype):
+    name = os.path.splitext(os.path.basename(path))[0]
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(PROFILE_CACHE_DIR, f"{name}-{key}.mmap-{np.dtype(dtype).name}-{mtime_ns}")
+
+
+def _write_profile_sidecar(path, sidecar, dtype):
+    tmp = f"{sidecar}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    with np.load(path) as prof:
+        for eid in prof.files:
+            np.save(os.path.join(tmp, f"{eid}.npy"), prof[eid].astype(dtype, copy=False))
+    try:
+        os.rename(tmp, sidecar)
+    except OSError:
+        # 別のプロセスが先に書き終えた
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(sidecar):
+            raise
+
+    # 古いプロファイル（mtime 違い）のサイドカーを消す
+    # （読み込み中のプロセスのメモリマップは消しても有効なまま）
+    stale = sidecar[:sidecar.rindex("-") + 1]
+    for d in glob(f"{stale}*"):
+        if d != sidecar and ".tmp-" not in d:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def _load_profile_mmap(path, mtime_ns, dtype):
+    """return: {eid: 読み取り専用の memmap}（サイドカーを作れなければ None）"""
+    sidecar = profile_sidecar_dir(path, mtime_ns, dtype)
+    try:
+        if not os.path.isdir(sidecar):
+            _write_profile_sidecar(path, sidecar, dtype)
+        files = sorted(glob(os.path.join(sidecar, "*.npy")))
+        return {
+            # memmap のサブクラスが計算結果に伝わらないよう ndarray として見る（中身は共有のまま）
+            os.path.splitext(os.path.basename(f))[0]: np.load(f, mmap_mode="r").view(np.ndarray)
+            for f in files
+        }
+    except OSError as e:
+        print(f"⚠ 教師プロファイルのメモリマップを使えません（npz を展開します）: {e}")
+        return None
+
+
+# ============================================================
+# 採点本体（メモリ上の特徴量 → 3種類の表）
+# ============================================================
+@metrics.timer("scoring")
+def score_features(features, prof, match="index", band_sec=DTW_BAND_SEC):
+    """
+    features: {"E01": DataFrame(n_windows,83), ...}
+    prof    : TeacherProfile（load_teacher_profile() の戻り値）
+    match   : "index" = i 番目どうし（短い方に合わせる）
+              "dtw"   = DTW で対応付け（生徒ウィンドウは全部使う。
+                        DTW の道が無いときだけ "index" と同じく短い方に合わせる）
+    return  : (df_detail, df_summary, df_part)
+    """
+    if match not in ("index", "dtw"):
+        raise ValueError(f"未対応の match: {match}")
+
+    detail_frames = []
+    part_frames = []
+    parts = M = None
+
+    for eid in sorted(features):
         teacher_mat = prof.get(eid, None)
 
         if teacher_mat is None:
             print(f"⚠ {eid}: 教師データなし → スキップ")
             continue
 
-        csv_list = sorted(glob(os.path.join(e_folder, "*.csv")))
-        if len(csv_list) == 0:
+        student_df = features[eid]
+        if len(student_df) == 0:
             print(f"⚠ {eid}: 生徒データなし → スキップ")
             continue
 
-        student_df = pd.read_csv(csv_list[0])
-        student_mat = student_df.values
+        if M is None:
+            columns = list(student_df.columns)
+            if columns == prof.columns:
+                parts, M = prof.parts, prof.part_matrix
+            else:
+                parts, M = part_indicator(build_feature_part_map(columns), len(columns))
+
+        # ===== 教師の最小距離（dist-min）: 読み込み時に計算済み =====
+        min_dist = prof.min_dist[eid]
+
+        print(f"➡ {eid}: teacher_min_dist = {min_dist:.2f}")
+
+        # ===== 生徒スコア算出（全ウィンドウ一括） =====
+        if match == "dtw":
+            J = match_windows(student_df.values, teacher_mat, band_windows(band_sec))
+            W = len(J)
+            S = student_df.values[:W]
+            Tm = teacher_mat[J]
+        else:
+            W = min(teacher_mat.shape[0], len(student_df))
+            S = student_df.values[:W]
+            Tm = teacher_mat[:W]
+
+        detail = {
+            "exercise": eid,
+            "window_index": np.arange(W),
+        }
+        if match == "dtw":
+            detail["teacher_window_index"] = J
+        detail["score"] = score_windows(S, Tm, min_dist)
+        detail_frames.append(pd.DataFrame(detail))
+
+        # ===== 部位誤差集計（指示行列との行列積） =====
+        part_frames.append(pd.DataFrame({
+            "exercise": eid,
+            "part": parts,
+            "mean_abs_error": part_mean_abs_error(S, Tm, parts, M),
+        }))
+
+    columns = ["exercise", "window_index", "score"]
+    df_detail = pd.concat(detail_frames, ignore_index=True) if detail_frames \
+        else pd.DataFrame(columns=columns)
+    df_summary = df_detail.groupby("exercise")["score"].mean().reset_index() \
+        .rename(columns={"score": "mean_score"})
 
-        if feature_part_map is None:
-            feature_part_map = build_feature_part_map(list(student_df.columns))
-            print("🧩 feature→部位 マップ:", feature_part_map)
+    # 部位誤差
+    columns = ["exercise", "part", "mean_abs_error"]
+    df_part = pd.concat(part_frames, ignore_index=True) if part_frames \
+        else pd.DataFrame(columns=columns)
 
-        # ===== 教師の最小距離（dist-min）を計算 =====
-        teacher_min_dist = np.inf
-        for i in range(len(teacher_mat) - 1):
-            d = np.linalg.norm(teacher_mat[i] - teacher_mat[i+1])
-            teacher_min_dist = min(teacher_min_dist, d)
+    return df_detail, df_summary, df_part
 
-        print(f"\n➡ {eid}: teacher_min_dist = {teacher_min_dist:.2f}")
 
-        # ===== 生徒スコア算出 =====
-        W = min(teacher_mat.shape[0], student_mat.shape[0])
+# ============================================================
+# CSV 保存（<outdir>/results_score/*.csv）
+# ============================================================
+def save_scores(out_base, df_detail, df_summary, df_part):
+    out_dir = os.path.join(out_base, "results_score")
+    os.makedirs(out_dir, exist_ok=True)
 
-        for i in range(W):
-            s_vec = student_mat[i]
-            t_vec = teacher_mat[i]
+    detail_path = os.path.join(out_dir, "student_score_detail.csv")
+    summary_path = os.path.join(out_dir, "student_score_summary.csv")
 
-            score = score_window(s_vec, t_vec, teacher_min_dist)
+    df_detail.to_csv(detail_path, index=False)
+    df_summary.to_csv(summary_path, index=False)
 
-            results.append({
-                "exercise": eid,
-                "window_index": i,
-                "score": score
-            })
+    print("\n🎉 採点完了!!!!")
+    print(f"  🔍 詳細: {detail_path}")
+    print(f"  📊 平均: {summary_path}")
 
-            # 部位誤差集計
-            diff = np.abs(s_vec - t_vec)
-            pe = part_error.setdefault(eid, {})
-            pc = part_count.setdefault(eid, {})
+    if len(df_part) > 0:
+        part_path = os.path.join(out_dir, "student_part_error.csv")
+        df_part.to_csv(part_path, index=False)
+        print(f"  🧠 部位別誤差: {part_path}")
 
-            for fi, part in feature_part_map.items():
-                pe[part] = pe.get(part, 0.0) + float(diff[fi])
-                pc[part] = pc.get(part, 0) + 1
+    return summary_path
 
-    df = pd.DataFrame(results)
 
-    detail_path = os.path.join(OUT_DIR, "student_score_detail.csv")
-    summary_path = os.path.join(OUT_DIR, "student_score_summary.csv")
+# ============================================================
+# 生徒特徴量の読み込み（CSV フォルダ / npz 1 ファイル）
+# ============================================================
+def load_window_features(indir):
+    if os.path.isfile(indir):
+        features = load_features(indir)
+        print(f"\n🎯 生徒特徴量: {len(features)} 体操 ← {indir}")
+        return features
 
-    df.to_csv(detail_path, index=False)
-    df.groupby("exercise")["score"].mean().reset_index() \
-        .rename(columns={"score": "mean_score"}) \
-        .to_csv(summary_path, index=False)
+    student_folders = sorted(glob(os.path.join(indir, "E*")))
+    print(f"\n🎯 生徒 Eフォルダ検出: {len(student_folders)} 個")
 
-    print("\n🎉 採点完了!!!!")
-    print(f"  🔍 詳細: {detail_path}")
-    print(f"  📊 平均: {summary_path}")
+    features = {}
+    for e_folder in student_folders:
+        eid = os.path.basename(e_folder)
 
-    # 部位誤差
-    part_rows = []
-    for eid, per_part in part_error.items():
-        for part, total_err in per_part.items():
-            cnt = part_count[eid].get(part, 1)
-            part_rows.append({
-                "exercise": eid,
-                "part": part,
-                "mean_abs_error": total_err / cnt
-            })
-
-    if part_rows:
-        df_part = pd.DataFrame(part_rows)
-        part_path = os.path.join(OUT_DIR, "student_part_error.csv")
-        df_part.to_csv(part_path, index=False)
-        print(f"  🧠 部位別誤差: {part_path}")
+        csv_list = sorted(glob(os.path.join(e_folder, "*.csv")))
+        if len(csv_list) == 0:
+            print(f"⚠ {eid}: 生徒データなし → スキップ")
+            continue
+
+        features[eid] = pd.read_csv(csv_list[0])
+    return features
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--indir", required=True,
+                        help="E**/ フォルダのあるディレクトリ、または *_features.npz")
+    parser.add_argument("--outdir", required=True)
+    parser.add_argument("--match", choices=["index", "dtw"], default="index")
+    parser.add_argument("--band-sec", type=float, default=DTW_BAND_SEC,
+                        help="--match dtw のバンド幅 [sec]")
+    args = parser.parse_args()
+
+    IN_DIR = args.indir
+    OUT_BASE = args.outdir
+
+    print("📘 Loading teacher profile...")
+    prof = load_teacher_profile()
+
+    for eid, mat in prof.items():
+        print(f"  {eid}: {mat.shape}")
+
+    features = load_window_features(IN_DIR)
+
+    df_detail, df_summary, df_part = score_features(features, prof, args.match, args.band_sec)
+    save_scores(OUT_BASE, df_detail, df_summary, df_part)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scoring_jobs.py（採点ジョブキュー）
+============================================================
+/score_landmarks はジョブを積んですぐ job_id を返し、
+採点そのものはプロセスプールのワーカーで行う。
+
+  ・外部ブローカー不要（gunicorn ワーカー内のローカルプール）
+  ・待ち＋実行中のジョブ数が SCORING_QUEUE_MAX に達したら QueueFull
+    （server.py が 503 + Retry-After を返す）
+  ・ジョブの状態は job_id（= student_id）で引ける
+      queued → running → done / error
+  ・ワーカーで測った段階ごとの時間（metrics.py）はジョブ完了時に
+    Web プロセスの集計へ取り込む（/metrics で見える）
+
+環境変数:
+  SCORING_WORKERS    ワーカープロセス数（既定 2）
+  SCORING_QUEUE_MAX  同時に受け付けるジョブ数の上限（既定 16）
+============================================================
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from scoring_pipeline import get_pipeline, save_result
+
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "2"))
+SCORING_QUEUE_MAX = int(os.getenv("SCORING_QUEUE_MAX", "16"))
+
+# 終わったジョブの状態を残しておく秒数
+JOB_TTL_SEC = 60 * 60
+
+# 満杯時にクライアントへ伝える再送までの秒数
+RETRY_AFTER_SEC = 5
+
+
+class QueueFull(Exception):
+    pass
+
+
+# ============================================================
+# ワーカー側で動く処理（プロセスプールから呼ばれる）
+# ============================================================
+def _warm_up():
+    # 教師プロファイルをワーカー起動時に読み込んでおく
+    get_pipeline()
+
+
+def _run_job(fn, *args):
+    """
+    ワーカーで fn(*args) を実行し、計測値と一緒に返す
+    （例外もここで受けて、失敗した段階の計測値を捨てないようにする）
+    """
+    started_at = time.time()
+    result = error = None
+    with metrics.capture() as events:
+        try:
+            with metrics.timer("job"):
+                result = fn(*args)
+        except Exception as e:
+            error = str(e)
+    return {"result": result, "error": error, "events": events, "started_at": started_at}
+
+
+def run_scoring_job(uid, student_dir, landmarks, fps):
+    """
+    特徴量 → 採点 → session_artifact.npz 保存（landmarks も一緒に）
+    return: artifact のパス
+    """
+    result = get_pipeline().run_landmarks(landmarks, fps=fps)
+    path = save_result(result, student_dir, landmarks, fps)
+    print(f"📦 結果保存: {path}")
+    return path
+
+
+# ============================================================
+# ジョブキュー（Web プロセス側）
+# ============================================================
+class JobQueue:
+    def __init__(self, workers=SCORING_WORKERS, max_pending=SCORING_QUEUE_MAX):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # スレッドを持つ Web プロセスを fork しないよう forkserver / spawn を使う
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            ctx = multiprocessing.get_context(method)
+            if method == "forkserver":
+                ctx.set_forkserver_preload(["scoring_pipeline"])
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=ctx, initializer=_warm_up,
+            )
+        return self._executor
+
+    def pending(self):
+        """待ち＋実行中のジョブ数"""
+        with self._lock:
+            return self._pending()
+
+    def _pending(self):
+        return sum(1 for j in self._jobs.values() if j["finished_at"] is None)
+
+    def submit(self, job_id, fn, *args, on_done=None):
+        """
+        fn(*args) をワーカーで実行する
+        on_done(result) は成功時に Web プロセス側で呼ばれる（履歴保存など）
+        """
+        with self._lock:
+            self._expire()
+            depth = self._pending()
+            if depth >= self.max_pending:
+                raise QueueFull(f"採点待ちが {depth} 件あります")
+
+            job = {
+                "status": "queued",
+                "error": None,
+                "result": None,
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "future": None,
+            }
+            self._jobs[job_id] = job
+
+            executor = self._get_executor()
+
+        try:
+            try:
+                job["future"] = executor.submit(_run_job, fn, *args)
+            except BrokenProcessPool:
+                # ワーカーが落ちてプールが壊れていたら作り直して 1 回だけ再投入
+                print("⚠ 採点プール再起動")
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                    executor = self._get_executor()
+                job["future"] = executor.submit(_run_job, fn, *args)
+        except Exception as e:
+            job.update(status="error", error=str(e), finished_at=time.time())
+            raise
+        job["future"].add_done_callback(lambda f: self._finish(job_id, f, on_done))
+        return job_id
+
+    def _finish(self, job_id, future, on_done):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return
+
+        try:
+            out = future.result()
+        except Exception as e:
+            # ワーカーごと落ちた場合など
+            out = {"result": None, "error": str(e), "events": [], "started_at": None}
+            metrics.count_failure("job")
+
+        metrics.replay(out["events"])
+        if out["started_at"] is not None:
+            metrics.observe_stage("queue_wait", max(0.0, out["started_at"] - job["submitted_at"]))
+
+        if out["error"] is not None:
+            print(f"採点ジョブエラー [{job_id}]:", out["error"])
+            job.update(status="error", error=out["error"], finished_at=time.time())
+            return
+        result = out["result"]
+
+        if on_done is not None:
+            try:
+                on_done(result)
+            except Exception as e:
+                print(f"採点ジョブ後処理エラー [{job_id}]:", e)
+
+        job.update(status="done", result=result, finished_at=time.time())
+
+    def status(self, job_id):
+        """return: ジョブ情報の dict（知らない job_id は None）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            info = {k: v for k, v in job.items() if k != "future"}
+
+        # プールに渡ってワーカーが取り出したら running
+        future = job["future"]
+        if info["status"] == "queued" and future is not None and future.running():
+            info["status"] = "running"
+        return info
+
+    def _expire(self):
+        limit = time.time() - JOB_TTL_SEC
+        old = [jid for jid, j in self._jobs.items()
+               if j["finished_at"] is not None and j["finished_at"] < limit]
+        for jid in old:
+            del self._jobs[jid]
+
+
+# ============================================================
+# プロセス共通インスタンス
+# ============================================================
+_QUEUE = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_job_queue():
+    # gunicorn のスレッドから同時に最初の呼び出しが来てもプールは 1 つだけ作る
+    global _QUEUE
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None:
+                _QUEUE = JobQueue()
+    return _QUEUE
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scoring_pipeline.py（プロセス内採点エンジン）
+============================================================
+make_student_window_features.py → score_student_windows.py の流れを
+サブプロセスを使わずに 1 プロセス内で実行する。
+
+  ・教師の時間モデル / 教師プロファイルは最初の 1 回だけ読み込む
+  ・ランドマーク配列をメモリのまま受け取り、
+    summary / detail / part_error の 3 つの表を返す
+
+server.py からの使い方:
+
+  pipeline = get_pipeline()
+  result = pipeline.run_landmarks(landmarks, fps=30.0)   # (T,33,4)
+  save_result(result, student_dir, landmarks, fps)      # → session_artifact.npz
+
+前処理（prepare）:
+  utils_pose.preprocess_pose の angles8 だけを使い、正規化・visibility マスクは
+  計算しない（設定で有効にする項目も置かない）。
+    ・正規化は骨盤中心を原点に移すので、骨盤の位置から作る体幹の指標
+      （trunk_range / trunk_vel）が常に 0 になる。教師プロファイルは生座標で
+      作られているので、正規化した座標では比べられない
+    ・20 角度・8 角度は平行移動・拡大・回転で変わらないので、正規化しても
+      角度の特徴量は同じ（angles8 は正規化の有無によらず生座標から求める）
+    ・マスクで落としたフレームは特徴量が NaN になり、score_window では
+      距離 NaN → 100 点になる（元の採点もマスクを使っていない）
+
+環境変数:
+  SCORING_ALIGNMENT           E01 開始の求め方
+                                threshold（既定）: 前奏のしきい値検出
+                                xcorr            : 教師との相互相関（alignment.py）
+  SCORING_ALIGN_PER_EXERCISE  1 なら xcorr で体操ごとのずれも合わせる
+  SCORING_MATCH               教師ウィンドウとの対応付け
+                                index（既定）: i 番目どうし
+                                dtw          : DTW（dtw_matcher.py）
+  SCORING_DTYPE               座標・角度・特徴量・教師プロファイルの dtype
+                                float64（既定）
+                                float32: メモリ・帯域が約半分（MediaPipe の精度は
+                                         もともと float32 程度。スコアの差は
+                                         tests/test_scoring_pipeline.py で確認）
+============================================================
+"""
+
+import os
+import threading
+import numpy as np
+
+import metrics
+from utils_pose import preprocess_pose
+from make_student_window_features import make_window_features, detect_alignment
+from score_student_windows import load_teacher_profile, score_features
+from session_artifact import save_artifact
+from alignment import Aligner
+
+SCORING_ALIGNMENT = os.getenv("SCORING_ALIGNMENT", "threshold")
+SCORING_ALIGN_PER_EXERCISE = os.getenv("SCORING_ALIGN_PER_EXERCISE", "0") == "1"
+SCORING_MATCH = os.getenv("SCORING_MATCH", "index")
+SCORING_DTYPE = os.getenv("SCORING_DTYPE", "float64")
+
+DTYPES = ("float32", "float64")
+
+
+class ScoringPipeline:
+    """教師プロファイルを保持したまま何度でも採点できるエンジン"""
+
+    def __init__(self, profile_path=None, alignment=SCORING_ALIGNMENT,
+                 per_exercise=SCORING_ALIGN_PER_EXERCISE, match=SCORING_MATCH,
+                 dtype=SCORING_DTYPE):
+        if np.dtype(dtype).name not in DTYPES:
+            raise ValueError(f"未対応の dtype: {dtype}")
+        self.dtype = np.dtype(dtype)
+        self.profile = load_teacher_profile(profile_path, self.dtype)
+
+        if match not in ("index", "dtw"):
+            raise ValueError(f"未対応の match: {match}")
+        self.match = match
+
+        if alignment not in ("threshold", "xcorr"):
+            raise ValueError(f"未対応の alignment: {alignment}")
+        self.aligner = Aligner(self.profile, per_exercise) if alignment == "xcorr" else None
+
+    # --------------------------------------------------------
+    # 位置合わせ（E01 開始時刻 + 体操ごとのずれ）
+    # --------------------------------------------------------
+    def align(self, angles8, ts, angle20=None):
+        return detect_alignment(angles8, ts, angle20, self.aligner)
+
+    # --------------------------------------------------------
+    # 特徴量生成（E01〜E13 → 83次元）
+    # --------------------------------------------------------
+    def features(self, P, angles8, ts):
+        return make_window_features(P, angles8, ts, self.aligner)
+
+    # --------------------------------------------------------
+    # 採点
+    # --------------------------------------------------------
+    def score(self, features):
+        df_detail, df_summary, df_part = score_features(features, self.profile, self.match)
+        return {
+            "features": features,
+            "summary": df_summary,
+            "detail": df_detail,
+            "part_error": df_part,
+        }
+
+    def run(self, P, angles8, ts):
+        """
+        P      : (T,33,3) 座標
+        angles8: (T,8)    基本角度
+        ts     : (T,)     時刻 [sec]
+        """
+        return self.score(self.features(P, angles8, ts))
+
+    def prepare(self, landmarks, buffers=None):
+        """
+        landmarks: (T,33,4) または (T,33,3)（index.js が送る生座標）
+        buffers  : utils_pose.PoseBuffers（チャンクごとに呼ぶときに使い回す）
+        return   : (P (T,33,3), angles8 (T,8))（どちらも self.dtype）
+        フレームごとの処理なので、チャンク単位で呼んでも結果は同じ
+        ※ 特徴量は生座標のまま（正規化・マスクを使わない理由はモジュールの説明を参照）
+        ※ P は landmarks の dtype が self.dtype と同じならコピーせずにビューを返す
+        """
+        with metrics.timer("angles"):
+            landmarks = np.asarray(landmarks)
+            P = landmarks[..., :3]
+            if P.dtype != self.dtype:
+                P = P.astype(self.dtype)
+            _, angles8, _ = preprocess_pose(landmarks, buffers, normalize=False, mask=False,
+                                            dtype=self.dtype)
+        return P, angles8
+
+    def run_landmarks(self, landmarks, fps=30.0):
+        """
+        landmarks: (T,33,4) または (T,33,3)（index.js が送る生座標）
+        """
+        P, angles8 = self.prepare(landmarks)
+        ts = np.arange(len(P)) / fps
+        return self.run(P, angles8, ts)
+
+
+# ============================================================
+# プロセス共通インスタンス
+# ============================================================
+_PIPELINE = None
+_PIPELINE_LOCK = threading.Lock()
+
+
+def get_pipeline():
+    # gunicorn のスレッドから同時に最初の呼び出しが来ても 1 つだけ作る
+    global _PIPELINE
+    if _PIPELINE is None:
+        with _PIPELINE_LOCK:
+            if _PIPELINE is None:
+                _PIPELINE = ScoringPipeline()
+    return _PIPELINE
+
+
+# ============================================================
+# 結果保存（1 セッション = session_artifact.npz 1 ファイル）
+# ============================================================
+@metrics.timer("save")
+def save_result(result, student_dir, landmarks=None, fps=None):
+    """
+    <student_dir>/session_artifact.npz に landmarks・特徴量・スコア表をまとめて保存
+    （CLI と同じ CSV が欲しいときは save_window_features / save_scores を使う）
+    return: artifact のパス
+    """
+    return save_artifact(student_dir, result, landmarks, fps)
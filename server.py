@@ -8,14 +8,25 @@ Render 完全対応版
   ● index.html（録画なし版）から送られる landmarks を直接採点
   ● 動画保存なし
   ● 説明した「方式A（今のscore_student_windows.py）」をそのまま利用
+    （scoring_jobs のワーカープロセスで実行。リクエストはすぐ返す）
   ● login_routes / result_routes もそのまま使える
   ● data/teacher_timing_model.* 不要
 ------------------------------------------------------------
 """
 
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
-import os, uuid, csv, json, subprocess
-import pandas as pd
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, Response
+import os, uuid, json
+import numpy as np
+
+from scoring_pipeline import get_pipeline, save_result
+from scoring_jobs import get_job_queue, run_scoring_job, QueueFull, RETRY_AFTER_SEC
+from landmark_codec import decode_landmarks, CONTENT_TYPE, N_LANDMARKS, N_CHANNELS
+from incremental_scoring import SessionStore
+from live_feedback import sse_stream
+from history_store import get_history_store
+from session_artifact import has_result, load_tables
+from result_retention import start_retention_thread
+import metrics
 
 # === Blueprints ===
 from login_routes import auth_bp
@@ -33,16 +44,13 @@ DATA_DIR = os.path.join(BASE_DIR, "../data")
 RESULTS_DIR = os.path.join(DATA_DIR, "results")
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
-# ============================================================
-# サブプロセス実行（共通関数）
-# ============================================================
-def run_script(cmd):
-    print("▶ 実行:", " ".join(cmd))
-    try:
-        subprocess.run(cmd, cwd=BASE_DIR, check=True)
-        return True, ""
-    except subprocess.CalledProcessError as e:
-        return False, str(e)
+HISTORY_DIR = os.path.join(DATA_DIR, "history")
+
+# 古い landmarks の削除・旧形式フォルダのまとめ（RETENTION_INTERVAL_SEC ごと）
+start_retention_thread(RESULTS_DIR)
+
+# 録画中のチャンク逐次採点セッション
+SESSIONS = SessionStore()
 
 # ============================================================
 # Blueprint 登録
@@ -63,14 +71,75 @@ def record_page():
 
 
 # ============================================================
-# ★ landmarks → CSV に変換して採点（録画なし版の本体）
+# ★ landmarks を受け取って採点（録画なし版の本体）
 # ============================================================
 print("### /score_landmarks CALLED ###", flush=True)
 
+# ============================================================
+# アップロードされた landmarks を (T,33,4) 配列として読む
+# ============================================================
+def read_landmarks_request():
+    """
+    return: (landmarks, fps, None) または (None, None, エラーレスポンス)
+
+    - application/octet-stream : landmark_codec 形式（float32 バイナリ）
+    - application/json          : {"frames": [[[x,y,z,v], ×33], ...]}（旧クライアント、float64）
+    どちらも 33 点 × 4 でなければ 400
+    """
+    if request.mimetype == CONTENT_TYPE:
+        try:
+            landmarks, fps = decode_landmarks(request.get_data(cache=False))
+        except ValueError as e:
+            return None, None, (jsonify({"error": f"landmarks 形式エラー: {e}"}), 400)
+    else:
+        data = request.get_json(silent=True)
+        if not data or "frames" not in data:
+            return None, None, (jsonify({"error": "frames がありません"}), 400)
+        try:
+            # 旧クライアントは今までどおり float64（CSV 経由と同じ精度）
+            landmarks = np.asarray(data["frames"], dtype=np.float64)
+        except ValueError as e:
+            return None, None, (jsonify({"error": f"frames 形式エラー: {e}"}), 400)
+        if landmarks.size > 0 and landmarks.shape[1:] != (N_LANDMARKS, N_CHANNELS):
+            return None, None, (jsonify({"error": f"frames の形が不正: {landmarks.shape}"}), 400)
+        fps = 30.0   # 旧クライアントは 30fps 固定
+
+    if len(landmarks) == 0:
+        return None, None, (jsonify({"error": "フレーム数が 0"}), 400)
+
+    return landmarks, fps, None
+
+
+def read_fps_request(default):
+    """
+    JSON ボディの {"fps": 実測fps}（任意）を読む
+    return: (fps, None) または (None, エラーレスポンス)
+
+    fps が無い・null なら default。数値でない・有限でない・0 以下なら 400
+    （IncrementalSession は T / fps で時刻を出すので 0 以下は受け付けない）
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return None, (jsonify({"error": "JSON オブジェクトではありません"}), 400)
+    value = data.get("fps")
+    if value is None:
+        return default, None
+    try:
+        fps = float(value)
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": f"fps が不正です: {value!r}"}), 400)
+    if isinstance(value, bool) or not np.isfinite(fps) or fps <= 0:
+        return None, (jsonify({"error": f"fps が不正です: {value!r}"}), 400)
+    return fps, None
+
+
 @app.route("/score_landmarks", methods=["POST"])
 def score_landmarks():
     """
-    index.html が送る JSON:
+    index.js が送るバイナリ（Content-Type: application/octet-stream）:
+      landmark_codec.py のヘッダ + float32 (T,33,4)
+
+    旧クライアントの JSON:
       {
         "frames": [
            [[x,y,z,v], ×33 ],
@@ -78,96 +147,209 @@ def score_landmarks():
         ]
       }
     """
-    data = request.get_json()
-    if not data or "frames" not in data:
-        return jsonify({"error": "frames がありません"}), 400
+    with metrics.timer("ingest"):
+        landmarks, fps, err = read_landmarks_request()
+    if err is not None:
+        metrics.count_failure("ingest")
+        return err
+    metrics.count_frames(len(landmarks), "upload")
 
-    frames = data["frames"]
-    if len(frames) == 0:
-        return jsonify({"error": "フレーム数が 0"}), 400
-
-    # 生徒フォルダ作成
     uid = uuid.uuid4().hex[:6]
     student_dir = os.path.join(RESULTS_DIR, f"student_{uid}")
-    lm_dir = os.path.join(student_dir, "landmarks")
-    os.makedirs(lm_dir, exist_ok=True)
+    os.makedirs(student_dir, exist_ok=True)
 
     # ========================================================  
-    # 1. JSON → landmarks.csv へ変換
+    # 1〜3. 特徴量・採点・結果保存はワーカーで（ここでは積むだけ）
     # ========================================================
-    lm_csv = os.path.join(lm_dir, f"student_{uid}_landmarks.csv")
+    user_id = session.get("user_id")
+    try:
+        get_job_queue().submit(
+            uid, run_scoring_job, uid, student_dir, landmarks, fps,
+            on_done=lambda artifact: append_history(user_id, uid, artifact),
+        )
+    except QueueFull as e:
+        print("採点キュー満杯:", e)
+        metrics.count_failure("enqueue")
+        os.rmdir(student_dir)
+        resp = jsonify({"error": "採点が混み合っています。しばらくしてから送り直してください。"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(RETRY_AFTER_SEC)
+        return resp
 
-    with open(lm_csv, "w", newline="") as f:
-        writer = csv.writer(f)
+    return job_accepted(uid)
 
-        header = ["time_sec"]
-        for i in range(33):
-            for ax in ["x", "y", "z", "v"]:
-                header.append(f"{ax}_{i}")
-        writer.writerow(header)
 
-        t = 0.0
-        for frame in frames:
-            row = [t]
-            for p in frame:
-                row += [p[0], p[1], p[2], p[3]]
-            writer.writerow(row)
-            t += 1.0 / 30.0   # 30fps 固定
+def job_accepted(uid):
+    """
+    Accept: application/json のクライアント → 202 + job_id
+    それ以外（旧クライアント） → 結果ページへリダイレクト（採点中表示）
+    """
+    result_url = url_for("result.show_result", student_id=uid)
+    if request.accept_mimetypes.best == "application/json":
+        resp = jsonify({
+            "job_id": uid,
+            "status_url": url_for("score_job_status", job_id=uid),
+            "result_url": result_url,
+        })
+        resp.status_code = 202
+        resp.headers["Location"] = result_url
+        return resp
+    return redirect(result_url)
 
-    print(f"📄 JSON→CSV 保存: {lm_csv}")
 
-    # ========================================================  
-    # 2. ウィンドウ特徴量生成
-    # ========================================================
-    wf_dir = os.path.join(student_dir, "student_window_features")
-    os.makedirs(wf_dir, exist_ok=True)
+@app.route("/score_jobs/<job_id>")
+def score_job_status(job_id):
+    job = get_job_queue().status(job_id)
+    student_dir = os.path.join(RESULTS_DIR, f"student_{job_id}")
 
-    ok, err = run_script([
-        "python3", "make_student_window_features.py",
-        "--indir", lm_dir,
-        "--outdir", wf_dir
-    ])
-    if not ok:
-        return jsonify({"error": f"特徴量生成エラー: {err}"}), 500
+    if job is None:
+        # 別ワーカーのジョブ・再起動前のジョブは結果ファイルで判断
+        if has_result(student_dir):
+            status = "done"
+        elif os.path.isdir(student_dir):
+            status = "unknown"
+        else:
+            return jsonify({"error": "ジョブがありません"}), 404
+        error = None
+    else:
+        status, error = job["status"], job["error"]
 
-    # ========================================================  
-    # 3. 採点
-    # ========================================================
-    ok, err = run_script([
-        "python3", "score_student_windows.py",
-        "--indir", wf_dir,
-        "--outdir", student_dir
-    ])
-    if not ok:
-        return jsonify({"error": f"採点エラー: {err}"}), 500
+    return jsonify({
+        "job_id": job_id,
+        "status": status,
+        "error": error,
+        "queue_depth": get_job_queue().pending(),
+        "result_url": url_for("result.show_result", student_id=job_id),
+    })
 
-    summary_csv = os.path.join(student_dir, "results_score/student_score_summary.csv")
 
-    # ========================================================  
-    # 4. ログインユーザーは履歴に保存
-    # ========================================================
-    user_id = session.get("user_id")
-    if user_id:
-        history_dir = os.path.join(DATA_DIR, "history")
-        os.makedirs(history_dir, exist_ok=True)
-        history_path = os.path.join(history_dir, f"{user_id}_history.csv")
-
-        df_curr = pd.read_csv(summary_csv)
-        from datetime import datetime
-        df_curr["session_id"] = uid
-        df_curr["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        if os.path.exists(history_path):
-            df_old = pd.read_csv(history_path)
-            df_all = pd.concat([df_old, df_curr], ignore_index=True)
-        else:
-            df_all = df_curr
-        df_all.to_csv(history_path, index=False)
+# ============================================================
+# 履歴保存（ログインユーザーのみ）
+# ============================================================
+def append_history(user_id, uid, artifact):
+    if not user_id:
+        return
 
-    # ========================================================  
-    # 5. 結果ページへリダイレクト
-    # ========================================================
-    return redirect(url_for("result.show_result", student_id=uid))
+    df_curr = load_tables(artifact, ["summary"])["summary"]
+    get_history_store(HISTORY_DIR).add_session(
+        user_id, uid, list(zip(df_curr["exercise"], df_curr["mean_score"]))
+    )
+
+
+# ============================================================
+# ★ 録画中のチャンク逐次採点
+#   POST /score_session                 → {"session_id": ...}
+#   POST /score_session/<sid>/chunk     → landmarks チャンク（/score_landmarks と同じ形式）
+#                                          即時フィードバック（live_feedback）にも同じチャンクを使う
+#   POST /score_session/<sid>/finish    → {"fps": 実測fps}（任意）→ 結果ページへ
+# ============================================================
+@app.route("/score_session", methods=["POST"])
+def score_session_start():
+    fps, err = read_fps_request(30.0)
+    if err is not None:
+        return err
+    sid = SESSIONS.create(get_pipeline(), fps=fps)
+    return jsonify({"session_id": sid})
+
+
+@app.route("/score_session/<sid>/chunk", methods=["POST"])
+def score_session_chunk(sid):
+    sess = SESSIONS.get(sid)
+    if sess is None:
+        return jsonify({"error": "セッションがありません"}), 404
+
+    with metrics.timer("ingest"):
+        landmarks, fps, err = read_landmarks_request()
+    if err is not None:
+        metrics.count_failure("ingest")
+        return err
+    metrics.count_frames(len(landmarks), "chunk")
+
+    # 即時スコアを先に（数 ms）。t0 は決まっていれば使う。失敗しても逐次採点は続ける
+    if sess.live.n == 0:
+        sess.live.fps = fps
+    try:
+        sess.live.push(landmarks, sess.t0, sess.offsets)
+    except Exception as e:
+        print("即時フィードバックエラー:", e)
+
+    with sess.lock:
+        if sess.n_frames == 0:
+            sess.fps = fps
+
+        try:
+            with metrics.timer("chunk"):
+                sess.add_frames(landmarks)
+        except Exception as e:
+            print("逐次採点エラー:", e)
+            return jsonify({"error": f"逐次採点エラー: {e}"}), 500
+
+        return jsonify({
+            "frames": sess.n_frames,
+            "done": sess.done_exercises(),
+        })
+
+
+@app.route("/score_session/<sid>/finish", methods=["POST"])
+def score_session_finish(sid):
+    # fps が不正ならセッションは残したまま 400（正しい fps で送り直せる）
+    fps, err = read_fps_request(None)
+    if err is not None:
+        return err
+
+    sess = SESSIONS.pop(sid)
+    if sess is None:
+        return jsonify({"error": "セッションがありません"}), 404
+    if sess.n_frames == 0:
+        return jsonify({"error": "フレーム数が 0"}), 400
+
+    with sess.lock:
+        # 特徴量はほぼ計算済みなので、残りと採点はこのリクエスト内で行う
+        # （landmarks は届いた分をメモリに持っているので、ここで結果と一緒に 1 回だけ書く）
+        try:
+            with metrics.timer("session_finish"):
+                result = sess.finish(fps)
+            artifact = save_result(result, os.path.join(RESULTS_DIR, f"student_{sid}"),
+                                   sess.raw.view(), fps or sess.fps)
+        except Exception as e:
+            print("採点エラー:", e)
+            return jsonify({"error": f"採点エラー: {e}"}), 500
+
+    append_history(session.get("user_id"), sid, artifact)
+    return job_accepted(sid)
+
+
+# ============================================================
+# ★ 録画中の即時フィードバック（live_feedback.py）
+#   フレームは /score_session/<sid>/chunk で届いたものを使う（アップロードは 1 本）
+#   GET  /score_session/<sid>/feedback  → text/event-stream（ウィンドウごとのスコア）
+# ============================================================
+@app.route("/score_session/<sid>/feedback")
+def score_session_feedback(sid):
+    sess = SESSIONS.get(sid)
+    if sess is None:
+        return jsonify({"error": "セッションがありません"}), 404
+
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or 0)
+    except ValueError:
+        last_id = 0
+
+    resp = Response(sse_stream(sess.live, last_id), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"   # プロキシでため込まない
+    return resp
+
+
+# ============================================================
+# ★ 計測値（Prometheus 形式）
+#   採点ジョブのワーカーで測った値もジョブ完了時にここへ集まる
+#   （gunicorn のワーカープロセスごとの値）
+# ============================================================
+@app.route("/metrics")
+def metrics_endpoint():
+    metrics.set_queue_depth(get_job_queue().pending())
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 # ============================================================
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+session_artifact.py（1 セッション = 1 ファイルの採点結果）
+============================================================
+data/results/student_<uid>/session_artifact.npz に
+landmarks・特徴量・スコア表をまとめて圧縮保存する。
+
+  キー                           中身
+  meta.created_at / meta.fps      作成時刻 [unix 秒] / fps
+  landmarks.xyz / landmarks.vis   int16 (T,33,3) / uint8 (T,33)
+                                  （landmark_codec.quantize_landmarks で量子化。
+                                    座標は 1/8192 刻み・誤差 ≤ 6.1e-5、visibility は
+                                    1/255 刻み。元の float32 には戻らない）
+  features.E01 ...                (n_windows,83) float64（SCORING_DTYPE=float32 なら float32）
+  features.__columns__            特徴量の列名
+  <表>.__columns__                表の列名（summary / detail / part_error）
+  <表>.<列>                       列ごとの配列（文字列は unicode 配列）
+
+  ・pickle を使わないので np.load(allow_pickle=False) で読める
+  ・npz は必要なキーだけ読むので、結果ページは landmarks を読まない
+  ・保存は一時ファイル → os.replace（読み手が書きかけを見ない）
+  ・期限切れの landmarks だけを抜いた版に書き換えられる（スコアは残る）
+  ・保存される landmarks は量子化済みなので、load_landmarks → 採点し直すと
+    保存時の特徴量・スコアとは一致しない。差の上限は
+    tests/test_landmark_codec.py::test_quantized_scores_match_float32 で確認している
+    （特徴量 |q - f| / (|f| + 1) ≤ 0.05、ウィンドウのスコア ±0.1 点、
+    体操ごとの平均 ±0.01 点）。保存時のスコアをそのまま再現したいときは
+    features.* を使う（rescore_sessions.py の既定）
+
+旧形式（landmarks CSV・student_window_features/・results_score/*.csv）の
+フォルダは compact_legacy_dir() で 1 ファイルにまとめられる。
+
+再採点（rescore_sessions.py）の結果は同じフォルダの scores_<version>.npz に
+スコア表だけを保存し、元の artifact は書き換えない。
+結果ページはいちばん新しい scores_<version>.npz があればそれを表示する。
+============================================================
+"""
+
+import os
+import time
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from landmark_codec import quantize_landmarks, dequantize_landmarks
+
+ARTIFACT_NAME = "session_artifact.npz"
+SCORES_PREFIX = "scores_"
+
+TABLES = ("summary", "detail", "part_error")
+
+
+def artifact_path(student_dir):
+    return os.path.join(student_dir, ARTIFACT_NAME)
+
+
+def legacy_summary_path(student_dir):
+    return os.path.join(student_dir, "results_score", "student_score_summary.csv")
+
+
+def scores_path(student_dir, version):
+    return os.path.join(student_dir, f"{SCORES_PREFIX}{version}.npz")
+
+
+def latest_scores_path(student_dir):
+    """いちばん新しい再採点結果（無ければ None）"""
+    paths = glob(os.path.join(student_dir, f"{SCORES_PREFIX}*.npz"))
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def has_result(student_dir):
+    """採点結果があるか（新形式・旧 CSV のどちらでも）"""
+    return os.path.exists(artifact_path(student_dir)) or os.path.exists(legacy_summary_path(student_dir))
+
+
+# ============================================================
+# 保存
+# ============================================================
+def _table_arrays(name, df):
+    arrays = {f"{name}.__columns__": np.array(list(df.columns), dtype=str)}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[f"{name}.{col}"] = values
+    return arrays
+
+
+def _feature_arrays(features):
+    arrays = {}
+    columns = None
+    for eid, df in features.items():
+        arrays[f"features.{eid}"] = df.to_numpy()
+        columns = list(df.columns)
+    if columns is not None:
+        arrays["features.__columns__"] = np.array(columns, dtype=str)
+    return arrays
+
+
+def _write(path, arrays):
+    tmp = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def save_artifact(student_dir, result, landmarks=None, fps=None, created_at=None):
+    """
+    result   : ScoringPipeline.score() の dict（features / summary / detail / part_error）
+    landmarks: (T,33,4)（None なら landmarks 無しで保存）
+    return   : artifact のパス
+    """
+    os.makedirs(student_dir, exist_ok=True)
+
+    arrays = {
+        "meta.created_at": np.float64(time.time() if created_at is None else created_at),
+        "meta.fps": np.float64(fps if fps is not None else np.nan),
+    }
+
+    if landmarks is not None:
+        arrays["landmarks.xyz"], arrays["landmarks.vis"] = quantize_landmarks(landmarks)
+
+    arrays.update(_feature_arrays(result.get("features") or {}))
+
+    for name in TABLES:
+        if result.get(name) is not None:
+            arrays.update(_table_arrays(name, result[name]))
+
+    path = artifact_path(student_dir)
+    _write(path, arrays)
+    return path
+
+
+def save_scores_version(student_dir, version, result, created_at=None):
+    """再採点したスコア表を scores_<version>.npz に保存（特徴量・landmarks は入れない）"""
+    arrays = {"meta.created_at": np.float64(time.time() if created_at is None else created_at)}
+    for name in TABLES:
+        if result.get(name) is not None:
+            arrays.update(_table_arrays(name, result[name]))
+    path = scores_path(student_dir, version)
+    _write(path, arrays)
+    return path
+
+
+def save_features(path, features):
+    """
+    特徴量だけを 1 ファイルに保存（make_student_window_features.py --format npz）
+    load_features() でそのまま読める
+    """
+    _write(path, _feature_arrays(features))
+    return path
+
+
+# ============================================================
+# 読み出し
+# ============================================================
+def load_tables(path, tables=TABLES):
+    """return: {表名: DataFrame}（無い表は入らない）"""
+    out = {}
+    with np.load(path, allow_pickle=False) as z:
+        keys = set(z.files)
+        for name in tables:
+            ck = f"{name}.__columns__"
+            if ck not in keys:
+                continue
+            data = {}
+            for col in z[ck].tolist():
+                values = z[f"{name}.{col}"]
+                data[col] = values.astype(object) if values.dtype.kind == "U" else values
+            out[name] = pd.DataFrame(data)
+    return out
+
+
+def load_features(path):
+    """
+    session_artifact.npz / save_features() のファイル
+    return: {eid: DataFrame(n_windows,83)}
+    """
+    with np.load(path, allow_pickle=False) as z:
+        if "features.__columns__" not in z.files:
+            return {}
+        columns = z["features.__columns__"].tolist()
+        return {
+            k[len("features."):]: pd.DataFrame(z[k], columns=columns)
+            for k in sorted(z.files)
+            if k.startswith("features.") and k != "features.__columns__"
+        }
+
+
+def load_landmarks(path):
+    """
+    return: (landmarks (T,33,4) float32, fps)（削除済みなら (None, fps)）
+    ※ int16 量子化から戻した値（アップロードされた座標そのものではない）
+    """
+    with np.load(path, allow_pickle=False) as z:
+        fps = float(z["meta.fps"])
+        if "landmarks.xyz" not in z.files:
+            return None, fps
+        return dequantize_landmarks(z["landmarks.xyz"], z["landmarks.vis"]), fps
+
+
+def read_meta(path):
+    """return: {"created_at", "fps", "has_landmarks"}"""
+    with np.load(path, allow_pickle=False) as z:
+        return {
+            "created_at": float(z["meta.created_at"]),
+            "fps": float(z["meta.fps"]),
+            "has_landmarks": "landmarks.xyz" in z.files,
+        }
+
+
+# ============================================================
+# 整理（retention）
+# ============================================================
+def strip_landmarks(path):
+    """
+    landmarks だけを抜いて書き直す（スコア・特徴量は残す）
+    return: 減ったバイト数
+    """
+    with np.load(path, allow_pickle=False) as z:
+        if "landmarks.xyz" not in z.files:
+            return 0
+        arrays = {k: z[k] for k in z.files if not k.startswith("landmarks.")}
+    before = os.path.getsize(path)
+    _write(path, arrays)
+    return before - os.path.getsize(path)
+
+
+def _read_landmarks_csv(path):
+    """旧形式の landmarks CSV（time_sec, x_0, y_0, z_0, v_0, ...）→ ((T,33,4), fps)"""
+    df = pd.read_csv(path)
+    ts = df["time_sec"].to_numpy()
+    data = df.drop(columns=["time_sec"]).to_numpy(dtype=np.float32)
+    landmarks = data.reshape(len(df), -1, 4)
+    fps = (len(ts) - 1) / (ts[-1] - ts[0]) if len(ts) > 1 and ts[-1] > ts[0] else np.nan
+    return landmarks, fps
+
+
+def compact_legacy_dir(student_dir):
+    """
+    旧形式のフォルダ（CSV だらけ）→ session_artifact.npz 1 つにまとめて CSV を消す
+    return: まとめたら True（採点結果が無い・まとめ済みなら False）
+    """
+    summary_csv = legacy_summary_path(student_dir)
+    if not os.path.exists(summary_csv) or os.path.exists(artifact_path(student_dir)):
+        return False
+
+    score_dir = os.path.dirname(summary_csv)
+    result = {"summary": pd.read_csv(summary_csv)}
+    for name, fname in (("detail", "student_score_detail.csv"), ("part_error", "student_part_error.csv")):
+        p = os.path.join(score_dir, fname)
+        if os.path.exists(p):
+            result[name] = pd.read_csv(p)
+
+    wf_dir = os.path.join(student_dir, "student_window_features")
+    features = {}
+    for e_dir in sorted(glob(os.path.join(wf_dir, "E*"))):
+        csvs = sorted(glob(os.path.join(e_dir, "*.csv")))
+        if csvs:
+            features[os.path.basename(e_dir)] = pd.read_csv(csvs[0])
+    result["features"] = features
+
+    lm_csvs = sorted(glob(os.path.join(student_dir, "landmarks", "*_landmarks.csv")))
+    landmarks, fps = (None, None)
+    if lm_csvs:
+        landmarks, fps = _read_landmarks_csv(lm_csvs[0])
+
+    save_artifact(student_dir, result, landmarks, fps, created_at=os.path.getmtime(summary_csv))
+
+    # まとめ終わった CSV を消す
+    for p in glob(os.path.join(score_dir, "*.csv")) + glob(os.path.join(wf_dir, "E*", "*.csv")) + lm_csvs:
+        os.remove(p)
+    for d in sorted(glob(os.path.join(wf_dir, "E*"))) + [wf_dir, score_dir, os.path.join(student_dir, "landmarks")]:
+        if os.path.isdir(d) and not os.listdir(d):
+            os.rmdir(d)
+    return True
@@ -117,19 +117,29 @@ async function sendMessage() {
     try {
         const res = await fetch("/chat_api", {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
+            headers: {
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream"
+            },
             body: JSON.stringify({
                 message: text,
                 user_id: CURRENT_USER_ID
             })
         });
 
+        if (res.status === 503) {
+            answerTextArea.value = "コーチが混み合っています。少し待ってからもう一度送ってください";
+            return;
+        }
         if (!res.ok) {
             throw new Error("chat api error");
         }
 
-        const data = await res.json();
-        answerTextArea.value = data.reply;
+        // ★ 返答をトークンごとに表示（text/event-stream）
+        answerTextArea.value = "";
+        await readReplyStream(res, delta => {
+            answerTextArea.value += delta;
+        });
 
     } catch (e) {
         console.error(e);
@@ -137,6 +147,40 @@ async function sendMessage() {
     }
 }
 
+// ================================
+// /chat_api の text/event-stream を読む
+//   data: {"delta": "..."} → onDelta
+//   event: done で終わり / event: error なら例外
+// ================================
+async function readReplyStream(res, onDelta) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buf += decoder.decode(value, { stream: true });
+
+        let sep;
+        while ((sep = buf.indexOf("\n\n")) >= 0) {
+            const block = buf.slice(0, sep);
+            buf = buf.slice(sep + 2);
+
+            let event = "message";
+            let data = "";
+            for (const line of block.split("\n")) {
+                if (line.startsWith("event:")) event = line.slice(6).trim();
+                else if (line.startsWith("data:")) data += line.slice(5).trim();
+            }
+
+            if (event === "done") return;
+            if (event === "error") throw new Error(JSON.parse(data).error);
+            if (data) onDelta(JSON.parse(data).delta);
+        }
+    }
+}
+
 // ================================
 // リンクトリガー（既存）
 // ================================
@@ -6,6 +6,7 @@ const scoreEl = document.getElementById("score");
 const startBtn = document.getElementById("start-btn");
 const stopBtn = document.getElementById("stop-btn");
 const countdownEl = document.getElementById("countdown");
+const liveScoreEl = document.getElementById("live-score");
 
 // ===== 状態 =====
 let camera = null;
@@ -18,8 +19,21 @@ let cameraStarted = false;
 
 // ★ landmarks を溜める
 let allFrames = [];
+let recordStartTime = 0;
+
+// ★ 録画中のチャンク送信（/score_session）
+//   同じチャンクで逐次採点と即時スコア（SSE /feedback）の両方を行う
+let scoreSessionId = null;
+let sentFrames = 0;
+let queuedFrames = 0;
+let chunkChain = Promise.resolve();
+
+// ★ 録画中の即時スコア（SSE /feedback）
+let liveSource = null;
 
 const INSIDE_FRAMES = 30;
+const CHUNK_FRAMES = 15;      // サーバーの HOP と同じ（15 フレームごとに 1 ウィンドウ）
+const LIVE_GOOD_SCORE = 80;   // これ未満なら部位のヒントを出す
 
 // 描画サイズ
 canvas.width = 720;
@@ -70,6 +84,9 @@ pose.onResults(results => {
     ]);
     if (running) {
       allFrames.push(frame);
+      if (scoreSessionId && allFrames.length - queuedFrames >= CHUNK_FRAMES) {
+        queueChunk();
+      }
     }
 
     if (showBox) {
@@ -163,9 +180,11 @@ function showStep(i) {
 async function startExercise() {
   running = true;
   allFrames = [];
+  recordStartTime = performance.now();
   startBtn.disabled = true;
   stopBtn.disabled = false;
   showStep(0);
+  startScoreSession();
 
   let i = 0;
   function next() {
@@ -181,6 +200,147 @@ async function startExercise() {
   setTimeout(next, steps[0].duration);
 }
 
+// ===== landmarks → バイナリ（landmark_codec.py と同じ形式） =====
+// ヘッダ 16byte: "RTLM", version=1, dtype, 点数(u16), フレーム数(u32), fps(f32)
+// dtype=2（int16 量子化・既定）:
+//   本体: int16 × フレーム数 × 33 × 3 (x, y, z を 8192 倍) + uint8 × フレーム数 × 33 (visibility × 255)
+//   座標の誤差は 1/16384 以下。-32768 は NaN（見失った点）
+// dtype=1（float32）:
+//   本体: float32 × フレーム数 × 33 × 4 (x, y, z, visibility)
+const QUANT_SCALE = 8192;
+const QUANT_NAN = -32768;
+
+function encodeLandmarks(frames, fps, quantize = true) {
+  const T = frames.length;
+  const L = T > 0 ? frames[0].length : 33;
+  const HEADER = 16;
+  const size = quantize ? T * L * 7 : T * L * 4 * 4;
+  const buf = new ArrayBuffer(HEADER + size);
+  const dv = new DataView(buf);
+
+  "RTLM".split("").forEach((c, i) => dv.setUint8(i, c.charCodeAt(0)));
+  dv.setUint8(4, 1);
+  dv.setUint8(5, quantize ? 2 : 1);
+  dv.setUint16(6, L, true);
+  dv.setUint32(8, T, true);
+  dv.setFloat32(12, fps, true);
+
+  if (quantize) {
+    const q = (x) => {
+      if (x === undefined || x === null || Number.isNaN(x)) return QUANT_NAN;
+      return Math.max(-32767, Math.min(32767, Math.round(x * QUANT_SCALE)));
+    };
+    let off = HEADER;
+    let voff = HEADER + T * L * 6;
+    for (const frame of frames) {
+      for (const p of frame) {
+        dv.setInt16(off, q(p[0]), true);
+        dv.setInt16(off + 2, q(p[1]), true);
+        dv.setInt16(off + 4, q(p[2]), true);
+        off += 6;
+        const v = p[3] ?? 0;
+        dv.setUint8(voff, Math.max(0, Math.min(255, Math.round((Number.isNaN(v) ? 0 : v) * 255))));
+        voff += 1;
+      }
+    }
+    return buf;
+  }
+
+  let off = HEADER;
+  for (const frame of frames) {
+    for (const p of frame) {
+      dv.setFloat32(off, p[0], true);
+      dv.setFloat32(off + 4, p[1], true);
+      dv.setFloat32(off + 8, p[2], true);
+      dv.setFloat32(off + 12, p[3] ?? 0, true);
+      off += 16;
+    }
+  }
+  return buf;
+}
+
+// ===== 実際の録画フレームレート（取れなければ 30fps） =====
+function measuredFps() {
+  const elapsedSec = (performance.now() - recordStartTime) / 1000;
+  return elapsedSec > 0 && allFrames.length > 0
+    ? allFrames.length / elapsedSec
+    : 30;
+}
+
+// ===== チャンク逐次採点セッション =====
+async function startScoreSession() {
+  scoreSessionId = null;
+  sentFrames = 0;
+  queuedFrames = 0;
+  chunkChain = Promise.resolve();
+
+  try {
+    const res = await fetch("/score_session", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ fps: 30 })
+    });
+    if (!res.ok) return;
+    scoreSessionId = (await res.json()).session_id;
+    startLiveFeedback(scoreSessionId);
+  } catch (e) {
+    console.error(e);
+  }
+}
+
+// 送信は必ず順番どおり（前のチャンクの後ろにつなぐ。
+// フレームの番号がサーバーの窓の位置とずれないように）
+function queueChunk() {
+  queuedFrames = allFrames.length;
+  chunkChain = chunkChain.then(sendChunk);
+  return chunkChain;
+}
+
+async function sendChunk() {
+  if (!scoreSessionId) return;
+  const frames = allFrames.slice(sentFrames);
+  if (frames.length === 0) return;
+
+  try {
+    const res = await fetch(`/score_session/${scoreSessionId}/chunk`, {
+      method: "POST",
+      headers: { "Content-Type": "application/octet-stream" },
+      body: encodeLandmarks(frames, measuredFps())
+    });
+    if (!res.ok) throw new Error(`chunk ${res.status}`);
+    sentFrames += frames.length;
+  } catch (e) {
+    // 失敗したら逐次採点・即時スコアはやめて、終了時に全フレームを送る
+    console.error(e);
+    scoreSessionId = null;
+    stopLiveFeedback();
+  }
+}
+
+// ===== 録画中の即時スコア（SSE） =====
+function startLiveFeedback(sid) {
+  liveScoreEl.textContent = "";
+  liveScoreEl.className = "";
+
+  liveSource = new EventSource(`/score_session/${sid}/feedback`);
+  liveSource.onmessage = (e) => showLiveScore(JSON.parse(e.data));
+  liveSource.addEventListener("end", stopLiveFeedback);
+}
+
+function stopLiveFeedback() {
+  if (liveSource) liveSource.close();
+  liveSource = null;
+}
+
+function showLiveScore(ev) {
+  if (ev.score === null || ev.score === undefined) return;
+  const good = ev.score >= LIVE_GOOD_SCORE;
+  liveScoreEl.textContent = good || !ev.part
+    ? `いまの動き: ${Math.round(ev.score)} 点`
+    : `いまの動き: ${Math.round(ev.score)} 点（${ev.part}を意識しよう）`;
+  liveScoreEl.className = good ? "good" : "bad";
+}
+
 // ===== 体操終了 → 採点送信 =====
 async function stopExercise() {
   running = false;
@@ -189,15 +349,66 @@ async function stopExercise() {
   showStep(-1);
   scoreEl.textContent = "採点中...";
 
-  const res = await fetch("/score_landmarks", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ frames: allFrames })
-  });
+  stopLiveFeedback();
+  const fps = measuredFps();
 
+  // ① 逐次採点セッション：残りのチャンクを送って finish
+  if (scoreSessionId) {
+    await queueChunk();
+    if (scoreSessionId) {
+      try {
+        const res = await fetch(`/score_session/${scoreSessionId}/finish`, {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+          },
+          body: JSON.stringify({ fps })
+        });
+        if (await goToResult(res)) return;
+      } catch (e) {
+        console.error(e);
+      }
+    }
+  }
+
+  // ② フォールバック：全フレームを一括送信（混雑中 503 なら待って再送）
+  const body = encodeLandmarks(allFrames, fps);
+  for (let attempt = 0; attempt < 10; attempt++) {
+    const res = await fetch("/score_landmarks", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/octet-stream",
+        "Accept": "application/json"
+      },
+      body
+    });
+
+    if (res.status === 503) {
+      const wait = Number(res.headers.get("Retry-After") || 5);
+      scoreEl.textContent = `採点が混み合っています… ${wait}秒後に再送します`;
+      await new Promise(r => setTimeout(r, wait * 1000));
+      continue;
+    }
+
+    await goToResult(res);
+    return;
+  }
+  scoreEl.textContent = "採点を受け付けられませんでした。もう一度お試しください。";
+}
+
+// ===== 採点受付（202 + job）→ 結果ページ（採点中表示）へ =====
+async function goToResult(res) {
   if (res.redirected) {
     location.href = res.url;
+    return true;
+  }
+  if (res.status === 202) {
+    const data = await res.json();
+    location.href = data.result_url;
+    return true;
   }
+  return false;
 }
 
 // ===== ボタン =====
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+synthetic_session.py（ラジオ体操の合成セッション生成）
+============================================================
+ベンチマーク・動作確認用に、MediaPipe Pose と同じ形の
+landmarks (T,33,4) [x, y, z, visibility] を作る。
+
+  ・前奏（E00）はほぼ静止、E01 開始から体操ごとに周期運動
+  ・区間は data/teacher_timing_model.json の秒数に合わせる
+  ・体操の中身はおおまかな動き（腕の上げ下げ・回旋・膝の屈伸・
+    体幹の曲げ/ねじり・跳躍）を関節角度で作り、骨格に組み立てる
+  ・座標は画像正規化座標（x, y: 0〜1, y は下向き）
+  ・指定時間が 1 回分（約 3.3 分）より長いときは体操を繰り返す
+
+使い方:
+  python synthetic_session.py --minutes 3.5 --out session.npz
+============================================================
+"""
+
+import argparse
+import numpy as np
+
+from make_student_window_features import E_TIMES
+
+N_LANDMARKS = 33
+
+# 前奏（E00）の長さ [sec]：E01 開始までほぼ静止
+LEAD_IN_SEC = -E_TIMES["E00"]["start"]
+
+# 体操 1 回分の長さ [sec]（前奏込み）
+ROUTINE_SEC = LEAD_IN_SEC + E_TIMES["E13"]["end"]
+
+# 体操ごとの動き: (動きの種類, 周波数 [Hz])
+EXERCISE_MOTION = {
+    "E01": ("arms_up",      0.25),
+    "E02": ("arms_swing",   0.50),
+    "E03": ("arms_circle",  0.40),
+    "E04": ("chest",        0.30),
+    "E05": ("side_bend",    0.25),
+    "E06": ("forward_bend", 0.30),
+    "E07": ("twist",        0.40),
+    "E08": ("arms_updown",  0.50),
+    "E09": ("diag_bend",    0.25),
+    "E10": ("trunk_circle", 0.20),
+    "E11": ("jump",         1.00),
+    "E12": ("arms_swing",   0.50),
+    "E13": ("arms_up",      0.15),
+}
+
+# 骨格の寸法（画像正規化座標）
+HIP_HALF = 0.08        # 腰幅の半分
+SHOULDER_HALF = 0.11   # 肩幅の半分
+TRUNK = 0.25           # 腰→肩
+UPPER_ARM = 0.12
+FOREARM = 0.12
+THIGH = 0.15
+SHIN = 0.15
+
+
+# ============================================================
+# 体操ごとの関節角度（フレームごと）
+# ============================================================
+def _motion_params(t_rel):
+    """
+    t_rel: (T,) E01 開始からの秒数（体操 1 回分の中の位置）
+    return: 各パラメータ (T,) の dict
+      armL / armR : 腕の挙上角 [rad]（0 = 下ろす, π = 真上）
+      knee        : 膝の曲げ 0〜1
+      lean_x      : 体幹の横曲げ（肩の x ずれ）
+      lean_y      : 体幹の前屈（肩の y 下がり）
+      lean_z      : 体幹の前後（肩の z）
+      twist       : 体幹のねじり [rad]
+      lift        : 全身の上下（跳躍）
+    """
+    T = len(t_rel)
+    p = {k: np.zeros(T) for k in
+         ["armL", "armR", "knee", "lean_x", "lean_y", "lean_z", "twist", "lift"]}
+
+    for eid, (kind, freq) in EXERCISE_MOTION.items():
+        se = E_TIMES[eid]
+        # 隣の体操と区間が重なる部分は後ろの体操を優先
+        m = (t_rel >= se["start"]) & (t_rel < se["end"])
+        if not m.any():
+            continue
+        ph = 2 * np.pi * freq * (t_rel[m] - se["start"])
+        s, c = np.sin(ph), np.cos(ph)
+        up = 0.5 * (1 - c)                       # 0 → 1 → 0
+
+        if kind == "arms_up":
+            p["armL"][m] = p["armR"][m] = np.pi * up
+        elif kind == "arms_swing":
+            p["armL"][m] = p["armR"][m] = 0.6 * np.pi * up
+            p["knee"][m] = 0.6 * np.abs(s)
+        elif kind == "arms_circle":
+            p["armL"][m] = p["armR"][m] = np.mod(ph, 2 * np.pi) / 2
+        elif kind == "chest":
+            p["armL"][m] = p["armR"][m] = 0.5 * np.pi + 0.25 * np.pi * s
+            p["lean_z"][m] = 0.05 * up
+        elif kind == "side_bend":
+            p["armL"][m] = np.pi * np.clip(s, 0, 1)
+            p["armR"][m] = np.pi * np.clip(-s, 0, 1)
+            p["lean_x"][m] = 0.06 * s
+        elif kind == "forward_bend":
+            p["lean_y"][m] = 0.10 * up
+            p["lean_z"][m] = -0.12 * up
+            p["armL"][m] = p["armR"][m] = 0.3 * np.pi * up
+        elif kind == "twist":
+            p["twist"][m] = 0.6 * s
+            p["armL"][m] = p["armR"][m] = 0.4 * np.pi * np.abs(s)
+        elif kind == "arms_updown":
+            p["armL"][m] = p["armR"][m] = 0.5 * np.pi + 0.5 * np.pi * s
+            p["knee"][m] = 0.3 * up
+        elif kind == "diag_bend":
+            p["lean_y"][m] = 0.08 * up
+            p["lean_x"][m] = 0.05 * s
+            p["armL"][m] = p["armR"][m] = 0.5 * np.pi * up
+        elif kind == "trunk_circle":
+            p["lean_x"][m] = 0.06 * s
+            p["lean_z"][m] = 0.06 * c
+            p["armL"][m] = p["armR"][m] = np.pi * up
+        elif kind == "jump":
+            p["lift"][m] = 0.04 * np.abs(s)
+            p["armL"][m] = p["armR"][m] = 0.4 * np.pi * np.abs(s)
+
+    return p
+
+
+# ============================================================
+# 骨格の組み立て（関節角度 → 33 点）
+# ============================================================
+def _build_skeleton(p):
+    T = len(p["armL"])
+    P = np.zeros((T, N_LANDMARKS, 3))
+    k = p["knee"]
+
+    def put(i, x, y, z):
+        P[:, i, 0], P[:, i, 1], P[:, i, 2] = x, y, z
+
+    lift = -p["lift"]                            # y は下向き
+    hip_y = 0.60 + 0.05 * k + lift
+
+    # --- 脚 ---
+    for side, (hip, knee, ankle) in ((-1, (23, 25, 27)), (1, (24, 26, 28))):
+        x = 0.5 + side * HIP_HALF
+        put(hip, x, hip_y, 0.0)
+        put(knee, x, hip_y + THIGH * (1 - 0.3 * k), -0.10 * k)
+        put(ankle, x, 0.90 + lift, 0.0)
+        # 踵・つま先
+        put(hip + 6, x, 0.91 + lift, 0.03)
+        put(hip + 8, x + side * 0.01, 0.92 + lift, -0.05)
+
+    # --- 体幹（横曲げ・前屈・ねじり） ---
+    sc_x = 0.5 + p["lean_x"]
+    sc_y = hip_y - TRUNK + p["lean_y"]
+    sc_z = p["lean_z"]
+    tw = p["twist"]
+    for side, (sh, el, wr, arm) in ((-1, (11, 13, 15, "armL")), (1, (12, 14, 16, "armR"))):
+        sx = sc_x + side * SHOULDER_HALF * np.cos(tw)
+        sz = sc_z + side * SHOULDER_HALF * np.sin(tw)
+        put(sh, sx, sc_y, sz)
+
+        # 腕は前額面で肩まわりに回す（真っすぐ伸ばした腕）
+        th = p[arm]
+        dx, dy = side * np.sin(th), np.cos(th)
+        put(el, sx + UPPER_ARM * dx, sc_y + UPPER_ARM * dy, sz)
+        wx = sx + (UPPER_ARM + FOREARM) * dx
+        wy = sc_y + (UPPER_ARM + FOREARM) * dy
+        put(wr, wx, wy, sz)
+        # 小指・人差し指・親指
+        put(sh + 6, wx + side * 0.01, wy + 0.02 * dy, sz)
+        put(sh + 8, wx, wy + 0.025 * dy, sz - 0.01)
+        put(sh + 10, wx - side * 0.01, wy + 0.015 * dy, sz - 0.01)
+
+    # --- 顔（鼻・目・耳・口） ---
+    nose_y = sc_y - 0.12
+    put(0, sc_x, nose_y, sc_z - 0.05)
+    for side, (inner, eye, outer, ear, mouth) in ((-1, (1, 2, 3, 7, 9)), (1, (4, 5, 6, 8, 10))):
+        put(inner, sc_x + side * 0.010, nose_y - 0.02, sc_z - 0.04)
+        put(eye, sc_x + side * 0.020, nose_y - 0.02, sc_z - 0.04)
+        put(outer, sc_x + side * 0.030, nose_y - 0.02, sc_z - 0.04)
+        put(ear, sc_x + side * 0.050, nose_y - 0.01, sc_z)
+        put(mouth, sc_x + side * 0.015, nose_y + 0.02, sc_z - 0.04)
+
+    return P
+
+
+# ============================================================
+# セッション生成
+# ============================================================
+def make_session(minutes=3.5, fps=30.0, noise=0.003, seed=0):
+    """
+    minutes: 録画の長さ [分]
+    fps    : フレームレート
+    noise  : 座標に足すガウスノイズの標準偏差（正規化座標）
+    return : landmarks (T,33,4) float32
+    """
+    rng = np.random.default_rng(seed)
+    T = int(round(minutes * 60 * fps))
+    t = np.arange(T) / fps
+
+    # 前奏込みで体操 1 回分を繰り返す
+    t_rel = np.mod(t, ROUTINE_SEC) - LEAD_IN_SEC
+
+    P = _build_skeleton(_motion_params(t_rel))
+
+    # 体格・立ち位置のばらつき
+    scale = rng.uniform(0.9, 1.1)
+    shift = rng.uniform(-0.05, 0.05, size=2)
+    P[..., :2] = (P[..., :2] - 0.5) * scale + 0.5 + shift
+
+    P += rng.normal(0.0, noise, size=P.shape)
+
+    vis = rng.uniform(0.85, 1.0, size=(T, N_LANDMARKS, 1))
+    # たまに見失う（visibility が下がる）フレーム
+    vis[rng.random((T, N_LANDMARKS, 1)) < 0.01] *= 0.3
+
+    return np.concatenate([P, vis], axis=-1).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ラジオ体操の合成 landmarks を作る")
+    parser.add_argument("--minutes", type=float, default=3.5)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--noise", type=float, default=0.003)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="出力 .npz（landmarks, fps）")
+    args = parser.parse_args()
+
+    landmarks = make_session(args.minutes, args.fps, args.noise, args.seed)
+    np.savez_compressed(args.out, landmarks=landmarks, fps=args.fps)
+    print(f"✅ {args.out}: {landmarks.shape} @ {args.fps} fps")
+
+
+if __name__ == "__main__":
+    main()
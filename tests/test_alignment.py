@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# alignment.py：FFT 相互相関が直接計算と一致するか、録画の頭に前奏を足すと
+# t0 がその分だけずれるか、体操ごとのずれが ±MAX_EXERCISE_SHIFT_SEC に収まるか
+
+import numpy as np
+import pytest
+
+from synthetic_session import make_session
+from compute_20_angles import compute_20_angles
+from score_student_windows import load_teacher_profile
+from alignment import Aligner, xcorr_fft, motion_energy, MAX_EXERCISE_SHIFT_SEC, STEP_SEC
+
+# 教師テンプレート（E01〜E13）全体が入る長さ [分]
+FULL_SESSION_MINUTES = 3.5
+
+# 頭に足す静止フレーム数（30fps で 2 秒 = 4 step）
+PAD_FRAMES = 60
+
+
+@pytest.fixture(scope="module")
+def aligner():
+    return Aligner(load_teacher_profile(), per_exercise=True)
+
+
+@pytest.fixture(scope="module")
+def angle20(fps):
+    L = make_session(FULL_SESSION_MINUTES, fps)
+    return compute_20_angles(L[..., :3].astype(np.float64)).to_numpy()
+
+
+def test_xcorr_fft_matches_direct():
+    rng = np.random.default_rng(0)
+    for n, m in ((50, 7), (64, 64), (10, 1), (9, 30)):
+        s, t = rng.normal(size=n), rng.normal(size=m)
+        c, lags = xcorr_fft(s, t)
+        assert len(c) == len(lags) == n + m - 1
+        assert lags[0] == -(m - 1) and lags[-1] == n - 1
+        np.testing.assert_allclose(c, np.correlate(s, t, mode="full"), atol=1e-10)
+
+
+def test_recovers_embedded_template(aligner):
+    """テンプレートを既知の位置に埋めた信号 → そのずれが出る"""
+    t = aligner.template
+    s = np.concatenate([np.zeros(37), t, np.zeros(20)])
+    c, lags = xcorr_fft(s, t)
+    assert lags[np.argmax(c)] == 37
+
+
+def test_lead_in_shifts_t0(aligner, angle20, fps):
+    ts = np.arange(len(angle20)) / fps
+    al = aligner(angle20, ts)
+
+    padded = np.concatenate([np.repeat(angle20[:1], PAD_FRAMES, axis=0), angle20])
+    al2 = aligner(padded, np.arange(len(padded)) / fps)
+
+    assert al2.t0_ms - al.t0_ms == pytest.approx(PAD_FRAMES / fps * 1000.0, abs=1e-6)
+    assert al2.exercise_offsets_ms.keys() == al.exercise_offsets_ms.keys()
+    for eid, ms in al.exercise_offsets_ms.items():
+        assert al2.exercise_offsets_ms[eid] == pytest.approx(ms, abs=1e-6)
+        assert abs(ms) <= MAX_EXERCISE_SHIFT_SEC * 1000.0
+
+
+def test_motion_energy_steps(angle20, fps):
+    e = motion_energy(angle20, fps)
+    # 1 秒窓を 0.5 秒ずつ
+    assert len(e) == (len(angle20) - int(fps)) // int(STEP_SEC * fps) + 1
+    assert np.all(np.isfinite(e))
+    assert len(motion_energy(angle20[:10], fps)) == 0
+
+
+def test_short_recording(aligner, fps):
+    al = aligner(np.zeros((10, 20)), np.arange(10) / fps)
+    assert al.t0_ms == 0.0 and al.exercise_offsets_ms == {}
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# build_teacher_profile.py：P² の中央値（EXACT_MAX 本までは厳密）と、録画を 1 本ずつ
+# 読んで作ったプロファイル・時間モデルが全部まとめて求めた値と同じになるか
+
+import contextlib
+import io
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from build_teacher_profile import (
+    P2Median, ExerciseAccumulator, EXACT_MAX,
+    build_profile, read_segments, recording_features, save_profile,
+    PROFILE_NAME, TIMING_NAME,
+)
+
+# 観測が EXACT_MAX を超えたあとの P² の誤差（標準正規の中央値に対して）
+P2_TOL = 0.1
+
+
+def test_exact_median_up_to_exact_max():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(EXACT_MAX, 40))
+    X[rng.random(X.shape) < 0.1] = np.nan   # NaN は数えない
+
+    med = P2Median()
+    for row in X[:7]:
+        med.update(row)
+    np.testing.assert_array_equal(med.median(), np.nanmedian(X[:7], axis=0))
+
+    for row in X[7:]:
+        med.update(row)
+    # 最後の 1 本でマーカーに切り替わったセルも、まだのセルも厳密
+    np.testing.assert_allclose(med.median(), np.nanmedian(X, axis=0), rtol=0, atol=1e-12)
+
+
+def test_streaming_median_is_bounded():
+    rng = np.random.default_rng(1)
+    n_cells = 50
+    shift = np.linspace(-3, 3, n_cells)
+    med = P2Median(n_cells)
+    for _ in range(2000):
+        med.update(rng.normal(size=n_cells) + shift)
+
+    # 観測が何本あっても持つのは EXACT_MAX 本分のバッファとマーカーだけ
+    assert med.buf.shape == (n_cells, EXACT_MAX)
+    assert (med.count == 2000).all()
+    assert np.abs(med.median() - shift).max() < P2_TOL
+
+
+def test_empty_cells_are_nan():
+    med = P2Median()
+    med.update([1.0, np.nan])
+    med.update([3.0])
+    out = med.median()
+    assert out[0] == 2.0 and np.isnan(out[1])
+
+
+def test_profile_keeps_windows_in_half_of_recordings():
+    acc = ExerciseAccumulator(n_features=2)
+    for n_windows in (3, 5, 5):
+        acc.add(np.ones((n_windows, 2)))
+    assert acc.profile().shape == (5, 2)
+
+    acc.add(np.ones((3, 2)))   # ウィンドウ 4〜5 は 4 本中 2 本 → ちょうど半分なので残る
+    assert acc.profile().shape == (5, 2)
+    acc.add(np.ones((3, 2)))   # 5 本中 2 本 → 半分未満で落ちる
+    assert acc.profile().shape == (3, 2)
+
+
+# ============================================================
+# 録画フォルダから通しで
+# ============================================================
+# 録画ごとの開始のずれ [sec]（同じ合成セッションを切り出して別の録画にする）
+RECORDING_SHIFTS = {"teacher01": 0.0, "teacher02": 1.0, "teacher03": 2.5}
+SEGMENTS = {"E00": (0.0, 3.0), "E01": (2.0, 12.0), "E02": (12.0, 21.0)}
+
+
+@pytest.fixture(scope="module")
+def teacher_dir(landmarks, fps, tmp_path_factory):
+    root = tmp_path_factory.mktemp("teacher")
+    P = np.asarray(landmarks[..., :3], dtype=np.float64)
+    rows = []
+    for name, shift in RECORDING_SHIFTS.items():
+        Pi = P[int(shift * fps):]
+        np.savez(root / f"{name}_landmarks.npz", norm=Pi, ts=np.arange(len(Pi)) / fps)
+        rows += [(name, eid, s + shift, e + shift) for eid, (s, e) in SEGMENTS.items()]
+    # 区間の無い録画はスキップされる
+    np.savez(root / "nosegments_landmarks.npz", norm=P, ts=np.arange(len(P)) / fps)
+
+    seg_path = root / "segments.csv"
+    pd.DataFrame(rows, columns=["recording", "exercise_id", "start_sec", "end_sec"]).to_csv(seg_path, index=False)
+    return root, seg_path
+
+
+def _build(teacher_dir):
+    root, seg_path = teacher_dir
+    files = sorted(str(p) for p in root.glob("*_landmarks.npz"))
+    segments = read_segments(seg_path)
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), \
+            warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        profile, timing = build_profile(files, segments)
+        per_recording = []
+        for name in RECORDING_SHIFTS:
+            with np.load(root / f"{name}_landmarks.npz") as d:
+                per_recording.append(recording_features(d["norm"], d["ts"], segments[name]))
+    return profile, timing, per_recording
+
+
+def test_profile_matches_batch_median(teacher_dir):
+    profile, _, per_recording = _build(teacher_dir)
+
+    assert sorted(profile) == ["E01", "E02"]   # E00 は時間モデルだけ
+    for eid, mat in profile.items():
+        stacked = np.stack([feats[eid] for feats in per_recording])
+        assert mat.dtype == np.float32
+        assert mat.shape == stacked.shape[1:]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            expected = np.nanmedian(stacked, axis=0)
+        np.testing.assert_array_equal(mat, expected.astype(np.float32))
+
+
+def test_timing_is_mean_from_e01_start(teacher_dir, tmp_path):
+    profile, timing, _ = _build(teacher_dir)
+
+    t0 = SEGMENTS["E01"][0]
+    expected = pd.DataFrame(
+        [{"exercise_id": eid, "mean_start_sec": s - t0, "mean_end_sec": e - t0}
+         for eid, (s, e) in sorted(SEGMENTS.items())]
+    )
+    pd.testing.assert_frame_equal(timing, expected, check_exact=False)
+
+    profile_path, timing_path = save_profile(str(tmp_path), profile, timing)
+    assert profile_path.endswith(PROFILE_NAME) and timing_path.endswith(TIMING_NAME)
+    with np.load(profile_path) as d:
+        assert sorted(d.files) == sorted(profile)
+    pd.testing.assert_frame_equal(pd.read_json(timing_path), expected,
+                                  check_exact=False, check_dtype=False)
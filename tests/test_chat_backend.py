@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# chat_backend.py / chat_routes.py：CHAT_BACKEND=stub で API を呼ばずに
+# キャッシュ・相乗り・混雑時の 503・text/event-stream の区切りを確かめる
+
+import os
+import json
+import threading
+
+os.environ["CHAT_BACKEND"] = "stub"
+
+import pytest  # noqa: E402
+from flask import Flask  # noqa: E402
+
+import chat_backend  # noqa: E402
+import chat_routes  # noqa: E402
+from chat_backend import (  # noqa: E402
+    ChatService, ResponseCache, StubBackend, ChatBusy, normalize_prompt, RETRY_AFTER_SEC,
+)
+
+# 相乗り・混雑を待つ上限 [sec]（ここまでに終わらなければ失敗）
+WAIT_SEC = 5.0
+
+
+class GatedBackend(StubBackend):
+    """gate が開くまで返答を止めておく stub（生成中の状態を作る）"""
+
+    def __init__(self):
+        super().__init__(delay_sec=0)
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def stream(self, message):
+        self.started.set()
+        assert self.gate.wait(WAIT_SEC)
+        yield from super().stream(message)
+
+
+class FailingBackend(GatedBackend):
+    """最初のトークンの後で失敗する stub（gate は開けておく）"""
+
+    def __init__(self):
+        super().__init__()
+        self.gate.set()
+
+    def stream(self, message):
+        self.calls += 1
+        self.started.set()
+        assert self.gate.wait(WAIT_SEC)
+        yield "途中まで"
+        raise RuntimeError("API エラー")
+
+
+def _service(backend=None, **kw):
+    return ChatService(backend or StubBackend(delay_sec=0), ResponseCache(size=8, ttl_sec=60), **kw)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """chat_bp だけを載せた Flask アプリ（_SERVICE はテストごとに差し替える）"""
+    monkeypatch.setattr(chat_backend, "_SERVICE", None)
+    app = Flask(__name__)
+    app.register_blueprint(chat_routes.chat_bp)
+    return app.test_client()
+
+
+def _sse_events(body):
+    """text/event-stream → [(event, data), ...]"""
+    out = []
+    for block in body.split("\n\n"):
+        if not block:
+            continue
+        event, data = "message", None
+        for line in block.split("\n"):
+            key, _, value = line.partition(": ")
+            if key == "event":
+                event = value
+            elif key == "data":
+                data = json.loads(value)
+        out.append((event, data))
+    return out
+
+
+# ============================================================
+# 正規化・キャッシュ
+# ============================================================
+def test_normalize_prompt():
+    assert normalize_prompt("肩こりに効く 体操は？") == normalize_prompt("  肩こりに効く　\n体操は?")
+    assert normalize_prompt("ＡＢＣ。") == "abc"
+
+
+def test_stub_is_selected_by_env():
+    assert chat_backend.CHAT_BACKEND == "stub"
+    assert isinstance(chat_backend.make_backend(), StubBackend)
+    with pytest.raises(ValueError):
+        chat_backend.make_backend("unknown")
+
+
+def test_cache_hit_skips_backend():
+    chat = _service()
+    first = chat.reply("肩こりに効く体操は？")
+    assert chat.backend.calls == 1
+    assert chat.reply(" 肩こりに効く体操は?") == first
+    assert chat.backend.calls == 1
+    chat.reply("腰痛に効く体操は？")
+    assert chat.backend.calls == 2
+
+
+def test_cache_ttl_and_size(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(chat_backend.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(size=2, ttl_sec=10)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"          # a を新しくする
+    cache.put("c", "C")                   # いちばん古い b を捨てる
+    assert cache.get("b") is None and len(cache) == 2
+    now[0] += 10
+    assert cache.get("a") is None and cache.get("c") is None
+
+    off = ResponseCache(size=2, ttl_sec=0)
+    off.put("a", "A")
+    assert off.get("a") is None
+
+
+# ============================================================
+# 相乗り
+# ============================================================
+def test_concurrent_same_prompt_calls_backend_once():
+    backend = GatedBackend()
+    chat = _service(backend)
+    n = 10
+    barrier = threading.Barrier(n)
+    replies = [None] * n
+
+    def ask(i):
+        barrier.wait()
+        # 同じ質問を書き方を変えて
+        replies[i] = chat.reply("肩こりに効く体操は" + "？" * (i % 3))
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    assert backend.started.wait(WAIT_SEC)
+    backend.gate.set()
+    for t in threads:
+        t.join(WAIT_SEC)
+
+    assert backend.calls == 1
+    assert len(set(replies)) == 1 and replies[0]
+
+
+def test_coalesced_reader_gets_error():
+    backend = FailingBackend()
+    backend.gate.clear()
+    chat = _service(backend)
+    a = chat.stream_reply("質問")
+    b = chat.stream_reply("質問")
+    backend.gate.set()
+    for tokens in (a, b):
+        with pytest.raises(RuntimeError):
+            list(tokens)
+    assert chat.backend.calls == 1
+    assert len(chat.cache) == 0
+
+
+# ============================================================
+# 同時実行数
+# ============================================================
+def test_busy_when_no_slot():
+    backend = GatedBackend()
+    chat = _service(backend, max_concurrency=1, queue_timeout_sec=0.01)
+    first = chat.stream_reply("質問 1")
+    with pytest.raises(ChatBusy):
+        chat.stream_reply("質問 2")
+    # 同じ質問なら枠が無くても相乗りできる
+    second = chat.stream_reply("質問 1")
+    backend.gate.set()
+    assert "".join(first) == "".join(second)
+    assert chat.reply("質問 2")
+
+
+def test_busy_returns_503(client, monkeypatch):
+    backend = GatedBackend()
+    chat = _service(backend, max_concurrency=1, queue_timeout_sec=0.01)
+    monkeypatch.setattr(chat_backend, "_SERVICE", chat)
+    tokens = chat.stream_reply("質問 1")
+    try:
+        for headers in ({}, {"Accept": "text/event-stream"}):
+            r = client.post("/chat_api", json={"message": "質問 2"}, headers=headers)
+            assert r.status_code == 503
+            assert r.headers["Retry-After"] == str(RETRY_AFTER_SEC)
+            assert "error" in r.get_json()
+    finally:
+        backend.gate.set()
+        list(tokens)
+
+
+# ============================================================
+# /chat_api の返し方
+# ============================================================
+def test_chat_api_json(client, monkeypatch):
+    monkeypatch.setattr(chat_backend, "_SERVICE", _service())
+    r = client.post("/chat_api", json={"message": "肩こりに効く体操は？"})
+    assert r.status_code == 200
+    assert r.get_json()["reply"] in StubBackend.REPLIES
+    assert client.post("/chat_api", json={"message": ""}).status_code == 400
+
+
+def test_chat_api_stream(client, monkeypatch):
+    monkeypatch.setattr(chat_backend, "_SERVICE", _service())
+    r = client.post("/chat_api", json={"message": "肩こりに効く体操は？"},
+                    headers={"Accept": "text/event-stream"})
+    assert r.status_code == 200
+    assert r.mimetype == "text/event-stream"
+    assert r.headers["Cache-Control"] == "no-cache"
+    events = _sse_events(r.get_data(as_text=True))
+    assert events[-1] == ("done", {})
+    deltas = [data["delta"] for event, data in events[:-1]]
+    assert all(event == "message" for event, _ in events[:-1]) and len(deltas) > 1
+    assert "".join(deltas) in StubBackend.REPLIES
+
+
+def test_chat_api_errors(client, monkeypatch):
+    monkeypatch.setattr(chat_backend, "_SERVICE", _service(FailingBackend()))
+    r = client.post("/chat_api", json={"message": "質問"})
+    assert r.status_code == 500 and "API エラー" in r.get_json()["error"]
+
+    r = client.post("/chat_api", json={"message": "別の質問"},
+                    headers={"Accept": "text/event-stream"})
+    assert r.status_code == 200
+    events = _sse_events(r.get_data(as_text=True))
+    assert events == [("message", {"delta": "途中まで"}), ("error", {"error": "API エラー"})]
+
+
+def test_sse_reply_framing():
+    assert list(chat_routes.sse_reply(iter(["こん", "にちは"]))) == [
+        'data: {"delta": "こん"}\n\n',
+        'data: {"delta": "にちは"}\n\n',
+        "event: done\ndata: {}\n\n",
+    ]
+
+    def broken():
+        yield "あ"
+        raise RuntimeError("切断")
+    assert list(chat_routes.sse_reply(broken())) == [
+        'data: {"delta": "あ"}\n\n',
+        'event: error\ndata: {"error": "切断"}\n\n',
+    ]
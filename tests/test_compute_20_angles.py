@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# compute_20_angles.py / motion_features.py：全フレーム一括の 20 角度が
+# 元の 1 フレームずつのループ（angle_between）とビット単位で同じか
+
+import warnings
+
+import numpy as np
+import pytest
+
+import compute_20_angles as ca
+import motion_features as mf
+
+
+def _loop_compute_20_angles(coords):
+    """元の compute_20_angles.compute_20_angles（1 フレームずつ）"""
+    ab = ca.angle_between
+    rows = []
+    for P in coords:
+        L_UP, R_UP = P[11] - P[13], P[12] - P[14]
+        L_LOW, R_LOW = P[13] - P[15], P[14] - P[16]
+        L_THI, R_THI = P[23] - P[25], P[24] - P[26]
+        L_CALF, R_CALF = P[25] - P[27], P[26] - P[28]
+        TORSO = P[11] - P[23]
+        rows.append([
+            ab(L_UP, TORSO), ab(R_UP, TORSO), ab(L_LOW, TORSO), ab(R_LOW, TORSO),
+            ab(L_THI, TORSO), ab(R_THI, TORSO), ab(L_CALF, TORSO), ab(R_CALF, TORSO),
+            ab(L_UP, L_LOW), ab(R_UP, R_LOW), ab(L_THI, L_CALF), ab(R_THI, R_CALF),
+            ab(L_UP, L_THI), ab(R_UP, R_THI), ab(L_LOW, L_CALF), ab(R_LOW, R_CALF),
+            ab(P[11] - P[23], P[13] - P[25]), ab(P[12] - P[24], P[14] - P[26]),
+            ab(P[23] - P[25], P[25] - P[27]), ab(P[24] - P[26], P[26] - P[28]),
+        ])
+    return np.array(rows)
+
+
+def _loop_motion_20_angles(coords):
+    """元の motion_features.compute_20_angles（1 フレームずつ）"""
+    ab = mf.angle_between
+    gravity = np.array([0, -1, 0], dtype=float)
+    right_axis = np.array([1, 0, 0])
+    forward_axis = np.array([0, 1, 0])
+    vals = []
+    for P in coords:
+        L_SHO, R_SHO, L_ELB, R_ELB, L_WRI, R_WRI = P[11], P[12], P[13], P[14], P[15], P[16]
+        L_HIP, R_HIP, L_KNE, R_KNE, L_ANK, R_ANK = P[23], P[24], P[25], P[26], P[27], P[28]
+        TORSO = (L_SHO + R_SHO) / 2 - (L_HIP + R_HIP) / 2
+        L_UP, R_UP = L_ELB - L_SHO, R_ELB - R_SHO
+        L_LOW, R_LOW = L_WRI - L_ELB, R_WRI - R_ELB
+        L_THI, R_THI = L_KNE - L_HIP, R_KNE - R_HIP
+        L_CALF, R_CALF = L_ANK - L_KNE, R_ANK - R_KNE
+        vals.append([
+            ab(L_UP, -TORSO), ab(R_UP, -TORSO), ab(L_UP, L_LOW), ab(R_UP, R_LOW),
+            ab(L_LOW, gravity), ab(R_LOW, gravity),
+            ab(L_THI, TORSO), ab(R_THI, TORSO), ab(L_THI, L_CALF), ab(R_THI, R_CALF),
+            ab(L_CALF, gravity), ab(R_CALF, gravity),
+            ab(TORSO, forward_axis), ab(TORSO, right_axis),
+            ab(R_SHO - L_SHO, R_HIP - L_HIP), ab(R_HIP - L_HIP, R_SHO - L_SHO),
+            ab(L_UP, right_axis), ab(R_UP, -right_axis),
+            ab(L_THI, right_axis), ab(R_THI, -right_axis),
+        ])
+    return np.array(vals)
+
+
+@pytest.fixture(scope="module")
+def coords(landmarks):
+    """float64 の座標（見失った点 NaN・重なった点を混ぜる）"""
+    P = np.array(landmarks[:600, :, :3], dtype=np.float64)
+    P[10, 13] = np.nan
+    P[20, 25] = P[20, 23]   # 長さ 0 のベクトル
+    return P
+
+
+def test_compute_20_angles_matches_loop(coords):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ref = _loop_compute_20_angles(coords)
+    df = ca.compute_20_angles(coords)
+    assert list(df.columns) == [f"angle20_{i:02d}" for i in range(20)]
+    np.testing.assert_array_equal(df.to_numpy(), ref)
+
+
+def test_motion_20_angles_matches_loop(coords):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ref = _loop_motion_20_angles(coords)
+    np.testing.assert_array_equal(mf.compute_20_angles(coords), ref)
+
+
+def test_float32_stays_float32(coords):
+    out = ca.compute_20_angles(coords.astype(np.float32)).to_numpy()
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, ca.compute_20_angles(coords).to_numpy(), rtol=0, atol=0.01)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# dtw_matcher.py：バンド付き DTW の累積コストが素直な O(n·m) の DTW と一致するか、
+# 遅れて動く生徒を教師の同じ動きに対応付けるか、道が無いときの打ち切り
+
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dtw_matcher import dtw_path, match_windows, _band_columns
+from score_student_windows import load_teacher_profile, score_features
+
+
+def _reference_cost(S, T, band):
+    """全マスの表で計算する DTW（バンド外は inf）"""
+    n, m = len(S), len(T)
+    J, _ = _band_columns(n, m, band)
+    D = np.full((n + 1, m + 1), np.inf)
+    D[0, 0] = 0.0
+    for i in range(n):
+        for j in J[i][J[i] >= 0]:
+            d = np.linalg.norm(S[i] - T[j])
+            if np.isnan(d):
+                continue
+            D[i + 1, j + 1] = d + min(D[i, j + 1], D[i + 1, j], D[i, j])
+    return D[n, m]
+
+
+@pytest.mark.parametrize("n,m,band", [(40, 40, 3), (35, 50, 4), (50, 33, 6), (20, 20, 25), (1, 5, 4)])
+def test_cost_matches_full_table(n, m, band):
+    rng = np.random.default_rng(n * 100 + m)
+    S, T = rng.normal(size=(n, 83)), rng.normal(size=(m, 83))
+    path, cost = dtw_path(S, T, band)
+    ref = _reference_cost(S, T, band)
+    assert cost == pytest.approx(ref, rel=1e-12)
+
+    # 道は (0,0) → (n-1,m-1) で 1 歩ずつ進み、コストは道の上の距離の和
+    assert path[0] == (0, 0) and path[-1] == (n - 1, m - 1)
+    steps = np.diff(np.array(path), axis=0)
+    assert np.all((steps >= 0) & (steps <= 1)) and np.all(steps.sum(axis=1) >= 1)
+    assert sum(np.linalg.norm(S[i] - T[j]) for i, j in path) == pytest.approx(cost, rel=1e-12)
+
+
+def test_delayed_student_matches_same_motion():
+    """教師の列を 3 ウィンドウ遅らせた生徒 → 生徒 i は教師 i-3 に対応"""
+    rng = np.random.default_rng(0)
+    T = np.cumsum(rng.normal(size=(60, 83)), axis=0)
+    S = np.concatenate([np.repeat(T[:1], 3, axis=0), T[:-3]])
+    J = match_windows(S, T, band=6)
+    assert len(J) == len(S)
+    np.testing.assert_array_equal(J[3:], np.arange(57))
+
+
+def test_no_path_truncates():
+    # バンドが終点まで届かない
+    S1, T5 = np.zeros((1, 83)), np.ones((5, 83))
+    assert dtw_path(S1, T5, 1) == (None, np.inf)
+    assert _reference_cost(S1, T5, 1) == np.inf
+
+    T = np.zeros((10, 83))
+    S = np.full((14, 83), np.nan)
+    np.testing.assert_array_equal(match_windows(S, T, band=2), np.arange(10))
+
+
+def test_score_features_dtw_uses_all_windows():
+    prof = load_teacher_profile(dtype="float64")
+    T = prof["E01"]
+    # 教師より長い生徒（最初の 4 ウィンドウ分止まっていた）
+    S = np.concatenate([np.repeat(T[:1], 4, axis=0), T])
+    features = {"E01": pd.DataFrame(S, columns=prof.columns)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        detail, summary, _ = score_features(features, prof, match="dtw")
+        index_detail, _, _ = score_features(features, prof, match="index")
+
+    assert len(detail) == len(S) and len(index_detail) == len(T)
+    assert detail["teacher_window_index"].iloc[-1] == len(T) - 1
+    # 遅れを吸収するので i 番目どうしより高い
+    assert summary["mean_score"].iloc[0] >= index_detail["score"].mean()
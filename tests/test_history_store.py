@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# history_store.py：旧 CSV の取り込み・自己ベストの更新・再採点での書き換え
+
+import os
+
+import pandas as pd
+import pytest
+
+from history_store import HistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path))
+
+
+def test_best_scores_upsert(store):
+    store.add_session("alice", "s1", [("E01", 70.0), ("E02", 80.0)])
+    store.add_session("alice", "s2", [("E01", 90.0), ("E02", 60.0), ("E03", float("nan"))])
+    store.add_session("bob", "s3", [("E01", 10.0)])
+
+    assert store.best_scores("alice") == {"E01": 90.0, "E02": 80.0}
+    assert store.best_scores("bob") == {"E01": 10.0}
+    # NaN は NULL として残る（自己ベストには入らない）
+    assert store.session_scores("alice", "s2") == {"E01": 90.0, "E02": 60.0, "E03": None}
+    assert store.session_ids("alice") == ["s1", "s2"]
+    assert store.previous_session("alice", "s2") == "s1"
+    assert store.previous_session("alice", "s1") is None
+
+
+def test_migrate_csv_once(tmp_path):
+    path = os.path.join(tmp_path, "carol_history.csv")
+    # 旧形式の列名（exercise_id / score）・先頭 0 の session_id
+    pd.DataFrame({
+        "session_id": ["0a1b2c", "0a1b2c", "ffee01"],
+        "exercise_id": ["E01", "E02", "E01"],
+        "score": [50.0, 60.0, 75.0],
+        "timestamp": ["2025-01-01 10:00:00", "2025-01-01 10:00:00", "2025-01-02 10:00:00"],
+    }).to_csv(path, index=False)
+
+    store = HistoryStore(str(tmp_path))
+    assert store.migrate_csv_dir() == 1
+    assert store.session_ids("carol") == ["0a1b2c", "ffee01"]
+    assert store.session_scores("carol", "0a1b2c") == {"E01": 50.0, "E02": 60.0}
+    assert store.best_scores("carol") == {"E01": 75.0, "E02": 60.0}
+
+    # 2 回目（別ワーカー・再起動）は取り込まない
+    assert HistoryStore(str(tmp_path)).migrate_csv_dir() == 0
+    assert store.session_ids("carol") == ["0a1b2c", "ffee01"]
+
+
+def test_replace_sessions(store):
+    store.add_session("alice", "s1", [("E01", 90.0)], timestamp="2025-01-01 10:00:00")
+    store.add_session("alice", "s2", [("E01", 80.0)], timestamp="2025-01-02 10:00:00")
+    # 同じ session_id の別ユーザー（書き換えない）
+    store.add_session("bob", "s1", [("E01", 30.0)])
+
+    n = store.replace_sessions([
+        ("s1", [("E01", 50.0), ("E02", 40.0)]),
+        ("guest", [("E01", 100.0)]),   # 履歴に無いセッションは数えない
+    ])
+    assert n == 1
+    assert store.session_scores("alice", "s1") == {"E01": 50.0, "E02": 40.0}
+    assert store.session_scores("bob", "s1") == {"E01": 30.0}
+    # 下がった自己ベストも集計し直す
+    assert store.best_scores("alice") == {"E01": 80.0, "E02": 40.0}
+    assert store.best_scores("bob") == {"E01": 30.0}
+    assert store.session_ids("alice") == ["s1", "s2"]
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# incremental_scoring.py / server.py の /score_session：チャンクで送った録画の
+# finish() が一括採点（ScoringPipeline.run_landmarks）と同じになるか、fps の検証
+
+import os
+import contextlib
+import io
+
+os.environ.setdefault("CHAT_BACKEND", "stub")
+os.environ.setdefault("RETENTION_INTERVAL_SEC", "0")   # 保存期間スレッドは起動しない
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+from scoring_pipeline import ScoringPipeline  # noqa: E402
+from incremental_scoring import IncrementalSession, SessionStore  # noqa: E402
+from landmark_codec import encode_landmarks, CONTENT_TYPE  # noqa: E402
+
+# index.js が送るチャンクの長さ（30fps で 3 秒）
+CHUNK_FRAMES = 90
+
+
+@pytest.fixture(scope="module")
+def pipelines():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return {
+            "threshold": ScoringPipeline(dtype="float64"),
+            "xcorr": ScoringPipeline(dtype="float64", alignment="xcorr"),
+        }
+
+
+def _feed(pipeline, landmarks, fps, finish_fps=None):
+    """チャンクに分けて送り、finish() の結果と録画中に作った体操を返す"""
+    sess = IncrementalSession(pipeline, fps)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(0, len(landmarks), CHUNK_FRAMES):
+            sess.add_frames(landmarks[i:i + CHUNK_FRAMES])
+        done = sess.done_exercises()
+        result = sess.finish(finish_fps)
+    return result, done
+
+
+def _assert_same(result, expected):
+    for key in ("detail", "summary", "part_error"):
+        pd.testing.assert_frame_equal(result[key], expected[key])
+    assert sorted(result["features"]) == sorted(expected["features"])
+    for eid, df in expected["features"].items():
+        pd.testing.assert_frame_equal(result["features"][eid], df)
+
+
+@pytest.mark.parametrize("alignment", ["threshold", "xcorr"])
+def test_chunks_match_batch(pipelines, landmarks, fps, alignment):
+    pipeline = pipelines[alignment]
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = pipeline.run_landmarks(landmarks, fps)
+    result, done = _feed(pipeline, landmarks, fps)
+
+    assert len(expected["detail"]) > 0
+    # 録画中に（仮の t0 で）特徴量を先に作っている
+    assert done
+    _assert_same(result, expected)
+
+
+def test_fps_rebuild_matches_batch(pipelines, landmarks, fps):
+    """途中の fps が実測とずれていても、finish(実測fps) で一括採点と同じになる"""
+    pipeline = pipelines["threshold"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = pipeline.run_landmarks(landmarks, fps)
+    result, _ = _feed(pipeline, landmarks, fps * 0.8, finish_fps=fps)
+    _assert_same(result, expected)
+
+
+def test_needs_rebuild(pipelines):
+    sess = IncrementalSession(pipelines["threshold"], 30.0)
+    assert not sess.needs_rebuild(30.3)
+    assert sess.needs_rebuild(25.0)
+
+
+def test_session_store_expires(pipelines, monkeypatch):
+    store = SessionStore(ttl_sec=60)
+    sid = store.create(pipelines["threshold"], fps=30.0)
+    assert store.get(sid) is not None
+
+    other = store.create(pipelines["threshold"], fps=30.0)
+    store.get(other).last_access -= 120
+    assert store.get(other) is None
+
+    assert store.pop(sid) is not None
+    assert store.pop(sid) is None
+
+
+# ============================================================
+# /score_session エンドポイント
+# ============================================================
+@pytest.fixture
+def client(pipelines, monkeypatch, tmp_path):
+    import server
+    monkeypatch.setattr(server, "get_pipeline", lambda: pipelines["threshold"])
+    monkeypatch.setattr(server, "RESULTS_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "SESSIONS", SessionStore())
+    server.app.config["TESTING"] = True
+    return server.app.test_client()
+
+
+@pytest.mark.parametrize("fps_value", ["abc", 0, -30, float("inf"), True, [30]])
+def test_start_rejects_bad_fps(client, fps_value):
+    resp = client.post("/score_session", json={"fps": fps_value})
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("body", [{}, {"fps": None}, {"fps": "29.97"}])
+def test_start_accepts_fps(client, body):
+    resp = client.post("/score_session", json=body)
+    assert resp.status_code == 200
+    assert resp.get_json()["session_id"]
+
+
+def test_session_endpoints(client, landmarks, fps, pipelines, tmp_path):
+    sid = client.post("/score_session", json={"fps": fps}).get_json()["session_id"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(0, len(landmarks), CHUNK_FRAMES):
+            resp = client.post(f"/score_session/{sid}/chunk",
+                               data=encode_landmarks(landmarks[i:i + CHUNK_FRAMES], fps),
+                               content_type=CONTENT_TYPE)
+            assert resp.status_code == 200
+
+        # fps が不正なら 400 で、セッションは残る（送り直せる）
+        for bad in ("abc", 0, -1):
+            assert client.post(f"/score_session/{sid}/finish", json={"fps": bad}).status_code == 400
+
+        resp = client.post(f"/score_session/{sid}/finish", json={"fps": fps},
+                           headers={"Accept": "application/json"})
+    assert resp.status_code == 202
+    assert resp.get_json()["job_id"] == sid
+    assert os.path.isdir(tmp_path / f"student_{sid}")
+
+    # 終わったセッションには送れない
+    assert client.post(f"/score_session/{sid}/finish", json={}).status_code == 404
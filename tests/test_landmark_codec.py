@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# landmark_codec.py：バイナリ形式の往復・不正な形式・int16 量子化の採点への影響
+
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from landmark_codec import encode_landmarks, decode_landmarks, HEADER, QUANT_SCALE
+from scoring_pipeline import ScoringPipeline
+
+# int16 量子化と float32 の許容差
+#   特徴量: |q - f| / (|f| + 1)（分散は度² なので相対誤差で見る）
+#   スコア: ウィンドウごと・体操ごとの平均（100 点満点）
+QUANT_FEATURE_TOL = 0.05
+QUANT_WINDOW_SCORE_TOL = 0.1
+QUANT_MEAN_SCORE_TOL = 0.01
+
+
+def test_float32_roundtrip(landmarks, fps):
+    arr, got_fps = decode_landmarks(encode_landmarks(landmarks, fps))
+    assert got_fps == fps
+    np.testing.assert_array_equal(arr, landmarks)
+
+
+def test_int16_roundtrip(landmarks, fps):
+    src = np.array(landmarks)
+    src[0, 0, :3] = np.nan
+    arr, _ = decode_landmarks(encode_landmarks(src, fps, quantize=True))
+    assert arr.dtype == np.float32 and arr.shape == src.shape
+    assert np.isnan(arr[0, 0, :3]).all()
+    np.testing.assert_allclose(arr[..., :3], src[..., :3], atol=0.5 / QUANT_SCALE + 1e-7)
+    np.testing.assert_allclose(arr[..., 3], src[..., 3], atol=0.5 / 255 + 1e-7)
+
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_rejects_other_landmark_counts(quantize):
+    body = encode_landmarks(np.zeros((5, 17, 4), dtype=np.float32), quantize=quantize)
+    with pytest.raises(ValueError, match="33"):
+        decode_landmarks(body)
+
+
+def test_rejects_broken_body(landmarks, fps):
+    body = encode_landmarks(landmarks[:10], fps)
+    with pytest.raises(ValueError):
+        decode_landmarks(body[:HEADER.size - 1])
+    with pytest.raises(ValueError):
+        decode_landmarks(b"XXXX" + body[4:])
+    with pytest.raises(ValueError):
+        decode_landmarks(body[:-1])
+
+
+def test_quantized_scores_match_float32(landmarks, fps):
+    """int16 量子化経由と float32 経由で特徴量・スコアを比べる"""
+    f32, _ = decode_landmarks(encode_landmarks(landmarks, fps))
+    q16, _ = decode_landmarks(encode_landmarks(landmarks, fps, quantize=True))
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline = ScoringPipeline()
+        rf = pipeline.run_landmarks(f32, fps)
+        rq = pipeline.run_landmarks(q16, fps)
+
+    assert rq["features"].keys() == rf["features"].keys()
+    for eid, df in rf["features"].items():
+        a, b = rq["features"][eid].values, df.values
+        assert a.shape == b.shape, eid
+        np.testing.assert_array_equal(np.isnan(a), np.isnan(b))
+        with np.errstate(invalid="ignore"):
+            assert np.nanmax(np.abs(a - b) / (np.abs(b) + 1), initial=0.0) <= QUANT_FEATURE_TOL, eid
+
+    assert len(rq["detail"]) == len(rf["detail"]) > 0
+    np.testing.assert_allclose(rq["detail"]["score"].values, rf["detail"]["score"].values,
+                               rtol=0, atol=QUANT_WINDOW_SCORE_TOL)
+    np.testing.assert_allclose(rq["summary"]["mean_score"].values, rf["summary"]["mean_score"].values,
+                               rtol=0, atol=QUANT_MEAN_SCORE_TOL)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# make_student_window_features.py：体操ごとに一括で作った特徴量が、元の
+# create_windows + extract_features（1 ウィンドウずつ）と同じになるか
+
+import contextlib
+import io
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from compute_20_angles import compute_20_angles
+from motion_features import extract_features, FEATURE_COLUMNS
+from utils_pose import compute_basic_angles
+from make_student_window_features import (
+    make_window_features, create_windows, detect_start_t0, E_TIMES, WIN, HOP,
+)
+
+# 累積和で求めた統計と窓ごとに足し直した統計の許容差（test_motion_features と同じ）
+PER_WINDOW_TOL = 1e-8
+
+# 特徴量 CSV を読み直して採点したときのスコア・部位誤差の許容差（相対）
+CSV_ROUND_TRIP_TOL = 1e-12
+
+
+@pytest.fixture(scope="module")
+def session(landmarks, fps):
+    P = np.asarray(landmarks[..., :3], dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        angles8 = compute_basic_angles(P)
+    return P, angles8, np.arange(len(P)) / fps
+
+
+def _reference(P, angles8, ts):
+    """元の make_student_window_features.main の E01〜E13 ループ"""
+    t0 = detect_start_t0(angles8, fps=(len(ts) - 1) / (ts[-1] - ts[0]))
+    t_norm = ts - t0
+    angle20_df = compute_20_angles(P)
+    out = {}
+    for eid, se in E_TIMES.items():
+        idx = np.where((t_norm >= se["start"]) & (t_norm < se["end"]))[0]
+        if len(idx) < WIN:
+            continue
+        A = angle20_df.iloc[idx].to_numpy()
+        L = P[idx]
+        rows = [extract_features(wL, wA)
+                for wA, wL in zip(create_windows(A, WIN, HOP), create_windows(L, WIN, HOP))]
+        out[eid] = pd.DataFrame(rows)
+    return out
+
+
+def test_matches_per_window_loop(session):
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ref = _reference(*session)
+        features = make_window_features(*session)
+
+    assert list(features) == list(ref) and len(ref) > 0
+    for eid, df in features.items():
+        assert list(df.columns) == FEATURE_COLUMNS == list(ref[eid].columns)
+        assert df.shape == ref[eid].shape, eid
+        a, b = df.to_numpy(), ref[eid].to_numpy()
+        np.testing.assert_array_equal(np.isnan(a), np.isnan(b))
+        assert np.nanmax(np.abs(a - b) / (np.abs(b) + 1)) <= PER_WINDOW_TOL, eid
+
+
+# ============================================================
+# CLI：特徴量をメモリのまま採点（--score-outdir）
+# ============================================================
+def _run(main, monkeypatch, *argv):
+    monkeypatch.setattr("sys.argv", ["prog", *map(str, argv)])
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        main()
+
+
+@pytest.mark.parametrize("fmt", ["npz", "csv"])
+def test_cli_in_memory_scores_match_file_round_trip(session, tmp_path, monkeypatch, fmt):
+    """
+    --score-outdir の結果が、保存した特徴量を score_student_windows で採点した結果と同じ
+    （npz はビット単位で同じ。CSV は read_csv の 10 進 → 2 進変換で最後の桁がずれるので許容差つき）
+    """
+    import make_student_window_features as mswf
+    import score_student_windows as ssw
+
+    P, angles8, ts = session
+    indir = tmp_path / "in"
+    indir.mkdir()
+    np.savez(indir / "s1_landmarks.npz", norm=P, angles=angles8, ts=ts)
+
+    _run(mswf.main, monkeypatch, "--indir", indir, "--outdir", tmp_path / "feat",
+         "--format", fmt, "--score-outdir", tmp_path / "mem")
+    feat = tmp_path / "feat" / ("s1_features.npz" if fmt == "npz" else "")
+    _run(ssw.main, monkeypatch, "--indir", feat, "--outdir", tmp_path / "file")
+
+    for name in ("student_score_detail.csv", "student_score_summary.csv", "student_part_error.csv"):
+        mem = tmp_path / "mem" / "s1" / "results_score" / name
+        file = tmp_path / "file" / "results_score" / name
+        if fmt == "npz":
+            assert mem.read_bytes() == file.read_bytes(), name
+        else:
+            pd.testing.assert_frame_equal(pd.read_csv(mem), pd.read_csv(file), rtol=CSV_ROUND_TRIP_TOL)
+
+
+# ============================================================
+# FEATURE_WORKERS > 1（体操ごとに並列）
+# ============================================================
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parallel_features_match_serial(session, monkeypatch, executor):
+    """並列でも結果はビット単位で同じ・E 番号順のまま"""
+    import make_student_window_features as mswf
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial = make_window_features(*session)
+
+        monkeypatch.setattr(mswf, "FEATURE_WORKERS", 3)
+        monkeypatch.setattr(mswf, "FEATURE_EXECUTOR", executor)
+        monkeypatch.setattr(mswf, "_EXECUTOR", None)
+        try:
+            parallel = make_window_features(*session)
+            assert mswf._EXECUTOR is not None
+        finally:
+            if mswf._EXECUTOR is not None:
+                mswf._EXECUTOR.shutdown()
+
+    assert list(parallel) == list(serial) and len(serial) > 1
+    for eid, df in serial.items():
+        pd.testing.assert_frame_equal(parallel[eid], df, check_exact=True)
+
+
+def test_unknown_executor(monkeypatch):
+    import make_student_window_features as mswf
+    monkeypatch.setattr(mswf, "FEATURE_EXECUTOR", "gpu")
+    monkeypatch.setattr(mswf, "_EXECUTOR", None)
+    with pytest.raises(ValueError):
+        mswf._get_executor()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# metrics.py / server.py の /metrics：段階の時間・失敗数・ワーカーからの取り込み・
+# Prometheus テキスト形式
+# （集計はプロセス共通なので、前後の差で確かめる）
+
+import os
+
+os.environ.setdefault("CHAT_BACKEND", "stub")
+os.environ.setdefault("RETENTION_INTERVAL_SEC", "0")   # 保存期間スレッドは起動しない
+
+import pytest  # noqa: E402
+
+import metrics  # noqa: E402
+
+
+def _value(name, **labels):
+    """render() の出力から 1 行の値を引く（無ければ 0）"""
+    key = name + metrics._labels(tuple(labels.items()))
+    for line in metrics.render().splitlines():
+        if not line.startswith("#") and line.rsplit(" ", 1)[0] == key:
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+STAGE = f"{metrics.PREFIX}_stage_seconds"
+FAIL = f"{metrics.PREFIX}_stage_failures_total"
+
+
+def test_timer_counts_and_failures():
+    n0 = _value(f"{STAGE}_count", stage="test_ok")
+    f0 = _value(FAIL, stage="test_fail")
+
+    with metrics.timer("test_ok"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timer("test_fail"):
+            raise ValueError
+
+    assert _value(f"{STAGE}_count", stage="test_ok") == n0 + 1
+    assert _value(f"{STAGE}_count", stage="test_fail") >= 1
+    assert _value(FAIL, stage="test_fail") == f0 + 1
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics.observe_stage("test_hist", 0.03)
+    assert _value(f"{STAGE}_bucket", stage="test_hist", le="0.025") == 0
+    assert _value(f"{STAGE}_bucket", stage="test_hist", le="0.05") == 1
+    assert _value(f"{STAGE}_bucket", stage="test_hist", le="60.0") == 1
+    assert _value(f"{STAGE}_bucket", stage="test_hist", le="+Inf") == 1
+    assert _value(f"{STAGE}_sum", stage="test_hist") == 0.03
+
+
+def test_capture_and_replay():
+    name = f"{metrics.PREFIX}_windows_total"
+    w0 = _value(name, exercise="T01")
+    with metrics.capture() as events:
+        metrics.count_windows("T01", 7)
+        # capture 中は集計に入らない（ワーカープロセスで溜めて返す）
+        assert _value(name, exercise="T01") == w0
+    assert len(events) == 1
+
+    metrics.replay(events)
+    assert _value(name, exercise="T01") == w0 + 7
+
+
+def test_label_escaping():
+    assert metrics._labels((("stage", 'a"b\\c\nd'),)) == '{stage="a\\"b\\\\c\\nd"}'
+
+
+def test_metrics_endpoint():
+    import server
+    server.app.config["TESTING"] = True
+    resp = server.app.test_client().get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"] == metrics.CONTENT_TYPE
+    text = resp.get_data(as_text=True)
+    assert f"# TYPE {metrics.PREFIX}_scoring_queue_depth gauge" in text
+    assert f"# TYPE {STAGE} histogram" in text
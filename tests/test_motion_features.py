@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# motion_features.py：逐次版（WindowFeatureStream）が一括版（extract_window_features）と
+# ビット単位で一致するか、窓ごとの calc_* と丸め誤差の範囲で一致するか
+
+import warnings
+
+import numpy as np
+import pytest
+
+from compute_20_angles import compute_20_angles
+from motion_features import (
+    extract_window_features, extract_features, WindowFeatureStream, FEATURE_COLUMNS,
+)
+
+# 累積和の差で求めた統計と、窓ごとに足し直した calc_* との許容差 |a - b| / (|b| + 1)
+PER_WINDOW_TOL = 1e-8
+
+
+@pytest.fixture(scope="module")
+def inputs(landmarks):
+    P = np.asarray(landmarks[:600, :, :3], dtype=np.float64)
+    A = compute_20_angles(P).to_numpy().copy()
+    A[np.random.default_rng(0).random(A.shape) < 0.02] = np.nan
+    return P, A
+
+
+def _stream(P, A, win, hop, sizes):
+    """sizes のフレーム数ずつ push して (窓の終わり, 特徴量) を集める"""
+    stream = WindowFeatureStream(win, hop)
+    pelvis = (P[:, 23] + P[:, 24]) / 2
+    ends, out = [], []
+    s = 0
+    for k in sizes:
+        for end, vec in stream.push(A[s:s + k], pelvis[s:s + k]):
+            ends.append(end)
+            out.append(vec)
+        s += k
+        if s >= len(P):
+            break
+    return ends, np.array(out).reshape(-1, len(FEATURE_COLUMNS))
+
+
+@pytest.mark.parametrize("win,hop", [(30, 15), (30, 7), (30, 40), (17, 5), (30, 30)])
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_stream_matches_batch(inputs, win, hop, dtype):
+    P, A = (x.astype(dtype) for x in inputs)
+    rng = np.random.default_rng(win * 100 + hop)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ref = extract_window_features(P, A, win, hop)
+        ends, X = _stream(P, A, win, hop, rng.integers(1, 45, size=len(P)))
+
+    assert ends == [win + i * hop for i in range(len(ref))]
+    assert X.dtype == ref.dtype
+    np.testing.assert_array_equal(X, ref)
+
+
+def test_stream_one_frame_at_a_time(inputs):
+    P, A = inputs
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ref = extract_window_features(P, A, 30, 15)
+        _, X = _stream(P, A, 30, 15, [1] * len(P))
+    np.testing.assert_array_equal(X, ref)
+
+
+def test_matches_per_window_stats(inputs):
+    P, A = inputs
+    win, hop = 30, 15
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        X = extract_window_features(P, A, win, hop)
+        feats = [extract_features(P[s:s + win], A[s:s + win]) for s in range(0, len(A) - win + 1, hop)]
+    ref = np.array([[f[c] for c in FEATURE_COLUMNS] for f in feats])
+    np.testing.assert_array_equal(np.isnan(X), np.isnan(ref))
+    assert np.nanmax(np.abs(X - ref) / (np.abs(ref) + 1)) <= PER_WINDOW_TOL
+
+
+def test_stream_all_nan_gap(inputs):
+    """角度を見失った区間（窓がまるごと NaN）でも一括版と同じ"""
+    P, A = inputs
+    A = A.copy()
+    A[100:200] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ref = extract_window_features(P, A, 30, 15)
+        _, X = _stream(P, A, 30, 15, [15] * (len(P) // 15))
+    assert np.isnan(ref[8, 0]) and ref[8, 3] == 0.0
+    np.testing.assert_array_equal(X, ref)
+
+
+@pytest.mark.parametrize("win,hop", [(0, 15), (30, 0), (-1, 1)])
+def test_stream_rejects_bad_config(win, hop):
+    with pytest.raises(ValueError):
+        WindowFeatureStream(win, hop)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# rescore_sessions.py：保存済みセッションの一括再採点・チェックポイントからの再開・
+# 失敗の記録・履歴の書き換え
+
+import contextlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scoring_pipeline import ScoringPipeline
+from session_artifact import save_artifact, artifact_path, scores_path, load_tables
+from history_store import get_history_store
+from rescore_sessions import rescore_all
+
+SIDS = ["aaa001", "aaa002"]
+
+
+@pytest.fixture(scope="module")
+def result(landmarks, fps):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ScoringPipeline(dtype="float64").run_landmarks(landmarks, fps)
+
+
+@pytest.fixture
+def dirs(tmp_path, result, landmarks, fps):
+    results_dir = tmp_path / "results"
+    for sid in SIDS:
+        save_artifact(str(results_dir / f"student_{sid}"), result, landmarks, fps)
+    broken = results_dir / "student_bad001"
+    broken.mkdir()
+    (broken / "session_artifact.npz").write_bytes(b"not a zip")
+
+    history_dir = tmp_path / "history"
+    store = get_history_store(str(history_dir))
+    # 古い採点のスコア（再採点で書き換わる）
+    store.add_session("alice", SIDS[0], [("E01", 1.0)])
+    return {"results_dir": str(results_dir), "history_dir": str(history_dir),
+            "rescore_dir": str(tmp_path / "rescore")}, store
+
+
+def _rescore(dirs, **kw):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return rescore_all(workers=1, version="t1", dtype="float64", **dirs, **kw)
+
+
+def test_rescore_and_resume(dirs, result):
+    d, store = dirs
+    stats = _rescore(d)
+    assert (stats["total"], stats["scored"], stats["failed"], stats["skipped"]) == (3, 2, 1, 0)
+    assert stats["history"] == 1   # ゲストのセッションは履歴に無い
+
+    # 同じ設定・保存済み特徴量からの再採点は元の結果と同じ
+    for sid in SIDS:
+        student_dir = os.path.join(d["results_dir"], f"student_{sid}")
+        tables = load_tables(scores_path(student_dir, "t1"), ["summary", "detail"])
+        pd.testing.assert_frame_equal(tables["summary"], result["summary"], check_exact=True)
+        pd.testing.assert_frame_equal(tables["detail"], result["detail"], check_exact=True)
+        assert os.path.exists(artifact_path(student_dir))
+
+    expected = dict(zip(result["summary"]["exercise"], result["summary"]["mean_score"]))
+    assert store.session_scores("alice", SIDS[0]) == expected
+
+    with open(os.path.join(d["rescore_dir"], "t1", "errors.txt"), encoding="utf-8") as f:
+        assert f.read().startswith("bad001\t")
+
+    # 再開: 終わったセッションは飛ばし、失敗したものだけやり直す
+    stats = _rescore(d)
+    assert (stats["scored"], stats["failed"], stats["skipped"]) == (0, 1, 2)
+
+    # --restart は最初から
+    stats = _rescore(d, restart=True)
+    assert (stats["scored"], stats["failed"], stats["skipped"]) == (2, 1, 0)
+
+
+def test_version_follows_settings(dirs):
+    d, _ = dirs
+    with contextlib.redirect_stdout(io.StringIO()):
+        v_index = rescore_all(workers=1, match="index", dtype="float64",
+                              results_dir=os.path.join(d["rescore_dir"], "none"),
+                              history_dir=d["history_dir"], rescore_dir=d["rescore_dir"])["version"]
+        v_dtw = rescore_all(workers=1, match="dtw", dtype="float64",
+                            results_dir=os.path.join(d["rescore_dir"], "none"),
+                            history_dir=d["history_dir"], rescore_dir=d["rescore_dir"])["version"]
+    assert v_index != v_dtw and len(v_index) == 10
+
+
+def test_from_landmarks_within_quantization_bound(dirs, result):
+    """int16 の landmarks から作り直した特徴量のスコアは保存時と許容差内（session_artifact.py 参照）"""
+    d, _ = dirs
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = rescore_all(workers=1, version="t2", dtype="float64", from_landmarks=True, **d)
+    assert stats["scored"] == 2
+
+    student_dir = os.path.join(d["results_dir"], f"student_{SIDS[0]}")
+    summary = load_tables(scores_path(student_dir, "t2"), ["summary"])["summary"]
+    assert list(summary["exercise"]) == list(result["summary"]["exercise"])
+    np.testing.assert_allclose(summary["mean_score"], result["summary"]["mean_score"], rtol=0, atol=0.01)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# result_retention.py：TTL・容量上限で landmarks だけを消し、採点結果は残すか。
+# ロックを別のワーカーが持っているあいだは何もしないか
+
+import fcntl
+import os
+import time
+
+from result_retention import run_retention, _run_locked, LOCK_NAME
+from session_artifact import save_artifact, read_meta, load_landmarks, artifact_path
+
+DAY = 24 * 3600
+
+
+def _session(results_dir, name, landmarks, fps, created_at):
+    student_dir = os.path.join(results_dir, f"student_{name}")
+    os.makedirs(student_dir)
+    save_artifact(student_dir, {}, landmarks, fps, created_at=created_at)
+    return artifact_path(student_dir)
+
+
+def test_ttl_strips_old_landmarks(landmarks, fps, tmp_path):
+    now = time.time()
+    old = _session(str(tmp_path), "old", landmarks, fps, now - 20 * DAY)
+    new = _session(str(tmp_path), "new", landmarks, fps, now - 1 * DAY)
+
+    stats = run_retention(str(tmp_path), ttl_days=14, budget_mb=1024, now=now)
+
+    assert stats["stripped"] == 1 and stats["freed_bytes"] > 0
+    assert load_landmarks(old) == (None, fps)
+    assert read_meta(new)["has_landmarks"]
+
+
+def test_budget_strips_oldest_first(landmarks, fps, tmp_path):
+    now = time.time()
+    paths = [_session(str(tmp_path), f"s{i}", landmarks, fps, now - (3 - i) * 3600) for i in range(3)]
+    # いちばん古い 1 つを消せば収まる上限
+    budget_mb = (os.path.getsize(paths[1]) + os.path.getsize(paths[2]) + 4096) / (1024 * 1024)
+
+    stats = run_retention(str(tmp_path), ttl_days=14, budget_mb=budget_mb, now=now)
+
+    assert stats["stripped"] == 1
+    assert [read_meta(p)["has_landmarks"] for p in paths] == [False, True, True]
+
+
+def test_removes_stale_dir_without_result(tmp_path):
+    stale = tmp_path / "student_failed"
+    stale.mkdir()
+    (stale / "landmarks.npy").write_bytes(b"\0" * 16)
+
+    stats = run_retention(str(tmp_path), ttl_days=14, now=time.time() + 20 * DAY)
+
+    assert stats["removed"] == 1
+    assert not stale.exists()
+
+
+def test_locked_run_skips_while_other_worker_holds_lock(landmarks, fps, tmp_path):
+    _session(str(tmp_path), "old", landmarks, fps, time.time() - 20 * DAY)
+
+    # 別のワーカーが実行中（別のファイル記述子でロックを持っている）
+    with open(tmp_path / LOCK_NAME, "w") as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert _run_locked(str(tmp_path)) is None
+        fcntl.flock(other, fcntl.LOCK_UN)
+
+    # ロックが空けば実行され、終わったらロックを放している
+    stats = _run_locked(str(tmp_path))
+    assert stats is not None and stats["stripped"] == 1
+    with open(tmp_path / LOCK_NAME, "w") as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# result_routes.py：/result/<student_id> の ETag / 304 と表示用データのキャッシュ
+
+import os
+
+os.environ.setdefault("CHAT_BACKEND", "stub")
+os.environ.setdefault("RETENTION_INTERVAL_SEC", "0")   # 保存期間スレッドは起動しない
+
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+import result_routes  # noqa: E402
+from session_artifact import save_artifact, save_scores_version  # noqa: E402
+
+SID = "abc123"
+
+
+def _result(scores):
+    eids = [f"E{i:02d}" for i in range(1, len(scores) + 1)]
+    return {
+        "summary": pd.DataFrame({"exercise": eids, "mean_score": scores}),
+        "part_error": pd.DataFrame({
+            "exercise": [e for e in eids for _ in range(2)],
+            "part": ["肩", "膝"] * len(eids),
+            "mean_abs_error": [float(i) for i in range(2 * len(eids))],
+        }),
+    }
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    import server
+    monkeypatch.setattr(result_routes, "RESULTS_DIR", str(tmp_path))
+    monkeypatch.setattr(result_routes, "_VIEW_CACHE", result_routes.OrderedDict())
+    server.app.config["TESTING"] = True
+    save_artifact(str(tmp_path / f"student_{SID}"), _result([80.0, 40.0, 60.0, 95.0]), created_at=0)
+    return server.app.test_client()
+
+
+def test_etag_and_304(client):
+    resp = client.get(f"/result/{SID}")
+    assert resp.status_code == 200
+    etag = resp.headers["ETag"]
+    assert resp.headers["Cache-Control"] == "private, no-cache"
+    assert resp.headers["Last-Modified"]
+
+    again = client.get(f"/result/{SID}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == etag
+
+    # ETag が違えば本文を返す
+    assert client.get(f"/result/{SID}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_rescore_changes_etag(client, tmp_path):
+    first = client.get(f"/result/{SID}")
+    view = result_routes._VIEW_CACHE[SID][1]
+    assert view["low_eids"] == ["E02", "E03", "E01"]
+
+    # 再採点結果（scores_<version>.npz）ができたら作り直す
+    save_scores_version(str(tmp_path / f"student_{SID}"), "v2", _result([10.0, 90.0, 90.0, 90.0]))
+    resp = client.get(f"/result/{SID}", headers={"If-None-Match": first.headers["ETag"]})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != first.headers["ETag"]
+    assert result_routes._VIEW_CACHE[SID][1]["low_eids"][0] == "E01"
+
+
+def test_view_cache_is_bounded(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(result_routes, "RESULT_CACHE_SIZE", 2)
+    for i in range(3):
+        sid = f"lru{i}"
+        save_artifact(str(tmp_path / f"student_{sid}"), _result([50.0]), created_at=0)
+        assert client.get(f"/result/{sid}").status_code == 200
+    assert list(result_routes._VIEW_CACHE) == ["lru1", "lru2"]
+
+
+def test_missing_result(client):
+    assert client.get("/result/nosuch").status_code == 404
+
+
+def test_advice_is_deterministic(client, tmp_path):
+    body = client.get(f"/result/{SID}").data
+    advice = result_routes._VIEW_CACHE[SID][1]["exercise_advice"]
+    assert set(advice) == {"E01", "E02", "E03"}
+
+    # キャッシュが消えても（別ワーカー・追い出し）同じ文言・同じ本文
+    result_routes._VIEW_CACHE.clear()
+    assert client.get(f"/result/{SID}").data == body
+    assert result_routes._VIEW_CACHE[SID][1]["exercise_advice"] == advice
+
+    tails = {result_routes.advice_tail(f"s{i}", "E01") for i in range(50)}
+    assert tails == set(result_routes.ADVICE_TAILS)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# score_student_windows.py：一括採点（score_features）が元の 1 ウィンドウずつの採点
+# （score_window + 部位ごとのループ集計）とビット単位で同じか
+
+import contextlib
+import io
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import score_student_windows
+from scoring_pipeline import ScoringPipeline
+from score_student_windows import (
+    score_window, score_windows, score_features, row_norms, build_feature_part_map,
+    load_teacher_profile, resolve_profile_path, teacher_min_dist, TeacherProfile,
+)
+
+
+def _reference(features, path):
+    """元の score_student_windows.main の採点ループ（float32 のプロファイルをそのまま使う）"""
+    prof = np.load(path)
+    rows, part_rows = [], []
+    feature_part_map = None
+    for eid in sorted(features):
+        if eid not in prof.files:
+            continue
+        student_df = features[eid]
+        student_mat, teacher_mat = student_df.values, prof[eid]
+        if feature_part_map is None:
+            feature_part_map = build_feature_part_map(list(student_df.columns))
+
+        min_dist = np.inf
+        for i in range(len(teacher_mat) - 1):
+            min_dist = min(min_dist, np.linalg.norm(teacher_mat[i] - teacher_mat[i + 1]))
+
+        pe, pc = {}, {}
+        for i in range(min(len(teacher_mat), len(student_mat))):
+            rows.append({"exercise": eid, "window_index": i,
+                         "score": score_window(student_mat[i], teacher_mat[i], min_dist)})
+            diff = np.abs(student_mat[i] - teacher_mat[i])
+            for fi, part in feature_part_map.items():
+                pe[part] = pe.get(part, 0.0) + float(diff[fi])
+                pc[part] = pc.get(part, 0) + 1
+        part_rows += [{"exercise": eid, "part": part, "mean_abs_error": pe[part] / pc[part]}
+                      for part in pe]
+
+    detail = pd.DataFrame(rows)
+    summary = detail.groupby("exercise")["score"].mean().reset_index() \
+        .rename(columns={"score": "mean_score"})
+    return detail, summary, pd.DataFrame(part_rows)
+
+
+@pytest.fixture(scope="module")
+def features(landmarks, fps):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ScoringPipeline(dtype="float64").run_landmarks(landmarks, fps)["features"]
+
+
+def test_score_features_matches_per_window_loop(features):
+    ref_detail, ref_summary, ref_part = _reference(features, resolve_profile_path())
+    with contextlib.redirect_stdout(io.StringIO()):
+        detail, summary, part = score_features(features, load_teacher_profile(dtype="float64"))
+
+    assert len(detail) > 0
+    pd.testing.assert_frame_equal(detail, ref_detail, check_exact=True)
+    pd.testing.assert_frame_equal(summary, ref_summary, check_exact=True)
+    pd.testing.assert_frame_equal(part, ref_part, check_exact=True)
+
+
+def test_score_windows_matches_score_window():
+    rng = np.random.default_rng(0)
+    S = rng.normal(0, 3000, size=(200, 83))
+    T = rng.normal(0, 3000, size=(200, 83)).astype(np.float32).astype(np.float64)
+    S[5, 10] = np.nan
+    for min_dist in (0.0, 2500.0, np.float32(12345.6)):
+        ref = np.array([score_window(s, t, min_dist) for s, t in zip(S, T)])
+        np.testing.assert_array_equal(score_windows(S, T, min_dist), ref)
+    np.testing.assert_array_equal(row_norms(S - T), [np.linalg.norm(d) for d in S - T])
+
+
+def test_min_dist_uses_stored_dtype():
+    """float32 で保存されたプロファイルは float64 で採点しても float32 のまま最小距離を取る"""
+    path = resolve_profile_path()
+    with np.load(path) as z:
+        raw = {eid: z[eid] for eid in z.files}
+    for dtype in ("float64", "float32"):
+        prof = load_teacher_profile(path, dtype)
+        assert isinstance(prof, TeacherProfile)
+        for eid, mat in raw.items():
+            ref = min(np.linalg.norm(mat[i] - mat[i + 1]) for i in range(len(mat) - 1))
+            assert prof.min_dist[eid] == ref
+            assert prof[eid].dtype == np.dtype(dtype)
+
+
+def test_teacher_min_dist_short_profile():
+    assert teacher_min_dist(np.zeros((1, 83))) == np.inf
+    assert teacher_min_dist(np.zeros((0, 83))) == np.inf
+
+
+def test_mmap_sidecar_in_cache_dir(tmp_path, monkeypatch):
+    """TEACHER_PROFILE_MMAP=1 はキャッシュ置き場にサイドカーを書き、npz と同じ値を返す"""
+    src = tmp_path / "profile" / "teacher.npz"
+    src.parent.mkdir()
+    shutil.copy(resolve_profile_path(), src)
+    src.parent.chmod(0o555)   # プロファイルの置き場所は読み取り専用でもよい
+    cache = tmp_path / "cache"
+    monkeypatch.setattr(score_student_windows, "PROFILE_CACHE_DIR", str(cache))
+    try:
+        monkeypatch.setattr(score_student_windows, "PROFILE_MMAP", True)
+        mapped = load_teacher_profile(str(src), "float64")
+        monkeypatch.setattr(score_student_windows, "PROFILE_MMAP", False)
+        plain = load_teacher_profile(str(src), "float32")
+    finally:
+        src.parent.chmod(0o755)
+
+    assert os.listdir(src.parent) == ["teacher.npz"]
+    (sidecar,) = os.listdir(cache)
+    assert sidecar.startswith("teacher-") and ".mmap-float64-" in sidecar
+    assert sorted(mapped.files) == sorted(plain.files)
+    for eid in plain.files:
+        assert not mapped[eid].flags.writeable
+        np.testing.assert_array_equal(mapped[eid], plain[eid].astype(np.float64))
+        assert mapped.min_dist[eid] == plain.min_dist[eid]
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# scoring_jobs.py / server.py：ジョブの状態遷移・満杯時の QueueFull と 503 + Retry-After
+
+import os
+import math
+import time
+import operator
+
+os.environ.setdefault("CHAT_BACKEND", "stub")
+os.environ.setdefault("RETENTION_INTERVAL_SEC", "0")   # 保存期間スレッドは起動しない
+
+import pytest  # noqa: E402
+
+from scoring_jobs import JobQueue, QueueFull, RETRY_AFTER_SEC  # noqa: E402
+from landmark_codec import encode_landmarks, CONTENT_TYPE  # noqa: E402
+
+# ジョブが終わるのを待つ上限 [sec]（ワーカー起動で教師プロファイルを読む分を含む）
+WAIT_SEC = 60.0
+
+
+def _wait(queue, job_id):
+    deadline = time.time() + WAIT_SEC
+    while time.time() < deadline:
+        info = queue.status(job_id)
+        if info["status"] in ("done", "error"):
+            return info
+        time.sleep(0.02)
+    raise AssertionError(f"ジョブが終わりません: {job_id}")
+
+
+@pytest.fixture(scope="module")
+def queue():
+    q = JobQueue(workers=1, max_pending=1)
+    yield q
+    if q._executor is not None:
+        q._executor.shutdown()
+
+
+def test_job_lifecycle(queue):
+    done = []
+    queue.submit("add", operator.add, 2, 3, on_done=done.append)
+    assert queue.status("add")["status"] in ("queued", "running", "done")
+    info = _wait(queue, "add")
+    assert info["status"] == "done" and info["result"] == 5 and info["error"] is None
+    assert done == [5]
+    assert queue.status("unknown") is None
+
+
+def test_job_error(queue):
+    done = []
+    queue.submit("bad", math.sqrt, -1.0, on_done=done.append)
+    info = _wait(queue, "bad")
+    assert info["status"] == "error" and "math domain error" in info["error"]
+    # 失敗したジョブの後処理（履歴保存）は呼ばない
+    assert done == []
+
+
+def test_queue_full(queue):
+    queue.submit("slow", time.sleep, 0.5)
+    with pytest.raises(QueueFull):
+        queue.submit("next", operator.add, 1, 1)
+    assert queue.pending() == 1
+    _wait(queue, "slow")
+    # 終わったら受け付ける
+    queue.submit("next", operator.add, 1, 1)
+    assert _wait(queue, "next")["result"] == 2
+
+
+# ============================================================
+# /score_landmarks・/score_jobs
+# ============================================================
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    import server
+    full = JobQueue(workers=1, max_pending=0)   # 常に満杯（プールは作られない）
+    monkeypatch.setattr(server, "get_job_queue", lambda: full)
+    monkeypatch.setattr(server, "RESULTS_DIR", str(tmp_path))
+    server.app.config["TESTING"] = True
+    return server.app.test_client()
+
+
+def test_score_landmarks_busy(client, landmarks, fps, tmp_path):
+    resp = client.post("/score_landmarks", data=encode_landmarks(landmarks[:60], fps),
+                       content_type=CONTENT_TYPE, headers={"Accept": "application/json"})
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(RETRY_AFTER_SEC)
+    assert "error" in resp.get_json()
+    # 受け付けなかったジョブの結果フォルダは残さない
+    assert os.listdir(tmp_path) == []
+
+
+def test_unknown_job(client):
+    assert client.get("/score_jobs/nosuch").status_code == 404
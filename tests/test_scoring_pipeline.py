@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# scoring_pipeline.py：SCORING_DTYPE=float32 の採点が float64 と許容差内に収まるか
+
+import contextlib
+import io
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from scoring_pipeline import ScoringPipeline
+from utils_pose import preprocess_pose
+
+# float32 採点と float64 採点の許容差（100 点満点）
+DTYPE_WINDOW_SCORE_TOL = 0.1
+DTYPE_MEAN_SCORE_TOL = 0.01
+
+
+def _run(pipeline, landmarks, fps):
+    """run_landmarks の結果と、その間のピークメモリ [bytes]"""
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = pipeline.run_landmarks(landmarks, fps)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+@pytest.fixture(scope="module")
+def pipelines():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return {dtype: ScoringPipeline(dtype=dtype) for dtype in ("float64", "float32")}
+
+
+def test_float32_scores_match_float64(pipelines, landmarks, fps):
+    r64, peak64 = _run(pipelines["float64"], landmarks, fps)
+    r32, peak32 = _run(pipelines["float32"], landmarks, fps)
+
+    assert len(r32["detail"]) == len(r64["detail"]) > 0
+    np.testing.assert_allclose(r32["detail"]["score"].values, r64["detail"]["score"].values,
+                               rtol=0, atol=DTYPE_WINDOW_SCORE_TOL)
+    np.testing.assert_allclose(r32["summary"]["mean_score"].values, r64["summary"]["mean_score"].values,
+                               rtol=0, atol=DTYPE_MEAN_SCORE_TOL)
+    assert peak32 < peak64
+
+
+def test_prepare_keeps_input(pipelines, landmarks):
+    """landmarks の dtype が同じなら座標はコピーせずにビュー、入力は書き換えない"""
+    before = np.array(landmarks)
+    P, angles8 = pipelines["float32"].prepare(landmarks)
+    assert P.dtype == angles8.dtype == np.float32
+    assert np.shares_memory(P, landmarks)
+    P64, _ = pipelines["float64"].prepare(landmarks)
+    assert P64.dtype == np.float64
+    np.testing.assert_array_equal(landmarks, before)
+
+
+def test_rejects_unknown_dtype():
+    with pytest.raises(ValueError):
+        ScoringPipeline(dtype="float16")
+
+
+def test_prepare_angles_do_not_depend_on_normalize(pipelines, landmarks):
+    """正規化・マスクを飛ばしても、採点に使う angles8 はビット単位で同じ"""
+    for dtype, pipeline in pipelines.items():
+        _, angles8 = pipeline.prepare(landmarks)
+        _, full, _ = preprocess_pose(landmarks, normalize=True, mask=True, dtype=np.dtype(dtype))
+        np.testing.assert_array_equal(angles8, full)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# session_artifact.py：保存した landmarks は landmark_codec の int16 量子化と同じ値に戻る
+# （採点への影響の上限は test_landmark_codec.py::test_quantized_scores_match_float32）
+
+import numpy as np
+
+from landmark_codec import encode_landmarks, decode_landmarks, QUANT_SCALE
+from session_artifact import save_artifact, load_landmarks, strip_landmarks, read_meta
+
+
+def test_landmarks_match_codec_quantization(landmarks, fps, tmp_path):
+    path = save_artifact(str(tmp_path), {}, landmarks, fps)
+    loaded, loaded_fps = load_landmarks(path)
+    q16, _ = decode_landmarks(encode_landmarks(landmarks, fps, quantize=True))
+
+    assert loaded_fps == fps
+    np.testing.assert_array_equal(loaded, q16)
+    # 座標の誤差は量子化の刻みの半分まで
+    err = np.abs(loaded[..., :3] - landmarks[..., :3])
+    assert np.nanmax(err) <= 0.5 / QUANT_SCALE + 1e-7
+
+
+def test_strip_keeps_meta(landmarks, fps, tmp_path):
+    path = save_artifact(str(tmp_path), {}, landmarks, fps)
+    strip_landmarks(path)
+    assert load_landmarks(path) == (None, fps)
+    assert not read_meta(path)["has_landmarks"]
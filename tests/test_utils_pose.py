@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# utils_pose.py：preprocess_pose が normalize_pose / compute_basic_angles /
+# visibility_mask を別々に呼んだときと一致するか
+
+import warnings
+
+import numpy as np
+
+from utils_pose import (
+    preprocess_pose, normalize_pose, compute_basic_angles, visibility_mask, PoseBuffers, POSE_IDX,
+)
+
+# まとめた版と別々に呼んだ版の許容差（座標・角度 [度]）
+PREPROCESS_TOL = 1e-6
+
+# dtype=float32 の角度の許容差 [度]（180° 付近の arccos で 0.006° ほどずれる）
+FLOAT32_ANGLE_TOL = 0.01
+
+
+def _reference(raw):
+    raw = np.asarray(raw, dtype=float)
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return (normalize_pose(raw[..., :3])[:, POSE_IDX],
+                compute_basic_angles(raw[..., :3]),
+                visibility_mask(raw))
+
+
+def _with_gaps(landmarks):
+    """見失った点（NaN）と visibility の低いフレームを混ぜる"""
+    raw = np.array(landmarks)
+    rng = np.random.default_rng(0)
+    raw[rng.random(raw.shape[:2]) < 0.01, :3] = np.nan
+    raw[100:130, :, 3] = 0.2
+    raw[200:210, 13:, 3] = 0.0   # 33 点のうち下半分だけ見えない
+    return raw
+
+
+def test_matches_separate_calls(landmarks):
+    raw = _with_gaps(landmarks)
+    norm, angles8, mask = preprocess_pose(raw)
+    ref_norm, ref_angles, ref_mask = _reference(raw)
+
+    np.testing.assert_array_equal(np.isnan(angles8), np.isnan(ref_angles))
+    assert np.nanmax(np.abs(norm - ref_norm), initial=0.0) <= PREPROCESS_TOL
+    assert np.nanmax(np.abs(angles8 - ref_angles), initial=0.0) <= PREPROCESS_TOL
+    np.testing.assert_array_equal(mask, ref_mask)
+    assert not mask[100:130].any()
+
+
+def test_reused_buffers_and_input_untouched(landmarks):
+    raw = _with_gaps(landmarks)
+    before = raw.copy()
+    buffers = PoseBuffers()
+    _, ref_angles, _ = _reference(raw)
+    # 長い → 短いの順に使い回しても同じ結果
+    preprocess_pose(raw, buffers)
+    _, angles8, _ = preprocess_pose(raw[:500], buffers)
+    assert np.nanmax(np.abs(angles8 - ref_angles[:500]), initial=0.0) <= PREPROCESS_TOL
+    np.testing.assert_array_equal(raw, before)
+
+
+def test_skip_normalize_and_mask(landmarks):
+    norm, angles8, mask = preprocess_pose(landmarks, normalize=False, mask=False, dtype=np.float32)
+    _, ref_angles, _ = _reference(landmarks)
+    assert norm is None and mask is None
+    assert angles8.dtype == np.float32
+    assert np.nanmax(np.abs(angles8 - ref_angles), initial=0.0) <= FLOAT32_ANGLE_TOL
@@ -149,3 +149,162 @@ def visibility_mask(raw):
     vis = raw[..., 3]  # (T,33)
     m = (np.nanmean(vis, axis=-1) >= 0.5).astype(np.uint8)
     return m
+
+
+# =============================================================
+# 前処理をまとめて 1 回で（IDX の 13 点だけ・出力バッファ再利用）
+#   normalize_pose + compute_basic_angles + visibility_mask と同じ計算を、
+#   (T,33,3) の一時配列を作らずに行う
+# =============================================================
+POSE_IDX = np.array(list(IDX.values()))             # 13 点の元の index
+_POS = {lm: i for i, lm in enumerate(POSE_IDX)}      # 元の index → 13 点の中の位置
+
+# compute_basic_angles と同じ順の 3 点 (A, B, C) → ∠ABC
+_ANGLE8 = [
+    (IDX["left_elbow"],  IDX["left_shoulder"],  IDX["left_hip"]),
+    (IDX["right_elbow"], IDX["right_shoulder"], IDX["right_hip"]),
+    (IDX["left_shoulder"],  IDX["left_elbow"],  IDX["left_wrist"]),
+    (IDX["right_shoulder"], IDX["right_elbow"], IDX["right_wrist"]),
+    (IDX["left_knee"],  IDX["left_hip"],  IDX["left_shoulder"]),
+    (IDX["right_knee"], IDX["right_hip"], IDX["right_shoulder"]),
+    (IDX["left_hip"],  IDX["left_knee"],  IDX["left_ankle"]),
+    (IDX["right_hip"], IDX["right_knee"], IDX["right_ankle"]),
+]
+_ANGLE8 = [(_POS[a], _POS[b], _POS[c]) for a, b, c in _ANGLE8]
+
+
+class PoseBuffers:
+    """preprocess_pose の出力・作業用バッファ（足りなくなったら倍々で確保し直す）"""
+
+    def __init__(self, capacity=0, dtype=np.float64):
+        self.capacity = 0
+        self.dtype = np.dtype(dtype)
+        self.ensure(capacity)
+
+    def ensure(self, T, dtype=None):
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        if T <= self.capacity and dtype == self.dtype:
+            return
+        cap = max(T, 2 * self.capacity, 256)
+        n = len(POSE_IDX)
+        self.sel = np.empty((cap, n, 4), dtype=dtype)
+        self.norm = np.empty((cap, n, 3), dtype=dtype)
+        self.angles8 = np.empty((cap, 8), dtype=dtype)
+        self.mask = np.empty(cap, dtype=np.uint8)
+        self.vec = np.empty((cap, 3), dtype=dtype)
+        self.cos = np.empty(cap, dtype=dtype)
+        self.sin = np.empty(cap, dtype=dtype)
+        self.tmp1 = np.empty((cap, n), dtype=dtype)
+        self.tmp2 = np.empty((cap, n), dtype=dtype)
+        self.v1 = np.empty((cap, 8, 3), dtype=dtype)
+        self.v2 = np.empty((cap, 8, 3), dtype=dtype)
+        self.n1 = np.empty((cap, 8), dtype=dtype)
+        self.n2 = np.empty((cap, 8), dtype=dtype)
+        self.capacity = cap
+        self.dtype = dtype
+
+
+def _normalize_into(xyz, P, b):
+    """normalize_pose と同じ手順で xyz (T,13,3) → P（b の作業用バッファを使う）"""
+    T = len(xyz)
+    Lh, Rh = _POS[IDX["left_hip"]], _POS[IDX["right_hip"]]
+    Ls, Rs = _POS[IDX["left_shoulder"]], _POS[IDX["right_shoulder"]]
+
+    # ---- 1) 骨盤中心を原点へ ----
+    pc = b.vec[:T]
+    np.add(xyz[:, Lh], xyz[:, Rh], out=pc)
+    pc *= 0.5
+    np.subtract(xyz, pc[:, None, :], out=P)
+
+    # ---- 2) 肩幅で割る ----
+    d = b.vec[:T]
+    np.subtract(P[:, Ls], P[:, Rs], out=d)
+    sw = b.cos[:T]
+    np.einsum("ti,ti->t", d, d, out=sw)
+    np.sqrt(sw, out=sw)
+    sw += 1e-9
+    P /= sw[:, None, None]
+
+    # ---- 3) 肩ラインが水平になるよう Z 軸まわりに回転 ----
+    #   θ = atan2(vy, vx) → cos(-θ) = vx / r, sin(-θ) = -vy / r（r = 0 なら回さない）
+    c, s = b.cos[:T], b.sin[:T]
+    np.subtract(P[:, Rs, 0], P[:, Ls, 0], out=c)
+    np.subtract(P[:, Ls, 1], P[:, Rs, 1], out=s)
+    r = b.n1[:T, 0]
+    np.hypot(c, s, out=r)
+    zero = r == 0
+    r[zero] = 1.0
+    c[zero] = 1.0
+    c /= r
+    s /= r
+
+    x, y = P[..., 0], P[..., 1]
+    sy, sx = b.tmp1[:T], b.tmp2[:T]
+    np.multiply(y, s[:, None], out=sy)
+    np.multiply(x, s[:, None], out=sx)
+    x *= c[:, None]
+    x -= sy                 # x' = cos·x - sin·y
+    y *= c[:, None]
+    y += sx                 # y' = sin·x + cos·y
+
+
+def preprocess_pose(raw, out=None, normalize=True, mask=True, dtype=np.float64):
+    """
+    raw      : (T,33,4) または (T,33,3)（index.js が送る生座標）
+    out      : PoseBuffers（渡すと中の配列に書いて返す。次の呼び出しで上書きされる）
+    normalize: False なら正規化を飛ばす（norm は None）
+    mask     : False ならマスクを飛ばす（mask は None）
+               ※ 採点（ScoringPipeline.prepare）は教師プロファイルが生座標の角度で
+                 作られているので、どちらも使わず angles8 だけ求める
+    dtype    : 出力の dtype（float32 / float64）
+    return:
+      norm    (T,13,3) POSE_IDX の 13 点を normalize_pose と同じ手順で正規化
+      angles8 (T,8)    compute_basic_angles と同じ 8 角度（生座標から。採点は生座標の角度で
+                       作った教師プロファイルと比べるので、見失った点の NaN の広がり方も同じにする）
+      mask    (T,)     visibility_mask と同じ（33 点の visibility の平均が 0.5 以上なら 1、
+                       visibility が無ければ全部 1）
+    """
+    T, _, C = raw.shape
+    b = out if out is not None else PoseBuffers()
+    b.ensure(T, dtype)
+
+    # ---- 13 点だけ取り出す ----
+    sel = b.sel[:T, :, :C]
+    for j, lm in enumerate(POSE_IDX):
+        sel[:, j] = raw[:, lm, :C]
+    xyz = sel[..., :3]
+    P = None
+    if normalize:
+        P = b.norm[:T]
+        _normalize_into(xyz, P, b)
+
+    # ---- 8 角度 ----
+    v1, v2 = b.v1[:T], b.v2[:T]
+    for k, (a, j, e) in enumerate(_ANGLE8):
+        np.subtract(xyz[:, a], xyz[:, j], out=v1[:, k])
+        np.subtract(xyz[:, e], xyz[:, j], out=v2[:, k])
+    n1, n2, ang = b.n1[:T], b.n2[:T], b.angles8[:T]
+    np.einsum("tki,tki->tk", v1, v1, out=n1)
+    np.einsum("tki,tki->tk", v2, v2, out=n2)
+    np.sqrt(n1, out=n1)
+    np.sqrt(n2, out=n2)
+    n1 += 1e-9
+    n2 += 1e-9
+    np.einsum("tki,tki->tk", v1, v2, out=ang)
+    ang /= n1
+    ang /= n2
+    np.clip(ang, -1.0, 1.0, out=ang)
+    np.arccos(ang, out=ang)
+    np.degrees(ang, out=ang)
+
+    # ---- visibility（13 点ではなく 33 点全部の平均。visibility_mask と同じ） ----
+    m = None
+    if mask:
+        m = b.mask[:T]
+        if C >= 4:
+            with np.errstate(invalid="ignore"):
+                np.greater_equal(np.nanmean(raw[..., 3], axis=-1), 0.5, out=m, casting="unsafe")
+        else:
+            m[:] = 1
+
+    return P, ang, m